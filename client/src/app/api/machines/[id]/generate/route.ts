@@ -0,0 +1,51 @@
+import { pool } from '@/lib/pool';
+import { NextResponse } from 'next/server';
+
+// Starts a background pipeline run on the machine's latest upload and returns its runId,
+// which the dashboard subscribes to for live iterations
+export async function POST(
+	request: Request,
+	{ params }: { params: { id: string; }; }
+) {
+	try {
+		const result = await pool.query(
+			`SELECT name, metadata->>'machineId' AS "machineId" FROM machines WHERE id = $1`,
+			[params.id]
+		);
+
+		if (result.rows.length === 0) {
+			return NextResponse.json(
+				{ error: 'Machine not found' },
+				{ status: 404 }
+			);
+		}
+
+		// Machines created before machineId was recorded are filed under their name
+		const machineId = result.rows[0].machineId ?? result.rows[0].name;
+		const runId = crypto.randomUUID();
+		const dsResponse = await fetch(
+			`http://localhost:8080/api/machines/${encodeURIComponent(machineId)}/runs`,
+			{
+				method: 'POST',
+				headers: { 'Content-Type': 'application/json' },
+				body: JSON.stringify({ runId }),
+			}
+		);
+
+		const dsResult = await dsResponse.json();
+		if (!dsResponse.ok) {
+			return NextResponse.json(
+				{ error: dsResult.error || 'Failed to start model generation' },
+				{ status: dsResponse.status }
+			);
+		}
+
+		return NextResponse.json({ runId: dsResult.runId, eventsUrl: dsResult.eventsUrl }, { status: 202 });
+	} catch (error) {
+		console.error('Error starting generation:', error);
+		return NextResponse.json(
+			{ error: 'Failed to start model generation' },
+			{ status: 500 }
+		);
+	}
+}
@@ -18,11 +18,13 @@ export async function POST(request: Request) {
 		const fileContent = await file.text();
 		const jsonData = JSON.parse(fileContent);
 
-		// Process the data through your data science API
+		// Process the data through your data science API. The pipeline runs in the background
+		// (202 after the plot is rendered); the dashboard follows it live by its runId
+		const runId = crypto.randomUUID();
 		const dsResponse = await fetch('http://localhost:8080/api/datascience', {
 			method: 'POST',
 			headers: { 'Content-Type': 'application/json' },
-			body: JSON.stringify({ jsonData }),
+			body: JSON.stringify({ jsonData, background: true, runId }),
 		});
 
 		if (!dsResponse.ok) {
@@ -59,6 +61,9 @@ export async function POST(request: Request) {
 				JSON.stringify({
 					originalFileName: file.name,
 					uploadTimestamp: new Date().toISOString(),
+					runId: dsResult.runId,
+					// The server files runs, models and history under the upload's id
+					machineId: jsonData.id ?? jsonData.name,
 					dataPoints: jsonData.fields?.[0]?.nums?.length || 0,
 					fields: jsonData.fields?.map((f: any) => f.name) || []
 				})
@@ -67,7 +72,7 @@ export async function POST(request: Request) {
 
 
 
-		return NextResponse.json(result.rows[0]);
+		return NextResponse.json({ ...result.rows[0], runId: dsResult.runId });
 	} catch (error) {
 		console.error('Error creating machine:', error);
 		return NextResponse.json(
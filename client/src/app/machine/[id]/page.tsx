@@ -1,5 +1,6 @@
 "use client";
 
+import { useRunEvents } from '@/components/hooks/use-run-events';
 import { ModelIteration, ModelIterations } from '@/components/modelIterations';
 import { ArrowLeft, RefreshCw, Settings } from 'lucide-react';
 import Link from 'next/link';
@@ -38,6 +39,10 @@ interface MachineData {
 		uploadTimestamp: string;
 		dataPoints: number;
 		fields: string[];
+		// The pipeline run started by the upload
+		runId?: string;
+		// Key of the machine on the modeling server (the upload's id)
+		machineId?: string;
 	};
 }
 
@@ -48,6 +53,8 @@ export default function MachineDashboard({ params }: { params: { id: string; };
 	const [iterations, setIterations] = useState<ModelIteration[]>([]);
 	const [isGenerating, setIsGenerating] = useState(false);
 	const [currentIteration, setCurrentIteration] = useState(0);
+	const [runId, setRunId] = useState<string | null>(null);
+	const liveRun = useRunEvents(runId);
 	const MAX_ITERATIONS = 5;
 
 	const handleStartGeneration = async () => {
@@ -60,6 +67,13 @@ export default function MachineDashboard({ params }: { params: { id: string; };
 
 			if (!response.ok) throw new Error('Failed to start model generation');
 
+			// Runs that report a runId stream their iterations live (see useRunEvents)
+			const { runId: startedRunId } = await response.json().catch(() => ({}));
+			if (startedRunId) {
+				setRunId(startedRunId);
+				return;
+			}
+
 			// Poll for updates or use WebSocket for real-time updates
 			// Add new iterations as they come in
 			setIterations(prev => [...prev, {
@@ -95,6 +109,10 @@ export default function MachineDashboard({ params }: { params: { id: string; };
 			const data = await response.json();
 			setMachineData(data);
 			setError(null);
+			// Follow (or replay) the run the upload started until a new one is generated
+			if (data.metadata?.runId) {
+				setRunId(prev => prev ?? data.metadata.runId);
+			}
 
 			// If we need to fetch visualization from data science service
 			if (data.file_paths?.visualizations?.[0]?.path) {
@@ -239,9 +257,9 @@ export default function MachineDashboard({ params }: { params: { id: string; };
 							<div className="space-y-6">
 								<ModelIterations
 									machineId={params.id}
-									isGenerating={isGenerating}
-									iterations={iterations}
-									currentIteration={currentIteration}
+									isGenerating={isGenerating || liveRun.isRunning}
+									iterations={runId ? liveRun.iterations : iterations}
+									currentIteration={runId ? liveRun.iterations.length : currentIteration}
 									maxIterations={MAX_ITERATIONS}
 									onStartGeneration={handleStartGeneration}
 									originalVisualizationPath={machineData.file_paths.visualizations[0]?.path}
@@ -0,0 +1,84 @@
+import * as React from "react";
+
+import { ModelIteration } from "@/components/modelIterations";
+
+const SERVER_URL = "http://localhost:8080";
+
+interface RunEvent {
+	id: number;
+	type: string;
+	time: number;
+	data: Record<string, any>;
+}
+
+// Subscribes to a pipeline run's Server-Sent Events and folds them into iterations
+export function useRunEvents(runId: string | null) {
+	const [iterations, setIterations] = React.useState<ModelIteration[]>([]);
+	const [isRunning, setIsRunning] = React.useState(false);
+
+	React.useEffect(() => {
+		if (!runId) return;
+		setIterations([]);
+		setIsRunning(true);
+
+		const source = new EventSource(`${SERVER_URL}/api/runs/${runId}/events`);
+		const update = (index: number, changes: Partial<ModelIteration>) => {
+			setIterations(prev => {
+				const next = [...prev];
+				while (next.length <= index) {
+					next.push({
+						version: `1.${next.length}`,
+						status: "running",
+						accuracy: null,
+						visualizationPath: null,
+						modelicaCode: null,
+						timestamp: new Date().toISOString(),
+					});
+				}
+				next[index] = { ...next[index], ...changes };
+				return next;
+			});
+		};
+		const parse = (message: MessageEvent): RunEvent => JSON.parse(message.data);
+
+		source.addEventListener("stage", message => {
+			const { data } = parse(message as MessageEvent);
+			update(data.iteration, { status: "running" });
+		});
+		source.addEventListener("code", message => {
+			const { data } = parse(message as MessageEvent);
+			update(data.iteration, { modelicaCode: data.modelica_code });
+		});
+		source.addEventListener("validation", message => {
+			const { data } = parse(message as MessageEvent);
+			// A model that fails validation is never simulated; the next iteration refines it
+			if (!data.ok) {
+				update(data.iteration, { status: "failed", error: (data.errors as string[]).join("\n") });
+			}
+		});
+		source.addEventListener("simulation", message => {
+			const { data } = parse(message as MessageEvent);
+			update(data.iteration, { status: data.success ? "completed" : "failed" });
+		});
+		source.addEventListener("image", message => {
+			const { data } = parse(message as MessageEvent);
+			if (data.kind === "simulation") {
+				update(data.iteration, { visualizationPath: data.url.replace(/^\//, "") });
+			}
+		});
+		source.addEventListener("budget_exceeded", message => {
+			const { data } = parse(message as MessageEvent);
+			update(data.iteration, { status: "failed", error: data.message });
+		});
+		const finish = () => {
+			setIsRunning(false);
+			source.close();
+		};
+		source.addEventListener("run_finished", finish);
+		source.addEventListener("run_failed", finish);
+
+		return () => source.close();
+	}, [runId]);
+
+	return { iterations, isRunning };
+}
@@ -181,7 +181,7 @@ export function ModelIterations({
 
 								{/* Error Message */}
 								{iterations[selectedIteration].error && (
-									<div className="mt-4 p-3 bg-red-50 text-red-700 rounded-md">
+									<div className="mt-4 p-3 bg-red-50 text-red-700 rounded-md whitespace-pre-line">
 										{iterations[selectedIteration].error}
 									</div>
 								)}
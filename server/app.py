@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, Response, g, render_template, request, redirect, stream_with_context, url_for
 import datetime
 from datetime import date
 from werkzeug.utils import secure_filename
@@ -8,21 +8,94 @@ from pydantic import ValidationError
 from typing import List, Optional
 from flask_cors import CORS   
 from dataScience import do_datascience as process_data  # renamed to avoid naming conflict
+from dataScience import genimg
 import json
 import uuid
 from flask import send_from_directory
 from runner import run_modelica_pipeline
+import usageStore
+from logConfig import get_logger
+from artifactServing import send_artifact
+from artifactStore import artifact_store
+from batchJobs import BatchRunner, read_archive, save_upload
+from pipelineEvents import event_bus, format_sse
+from taskExecutor import get_shared_executor
+from tracing import bind, tracer
+from scheduler import PRIORITIES, scheduler
+from artifactServing import etag_cache
+from contentCache import image_cache
+from dataStats import describe, stats_cache
+from dynamicsFeatures import feature_cache
+from modelLibrary import model_library
+from rateLimiter import rate_limiter_utilization
+import simWindows
+from multiRate import MultiRateDataset
+from realtimeTwin import TwinClosed, twin_manager
+from ensemble import EnsembleRunner
+from maintenance import maintenance
+from datasetStore import dataset_store
+from sharedFrames import shared_frames
+from multiRate import to_ns
+
+logger = get_logger(__name__)
 
 # If localhost won't connect: chrome://net-internals/#sockets
 app = Flask(__name__)
 CORS(app)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'generated_graphs')
+# Served directory; rendered plots and uploads are content-addressed objects under it
+UPLOAD_FOLDER = artifact_store.root
+# Event stream server (eventServer.py) that live subscriptions are redirected to; unset
+# streams them from this process, one request thread each (fine for the dev server)
+EVENTS_URL = os.getenv("EVENTS_URL", "").rstrip("/")
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+batch_runner = BatchRunner(UPLOAD_FOLDER)
+ensemble_runner = EnsembleRunner(os.path.join(UPLOAD_FOLDER, "ensembles"))
+
+tracer.register_gauge("shared_executor", lambda: get_shared_executor().backlog())
+tracer.register_gauge("batch_executor", lambda: batch_runner.executor.backlog())
+tracer.register_gauge("sim_segments", simWindows.backlog)
+tracer.register_gauge("ensemble_samples", ensemble_runner.backlog)
+tracer.register_gauge("cpu_slots", lambda: scheduler.pools["cpu"].stats())
+tracer.register_gauge("llm_slots", lambda: scheduler.pools["llm"].stats())
+tracer.register_gauge("twins", twin_manager.stats)
+tracer.register_gauge("maintenance", maintenance.stats)
+tracer.register_gauge("dataset_store", dataset_store.stats)
+tracer.register_gauge("shared_frames", shared_frames.stats)
+tracer.register_gauge("event_streams", lambda: sum(log.subscribers for log in list(event_bus.runs.values())))
+tracer.register_cache("images", image_cache.stats)
+tracer.register_cache("etags", etag_cache.stats)
+tracer.register_cache("statistics", stats_cache.stats)
+tracer.register_cache("features", feature_cache.stats)
+tracer.register_cache("model_library", model_library.stats)
+
+
+@app.before_request
+def start_request_span():
+    # Scheduled maintenance (if MAINTENANCE_INTERVAL is set) starts with the first request in each worker
+    maintenance.ensure_started()
+    g.trace_span = tracer.start(f"http {request.endpoint}", method=request.method)
+
+
+@app.after_request
+def tag_request_span(response):
+    span = g.get('trace_span')
+    if span is not None:
+        span.set(status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def end_request_span(error):
+    span = g.pop('trace_span', None)
+    if span is not None:
+        span.end(error)
+
+
 @app.route("/api/home", methods=['GET'])
 def return_home():
     return jsonify({
@@ -32,14 +105,23 @@ def return_home():
 
 @app.route('/generated_graphs/<path:filename>')
 def serve_image(filename):
-    print(f"Serving image: {filename}")
-    print(f"Looking in directory: {UPLOAD_FOLDER}")  # Add this debug line
+    logger.debug("Serving image %s from %s", filename, UPLOAD_FOLDER)
     try:
-        return send_from_directory(UPLOAD_FOLDER, filename)
+        return send_artifact(UPLOAD_FOLDER, filename, request)
     except Exception as e:
-        print(f"Error serving file: {str(e)}")  # Add this debug line
+        logger.info("Error serving file %s: %s", filename, e)
         return str(e), 404
 
+def _invalid_windows(windows, dataset: MultiRateDataset) -> Optional[str]:
+    """Why requested simulation windows cannot run on dataset, or None if they can."""
+    if not isinstance(windows, list):
+        return 'windows must be a list of [start, stop] pairs'
+    try:
+        simWindows.parse_windows(windows, (dataset.end - dataset.start) / 1e9)
+    except ValueError as e:
+        return str(e)
+    return None
+
 @app.route("/api/datascience", methods=['POST'])
 def do_datascience():
     data = request.get_json()
@@ -49,41 +131,353 @@ def do_datascience():
             'error': 'No JSON data provided in request'
         }), 400
     
+    # Interactive by default; scripted re-fits can queue behind people with "nightly"
+    priority = data.get('priority', 'interactive')
+    if priority not in PRIORITIES:
+        return jsonify({'error': f"priority must be one of {', '.join(PRIORITIES)}"}), 400
+
+    # Optional [[start, stop], ...] in seconds from the first sample to simulate; checked
+    # against the data before anything is stored or started
+    windows = data.get('windows')
+    if windows is not None:
+        try:
+            error = _invalid_windows(windows, MultiRateDataset.from_dict(data['jsonData']))
+        except (KeyError, TypeError, ValueError) as e:
+            error = f"Invalid jsonData: {e}"
+        if error:
+            return jsonify({'error': error}), 400
+
     try:
-        # Generate unique filename
-        temp_filename = f"{uuid.uuid4()}.json"
-        file_path = os.path.join(UPLOAD_FOLDER, temp_filename)
-        
-        # Save JSON data to temporary file
-        with open(file_path, 'w') as f:
-            json.dump(data['jsonData'], f)
+        # Clients may pick the run id up front and subscribe to its events before posting
+        run_id = data.get('runId') or str(uuid.uuid4())
+        # Uploads live in the artifact store; the run references them from the start, so
+        # they and the plot outlive a pipeline that fails before pinning them to the machine
+        file_path = save_upload(data['jsonData'], refs=[("run", run_id, "upload")])
         
         # Process the data using existing function
-        df_describe, image_file_path = process_data(file_path)
-        run_modelica_pipeline(file_path)
-        
-        # Clean up - remove temporary file
-        
-        
-        return jsonify({
+        with bind(priority=priority):
+            stats, image_file_path = process_data(file_path)
+        artifact_store.ref(image_file_path, "run", run_id, "source_image")
+        result = {
             'success': True,
-            'machineData': df_describe,
-            'visualizationPath': f"/generated_graphs/{os.path.basename(image_file_path)}"  # Modified this line
+            'machineData': str(stats),
+            'statistics': stats.to_dict(),
+            'visualizationPath': artifact_store.url(image_file_path),
+            'runId': run_id,
+            'eventsUrl': url_for('run_events', run_id=run_id),
+        }
+        if data.get('background'):
+            future = get_shared_executor().submit(
+                run_modelica_pipeline, file_path, run_id, image_file_path, windows, priority
+            )
+            future.add_done_callback(
+                lambda f: f.exception() and logger.error("Run %s failed: %s", run_id, f.exception())
+            )
+            return jsonify(result), 202
 
-        })
+        run_modelica_pipeline(
+            file_path, run_id=run_id, src_img=image_file_path, windows=windows, priority=priority
+        )
+        return jsonify(result)
         
     except Exception as e:
-        # Clean up in case of error
-        print(f"Error: {e}")
-        if 'file_path' in locals():
-            try:
-                os.remove(file_path)
-            except:
-                pass
+        # The run's references expire with it (ARTIFACT_RUN_TTL)
+        logger.exception("Error processing upload")
         return jsonify({
             'error': str(e)
         }), 500
     
+@app.route("/api/datascience/batch", methods=['POST'])
+def create_batch():
+    # Either a zip archive of upload JSON files, or {"items": [jsonData, ...]}
+    try:
+        if 'archive' in request.files:
+            uploads = read_archive(request.files['archive'].read())
+            run_pipeline = request.form.get('runPipeline', 'true').lower() != 'false'
+        else:
+            data = request.get_json(silent=True) or {}
+            uploads = data.get('items')
+            run_pipeline = bool(data.get('runPipeline', True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if not uploads or not isinstance(uploads, list):
+        return jsonify({
+            'error': "Provide a non-empty 'items' list or an 'archive' zip file"
+        }), 400
+
+    batch = batch_runner.submit(uploads, run_pipeline=run_pipeline)
+    return jsonify({
+        'success': True,
+        'batchId': batch['batchId'],
+        'statusUrl': url_for('batch_status', batch_id=batch['batchId']),
+        'batch': batch,
+    }), 202
+
+@app.route("/api/datascience/batch/<batch_id>", methods=['GET'])
+def batch_status(batch_id):
+    batch = batch_runner.status(batch_id)
+    if batch is None:
+        return jsonify({'error': f"Unknown batch {batch_id}"}), 404
+    return jsonify({'success': True, 'batch': batch})
+
+@app.route("/api/runs/<run_id>/events", methods=['GET'])
+def run_events(run_id):
+    # EventSource resends the last id it saw when reconnecting
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError:
+        after = 0
+
+    if request.args.get('stream', 'true').lower() == 'false':
+        return jsonify({'success': True, 'events': event_bus.events(run_id, after)})
+    if EVENTS_URL:
+        # Served from an event loop there instead of parking one of this worker's threads
+        return redirect(f"{EVENTS_URL}/api/runs/{run_id}/events?after={after}", code=307)
+
+    def stream():
+        yield "retry: 2000\n\n"
+        for event in event_bus.subscribe(run_id, after):
+            yield format_sse(event)
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+# Real-time twins live in the worker that started them; route a machine's calls to one worker
+@app.route("/api/twins/<machine>", methods=['POST'])
+def start_twin(machine):
+    data = request.get_json(silent=True) or {}
+    columns = data.get('columns')
+    inputs = data.get('inputs')
+    if columns is not None and not isinstance(columns, list):
+        return jsonify({'error': 'columns must be a list of field names'}), 400
+    if inputs is not None and not isinstance(inputs, list):
+        return jsonify({'error': 'inputs must be a list of field names'}), 400
+    try:
+        session = twin_manager.start(machine, data.get('modelicaCode'), columns, inputs)
+        status = session.status()
+    except TwinClosed as e:
+        # Restarted or stopped by another request in the meantime
+        return jsonify({'error': str(e)}), 409
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        logger.exception("Error starting twin for %s", machine)
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'success': True, 'twin': status}), 201
+
+@app.route("/api/twins/<machine>/readings", methods=['POST'])
+def twin_readings(machine):
+    session = twin_manager.get(machine)
+    if session is None:
+        return jsonify({'error': f"No twin running for machine {machine}"}), 404
+    data = request.get_json(silent=True) or {}
+    # Same shape as an upload's jsonData: {"fields": [{"key", "name", "nums": [...]}, ...]}
+    stored = dataset_store.info(machine) if dataset_store.contains(machine) else {'name': machine, 'unit': None}
+    try:
+        # Filed under the machine in the URL whatever id, name or unit the body carries
+        dataset = MultiRateDataset.from_dict(
+            {**data, 'id': machine, 'name': stored['name'], 'unit': stored['unit']}
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f"Invalid readings: {e}"}), 400
+    # Live readings extend the machine's stored history like uploads do; fields are matched
+    # to the stored sensors by key (or label), whatever order the body lists them in
+    dataset_store.ingest(dataset)
+    try:
+        flags = session.ingest(dataset_store.conform(dataset))
+        drifting = session.status()['drifting']
+    except TwinClosed as e:
+        # Stopped, restarted or expired while this request waited for it
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'success': True, 'flags': flags, 'drifting': drifting})
+
+@app.route("/api/twins/<machine>", methods=['GET'])
+def twin_status(machine):
+    session = twin_manager.get(machine)
+    if session is None:
+        return jsonify({'error': f"No twin running for machine {machine}"}), 404
+    try:
+        status = session.status()
+    except TwinClosed:
+        return jsonify({'error': f"No twin running for machine {machine}"}), 404
+    return jsonify({'success': True, 'twin': status})
+
+@app.route("/api/twins/<machine>", methods=['DELETE'])
+def stop_twin(machine):
+    if not twin_manager.stop(machine):
+        return jsonify({'error': f"No twin running for machine {machine}"}), 404
+    return jsonify({'success': True})
+
+@app.route("/api/ensembles/<machine>", methods=['POST'])
+def create_ensemble(machine):
+    # Monte Carlo over the machine's latest model (or posted modelicaCode) on its latest upload
+    data = request.get_json(silent=True) or {}
+    code = data.get('modelicaCode')
+    if code is None:
+        model_path = artifact_store.pinned(machine, "latest_model")
+        if model_path is None:
+            return jsonify({'error': f"No generated model stored for machine {machine}"}), 404
+        with open(model_path) as f:
+            code = f.read()
+    try:
+        if any(k in data for k in ('start', 'end', 'last')):
+            # A slice of the stored history instead of the latest upload
+            if data.get('last') is not None:
+                dataset = dataset_store.last(machine, float(data['last']))
+            else:
+                dataset = dataset_store.read(machine, data.get('start'), data.get('end'))
+            if not dataset.fields:
+                return jsonify({'error': f"No data for machine {machine} in the requested range"}), 404
+        else:
+            upload_path = artifact_store.pinned(machine, "upload")
+            if upload_path is None:
+                return jsonify({'error': f"No upload stored for machine {machine}"}), 404
+            dataset = MultiRateDataset.load(upload_path)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': f"Invalid range: {e}"}), 400
+    try:
+        ensemble = ensemble_runner.submit(
+            machine,
+            code,
+            dataset,
+            samples=int(data.get('samples', 256)),
+            method=data.get('method', 'lhs'),
+            ranges=data.get('parameters'),
+            spread=float(data.get('spread', 0.2)),
+            seed=data.get('seed'),
+            windows=data.get('windows'),
+            priority=data.get('priority', 'batch'),
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'success': True,
+        'ensembleId': ensemble['ensembleId'],
+        'statusUrl': url_for('ensemble_status', ensemble_id=ensemble['ensembleId']),
+        'ensemble': ensemble,
+    }), 202
+
+@app.route("/api/ensembles/<ensemble_id>", methods=['GET'])
+def ensemble_status(ensemble_id):
+    ensemble = ensemble_runner.status(ensemble_id)
+    if ensemble is None:
+        return jsonify({'error': f"Unknown ensemble {ensemble_id}"}), 404
+    return jsonify({'success': True, 'ensemble': ensemble})
+
+
+@app.route("/api/machines/<machine>", methods=['GET'])
+def machine_info(machine):
+    try:
+        return jsonify({'success': True, 'machine': dataset_store.info(machine)})
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+
+@app.route("/api/machines/<machine>/data", methods=['GET'])
+def machine_data(machine):
+    # A time slice of the machine's history: start/end (ISO or epoch ns) or the last N seconds
+    columns = request.args.get('columns')
+    columns = columns.split(',') if columns else None
+    try:
+        if request.args.get('last'):
+            dataset = dataset_store.last(machine, float(request.args['last']), columns)
+        else:
+            start, end = request.args.get('start'), request.args.get('end')
+            dataset = dataset_store.read(
+                machine,
+                None if start is None else to_ns(int(start) if start.isdigit() else start),
+                None if end is None else to_ns(int(end) if end.isdigit() else end),
+                columns,
+            )
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': f"Invalid range: {e}"}), 400
+    if not dataset.fields:
+        return jsonify({'error': f"No data for machine {machine} in the requested range"}), 404
+    result = {
+        'success': True,
+        'range': {'start': dataset.start, 'end': dataset.end},
+        # Columnar per field: epoch milliseconds and values
+        'fields': [
+            {'column': f.name, 'label': f.label, 't': (f.t // 1_000_000).tolist(), 'v': f.v.tolist()}
+            for f in dataset.fields
+        ],
+        'statistics': describe(dataset).to_dict(),
+    }
+    if request.args.get('plot', '').lower() in ('1', 'true'):
+        with bind(machine=dataset.name):
+            result['visualizationPath'] = artifact_store.url(genimg(dataset, dataset.name, dataset.unit))
+    return jsonify(result)
+
+@app.route("/api/machines/<machine>/runs", methods=['POST'])
+def start_machine_run(machine):
+    # Re-runs the pipeline on the machine's latest upload in the background; subscribe to eventsUrl
+    data = request.get_json(silent=True) or {}
+    priority = data.get('priority', 'interactive')
+    if priority not in PRIORITIES:
+        return jsonify({'error': f"priority must be one of {', '.join(PRIORITIES)}"}), 400
+    upload_path = artifact_store.pinned(machine, "upload")
+    if upload_path is None:
+        return jsonify({'error': f"No upload stored for machine {machine}"}), 404
+    windows = data.get('windows')
+    if windows is not None:
+        error = _invalid_windows(windows, MultiRateDataset.load(upload_path))
+        if error:
+            return jsonify({'error': error}), 400
+    run_id = data.get('runId') or str(uuid.uuid4())
+    future = get_shared_executor().submit(
+        run_modelica_pipeline, upload_path, run_id, artifact_store.pinned(machine, "source_image"), windows, priority
+    )
+    future.add_done_callback(
+        lambda f: f.exception() and logger.error("Run %s failed: %s", run_id, f.exception())
+    )
+    return jsonify({'success': True, 'runId': run_id, 'eventsUrl': url_for('run_events', run_id=run_id)}), 202
+
+@app.route("/api/maintenance", methods=['GET'])
+def maintenance_status():
+    return jsonify({'success': True, 'stats': maintenance.stats(), 'machines': maintenance.state()})
+
+@app.route("/api/maintenance/run", methods=['POST'])
+def run_maintenance():
+    # Starts a pass now, outside the off-peak window
+    if not maintenance.start_pass():
+        return jsonify({'error': "A maintenance pass is already running"}), 409
+    return jsonify({'success': True, 'statusUrl': url_for('maintenance_status')}), 202
+
+
+@app.route("/api/metrics", methods=['GET'])
+def metrics():
+    # Per worker process; the pid tells gunicorn workers apart
+    result = tracer.metrics()
+    result['rateLimits'] = rate_limiter_utilization()
+    result['artifacts'] = artifact_store.stats()
+    return jsonify(result)
+
+
+@app.route("/api/usage", methods=['GET'])
+def usage_summary():
+    try:
+        rows = usageStore.aggregate(
+            group_by=request.args.get('group_by', 'model'),
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            machine_name=request.args.get('machine'),
+            session_id=request.args.get('run'),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'success': True,
+        'usage': rows,
+        'totalCost': sum(row['total_cost'] for row in rows),
+    })
 
 
 if __name__ == '__main__':
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from flask import Request, Response, send_file
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+from artifactStore import artifact_store
+from logConfig import get_logger
+
+logger = get_logger(__name__)
+
+# Variants to produce next to every rendered PNG, e.g. "webp,avif". Empty disables.
+ARTIFACT_VARIANTS = [
+    v.strip().lower() for v in os.getenv("ARTIFACT_VARIANTS", "").split(",") if v.strip()
+]
+VARIANT_MIMETYPES = {"avif": "image/avif", "webp": "image/webp"}
+# Preferred first when the client accepts several
+VARIANT_PREFERENCE = ["avif", "webp"]
+VARIANT_SAVE_OPTIONS = {"webp": {"quality": 90, "method": 4}, "avif": {"quality": 60}}
+
+ONE_YEAR = 365 * 24 * 3600
+# Names that are already content addressed (see artifactStore) never change
+CONTENT_ADDRESSED = re.compile(r"(^|/)[0-9a-f]{64}\.[a-z0-9]+$")
+
+ETAG_CACHE_ENTRIES = 4096
+
+
+def _variant_supported(fmt: str) -> bool:
+    try:
+        from PIL import features
+
+        if fmt == "avif":
+            if "avif" in features.modules and features.check_module("avif"):
+                return True
+            import pillow_avif  # noqa: F401  (plugin for Pillow < 11.2)
+
+            return True
+        return features.check_module(fmt)
+    except ImportError:
+        return False
+
+
+_supported_variants = [v for v in ARTIFACT_VARIANTS if v in VARIANT_MIMETYPES and _variant_supported(v)]
+
+
+class ETagCache:
+    """sha256 digests of artifact files, keyed by (path, mtime, size) so edits invalidate."""
+
+    def __init__(self, max_entries: int = ETAG_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def digest(self, path: str) -> str:
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            digest = self.entries.get(key)
+            if digest is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return digest
+            self.misses += 1
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with self.lock:
+            self.entries[key] = digest
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return digest
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+etag_cache = ETagCache()
+
+
+def render_variants(png_path: str) -> List[str]:
+    """
+    Writes the configured compressed variants (png_path + ".webp", ".avif") next to a
+    freshly rendered PNG. Called at render time so requests never pay for encoding.
+    """
+    if not _supported_variants:
+        return []
+    from PIL import Image
+
+    written = []
+    with Image.open(png_path) as image:
+        image.load()
+        for fmt in _supported_variants:
+            variant_path = f"{png_path}.{fmt}"
+            tmp_path = f"{variant_path}.tmp"
+            try:
+                image.save(tmp_path, format=fmt.upper(), **VARIANT_SAVE_OPTIONS.get(fmt, {}))
+                os.replace(tmp_path, variant_path)
+                written.append(variant_path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Could not write %s variant of %s: %s", fmt, png_path, e)
+    return written
+
+
+def _accepted(accept_header: str) -> Dict[str, float]:
+    accepted = {}
+    for part in accept_header.split(","):
+        fields = part.strip().split(";")
+        quality = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[fields[0].strip().lower()] = quality
+    return accepted
+
+
+def negotiate(path: str, accept_header: Optional[str]) -> Tuple[str, Optional[str]]:
+    """Picks the best existing variant of path the client accepts. Returns (path, mimetype)."""
+    if not accept_header or not path.endswith(".png"):
+        return path, None
+    accepted = _accepted(accept_header)
+    for fmt in VARIANT_PREFERENCE:
+        if accepted.get(VARIANT_MIMETYPES[fmt], 0) > 0:
+            variant_path = f"{path}.{fmt}"
+            if os.path.exists(variant_path) and os.path.getmtime(variant_path) >= os.path.getmtime(path):
+                return variant_path, VARIANT_MIMETYPES[fmt]
+    return path, None
+
+
+def send_artifact(directory: str, filename: str, request: Request) -> Response:
+    """
+    Serves a generated artifact with a strong content-hash ETag, conditional-GET (304)
+    handling, and Accept-negotiated WebP/AVIF variants.
+
+    Content-addressed names and URLs whose ?v= matches the current content are marked
+    immutable for a year; anything else must be revalidated, which is a cheap 304.
+
+    Raises:
+        werkzeug.exceptions.NotFound: If the file does not exist or escapes directory.
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+
+    # Served objects count as used for the store's LRU eviction
+    artifact_store.touch(path)
+    digest = etag_cache.digest(path)
+    served_path, mimetype = negotiate(path, request.headers.get("Accept"))
+    suffix = os.path.splitext(served_path)[1].lstrip(".")
+    version = request.args.get("v", "")
+    immutable = bool(CONTENT_ADDRESSED.search(filename)) or (
+        len(version) >= 8 and digest.startswith(version)
+    )
+
+    response = send_file(
+        served_path,
+        mimetype=mimetype,
+        etag=f"{digest[:32]}-{suffix}",
+        conditional=True,
+        max_age=ONE_YEAR if immutable else 0,
+    )
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    response.vary.add("Accept")
+    return response
@@ -0,0 +1,357 @@
+import glob
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from logConfig import get_logger
+
+logger = get_logger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARTIFACT_ROOT = os.getenv("ARTIFACT_ROOT", os.path.join(BASE_DIR, "generated_graphs"))
+# Kept outside ARTIFACT_ROOT, which is served over HTTP
+ARTIFACT_DB_PATH = os.getenv("ARTIFACT_DB_PATH", os.path.join(BASE_DIR, "artifacts.db"))
+# Total bytes of stored objects before the collector starts evicting; 0 disables the quota
+ARTIFACT_QUOTA_BYTES = int(os.getenv("ARTIFACT_QUOTA_BYTES", str(2 * 1024**3)))
+# Run and batch references expire after this long; machine references stay until replaced
+ARTIFACT_RUN_TTL = float(os.getenv("ARTIFACT_RUN_TTL", str(7 * 24 * 3600)))
+ARTIFACT_GC_INTERVAL = float(os.getenv("ARTIFACT_GC_INTERVAL", "300"))
+# Unreferenced objects younger than this are kept, so a put is never collected before its ref lands
+GC_GRACE_SECONDS = 600
+# Serving an object refreshes its last_access at most this often (per process), for LRU eviction
+TOUCH_INTERVAL = 60
+
+# A reference: (owner_kind, owner_id, role), e.g. ("run", run_id, "source_image")
+Ref = Tuple[str, str, str]
+OWNER_KINDS = ("run", "batch", "machine")
+
+
+class ArtifactStore:
+    """
+    Content-addressed files under root/objects/<ab>/<sha256>.<ext>.
+
+    Identical content is stored once, writes are atomic (temp file + os.replace) and
+    names never change meaning, so concurrent runs cannot overwrite each other's files
+    and served objects are immutable. Objects are kept alive by references from runs,
+    batches and machines in a small SQLite index; a background collector deletes unreferenced
+    objects and enforces the disk quota.
+    """
+
+    def __init__(
+        self,
+        root: str = ARTIFACT_ROOT,
+        db_path: str = ARTIFACT_DB_PATH,
+        quota_bytes: int = ARTIFACT_QUOTA_BYTES,
+        run_ttl: float = ARTIFACT_RUN_TTL,
+        gc_interval: float = ARTIFACT_GC_INTERVAL,
+    ):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.db_path = db_path
+        self.quota_bytes = quota_bytes
+        self.run_ttl = run_ttl
+        self.gc_interval = gc_interval
+        self._local = threading.local()
+        # digest -> when this process last refreshed its last_access
+        self._touched: Dict[str, float] = {}
+        self._gc_thread: Optional[threading.Thread] = None
+        self._gc_pid: Optional[int] = None
+        self._gc_lock = threading.Lock()
+
+    # ===== Index =====
+
+    def connect(self) -> sqlite3.Connection:
+        # One connection per thread (and per process after a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS objects ("
+            "digest TEXT PRIMARY KEY, ext TEXT, size INTEGER, created REAL, last_access REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS refs ("
+            "digest TEXT, owner_kind TEXT, owner_id TEXT, role TEXT, created REAL, "
+            "PRIMARY KEY (digest, owner_kind, owner_id, role))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS refs_owner ON refs (owner_kind, owner_id, role)")
+        conn.execute("CREATE INDEX IF NOT EXISTS objects_last_access ON objects (last_access)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    # ===== Paths =====
+
+    def object_path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}.{ext}")
+
+    def digest_of(self, path: str) -> str:
+        """The digest of a stored object, from its file name."""
+        return os.path.basename(path).split(".", 1)[0]
+
+    def contains(self, path: str) -> bool:
+        """Whether path is an object in this store (rather than an arbitrary file)."""
+        return os.path.abspath(path).startswith(self.objects_dir + os.sep)
+
+    def url(self, path: str, prefix: str = "/generated_graphs") -> str:
+        """URL of a stored object, relative to the served generated_graphs directory."""
+        return f"{prefix}/{os.path.relpath(path, self.root).replace(os.sep, '/')}"
+
+    # ===== Writes =====
+
+    def put_file(
+        self,
+        src: str,
+        ext: Optional[str] = None,
+        refs: Iterable[Ref] = (),
+        on_create: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """
+        Moves src into the store and returns the object's path. If identical content is
+        already stored, src is deleted instead.
+
+        Args:
+            src (str): File to store; must be on the same filesystem as the store root.
+            ext (str, optional): Extension for the object; defaults to src's extension.
+            refs (Iterable[Ref]): References to add to the object.
+            on_create (Callable, optional): Called with the path when the object is new,
+                e.g. to render variants that should live next to it.
+
+        Returns:
+            str: Absolute path of the stored object.
+        """
+        ext = (ext or os.path.splitext(src)[1].lstrip(".") or "bin").lower()
+        sha = hashlib.sha256()
+        with open(src, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        path = self.object_path(digest, ext)
+
+        now = time.time()
+        conn = self.connect()
+        # Index first: a crash before the rename leaves a row the collector cleans up
+        conn.execute(
+            "INSERT INTO objects (digest, ext, size, created, last_access) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(digest) DO UPDATE SET last_access = excluded.last_access",
+            (digest, ext, os.path.getsize(src), now, now),
+        )
+        self.add_refs(digest, refs)
+
+        if os.path.exists(path):
+            os.remove(src)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(src, path)
+            if on_create is not None:
+                on_create(path)
+        self._ensure_gc()
+        return path
+
+    def put_bytes(self, data: bytes, ext: str, refs: Iterable[Ref] = ()) -> str:
+        """Stores data atomically and returns the object's path."""
+        return self.put_file(self.write_temp(data, ext), ext, refs)
+
+    def temp_path(self, ext: str, prefix: str = "") -> str:
+        """A unique, not yet existing path in the store's temp directory (same filesystem)."""
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.tmp_dir, prefix=prefix, suffix=f".{ext}")
+        os.close(fd)
+        return path
+
+    def write_temp(self, data: bytes, ext: str) -> str:
+        path = self.temp_path(ext)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def touch(self, path: str):
+        """Marks a stored object (or a variant next to it) as just used, so LRU eviction spares it."""
+        if not self.contains(path):
+            return
+        digest, now = self.digest_of(path), time.time()
+        if now - self._touched.get(digest, 0) < TOUCH_INTERVAL:
+            return
+        if len(self._touched) > 10000:
+            self._touched.clear()
+        self._touched[digest] = now
+        self.connect().execute("UPDATE objects SET last_access = ? WHERE digest = ?", (now, digest))
+
+    # ===== References =====
+
+    def add_refs(self, path_or_digest: str, refs: Iterable[Ref]):
+        digest = self.digest_of(path_or_digest)
+        rows = [(digest, kind, owner_id, role, time.time()) for kind, owner_id, role in refs if owner_id]
+        for row in rows:
+            if row[1] not in OWNER_KINDS:
+                raise ValueError(f"Unknown owner kind {row[1]!r}; expected one of {OWNER_KINDS}")
+        if rows:
+            self.connect().executemany("INSERT OR REPLACE INTO refs VALUES (?, ?, ?, ?, ?)", rows)
+
+    def ref(self, path_or_digest: str, owner_kind: str, owner_id: Optional[str], role: str = ""):
+        """References an object from a run, batch or machine. A None owner_id is ignored."""
+        self.add_refs(path_or_digest, [(owner_kind, owner_id, role)])
+
+    def pin(self, path_or_digest: str, machine: Optional[str], role: str):
+        """Makes path the machine's current object for role, releasing the previous one."""
+        if not machine:
+            return
+        conn = self.connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "DELETE FROM refs WHERE owner_kind = 'machine' AND owner_id = ? AND role = ?",
+                (machine, role),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO refs VALUES (?, 'machine', ?, ?, ?)",
+                (self.digest_of(path_or_digest), machine, role, time.time()),
+            )
+
+    def pinned(self, machine: str, role: str) -> Optional[str]:
+        """Path of the machine's current object for role, or None."""
+        row = self.connect().execute(
+            "SELECT o.digest, o.ext FROM refs r JOIN objects o ON o.digest = r.digest "
+            "WHERE r.owner_kind = 'machine' AND r.owner_id = ? AND r.role = ?",
+            (machine, role),
+        ).fetchone()
+        return self.object_path(*row) if row else None
+
+    def machines(self, role: str) -> List[str]:
+        """Machines that have a current object for role."""
+        rows = self.connect().execute(
+            "SELECT DISTINCT owner_id FROM refs WHERE owner_kind = 'machine' AND role = ? ORDER BY owner_id",
+            (role,),
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def release(self, owner_kind: str, owner_id: str):
+        """Drops every reference held by a run, batch or machine."""
+        self.connect().execute(
+            "DELETE FROM refs WHERE owner_kind = ? AND owner_id = ?", (owner_kind, owner_id)
+        )
+
+    # ===== Collection =====
+
+    def _delete_object(self, conn: sqlite3.Connection, digest: str, ext: str, keep_pinned: bool = False) -> Optional[int]:
+        """
+        Deletes an object if, checked again under the write lock, it is still past the grace
+        period and unreferenced (only unpinned with keep_pinned). Returns the bytes freed,
+        or None if a put or a new reference got to it first.
+        """
+        refs = "owner_kind = 'machine'" if keep_pinned else "1"
+        with conn:
+            # Files are removed before the commit, so a put_file waiting on the lock finds the
+            # object gone and writes it again rather than indexing a deleted file
+            conn.execute("BEGIN IMMEDIATE")
+            still = conn.execute(
+                "SELECT 1 FROM objects WHERE digest = ? AND last_access < ? "
+                f"AND NOT EXISTS (SELECT 1 FROM refs WHERE digest = ? AND {refs})",
+                (digest, time.time() - GC_GRACE_SECONDS, digest),
+            ).fetchone()
+            if still is None:
+                return None
+            conn.execute("DELETE FROM refs WHERE digest = ?", (digest,))
+            conn.execute("DELETE FROM objects WHERE digest = ?", (digest,))
+            path = self.object_path(digest, ext)
+            freed = 0
+            # The object plus any variants rendered next to it (path + ".webp", ...)
+            for file_path in [path] + glob.glob(glob.escape(path) + ".*"):
+                try:
+                    freed += os.path.getsize(file_path)
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+        return freed
+
+    def collect(self) -> Dict[str, int]:
+        """
+        One garbage-collection pass: expires old run and batch references, deletes unreferenced
+        objects past the grace period, then evicts least recently used objects not
+        pinned by a machine until the store is under quota. Each deletion re-checks its
+        object under the write lock, so objects re-put or re-referenced meanwhile survive.
+        """
+        now = time.time()
+        conn = self.connect()
+        conn.execute(
+            "DELETE FROM refs WHERE owner_kind IN ('run', 'batch') AND created < ?", (now - self.run_ttl,)
+        )
+        deleted = freed = 0
+        unreferenced = conn.execute(
+            "SELECT digest, ext FROM objects WHERE last_access < ? "
+            "AND digest NOT IN (SELECT digest FROM refs)",
+            (now - GC_GRACE_SECONDS,),
+        ).fetchall()
+        for digest, ext in unreferenced:
+            size = self._delete_object(conn, digest, ext)
+            if size is not None:
+                freed += size
+                deleted += 1
+
+        if self.quota_bytes:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+            if total > self.quota_bytes:
+                candidates = conn.execute(
+                    "SELECT digest, ext, size FROM objects WHERE last_access < ? AND digest NOT IN "
+                    "(SELECT digest FROM refs WHERE owner_kind = 'machine') ORDER BY last_access",
+                    (now - GC_GRACE_SECONDS,),
+                ).fetchall()
+                for digest, ext, size in candidates:
+                    if total <= self.quota_bytes:
+                        break
+                    if self._delete_object(conn, digest, ext, keep_pinned=True) is None:
+                        continue
+                    freed += size
+                    total -= size
+                    deleted += 1
+                if total > self.quota_bytes:
+                    logger.warning(
+                        "Artifact store is %d bytes over quota after eviction; the rest is pinned by machines",
+                        total - self.quota_bytes,
+                    )
+
+        # Temp files left by crashed writers
+        for tmp in glob.glob(os.path.join(self.tmp_dir, "*")):
+            try:
+                if os.path.getmtime(tmp) < now - GC_GRACE_SECONDS:
+                    os.remove(tmp)
+            except OSError:
+                pass
+        if deleted:
+            logger.info("Artifact GC deleted %d objects, freed %d bytes", deleted, freed)
+        return {"deleted": deleted, "freed": freed}
+
+    def _gc_loop(self):
+        while True:
+            time.sleep(self.gc_interval)
+            try:
+                self.collect()
+            except (sqlite3.Error, OSError) as e:
+                logger.warning("Artifact GC pass failed: %s", e)
+
+    def _ensure_gc(self):
+        # Re-create the collector after a fork; threads don't survive into the child
+        if self.gc_interval <= 0 or (self._gc_thread is not None and self._gc_pid == os.getpid()):
+            return
+        with self._gc_lock:
+            if self._gc_thread is None or self._gc_pid != os.getpid():
+                self._gc_thread = threading.Thread(target=self._gc_loop, name="artifact-gc", daemon=True)
+                self._gc_pid = os.getpid()
+                self._gc_thread.start()
+
+    def stats(self) -> Dict[str, int]:
+        conn = self.connect()
+        objects, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects").fetchone()
+        refs = conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        return {"objects": objects, "bytes": size, "refs": refs, "quota_bytes": self.quota_bytes}
+
+
+artifact_store = ArtifactStore()
@@ -0,0 +1,243 @@
+import concurrent.futures
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from dataScience import do_datascience as process_data
+from artifactStore import Ref, artifact_store
+from logConfig import get_logger
+from runner import run_modelica_pipeline
+from taskExecutor import StreamingExecutor
+from scheduler import slot
+from tracing import traced
+
+logger = get_logger(__name__)
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", str((os.cpu_count() or 1) * 4)))
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", str(os.cpu_count() or 1)))
+# Batch work yields CPU and LLM slots to interactive uploads (see scheduler.py)
+BATCH_PRIORITY = "batch"
+MAX_ARCHIVE_MEMBERS = 5000
+# Seconds between rewrites of a running batch's status file; the worker running the batch
+# answers status requests from memory, so only other workers see it this late
+BATCH_STATUS_INTERVAL = float(os.getenv("BATCH_STATUS_INTERVAL", "1.0"))
+
+# Item lifecycle: queued -> ingesting -> rendering -> modeling -> done | failed
+ITEM_STATES = ("queued", "ingesting", "rendering", "modeling", "done", "failed")
+
+
+@traced("upload.store")
+def save_upload(json_data: Dict[str, Any], refs: Iterable[Ref] = ()) -> str:
+    """
+    Stores one machine's upload in the artifact store and returns its path. Identical
+    uploads share one object, which the collector deletes once no run, batch or machine
+    uses it.
+    """
+    return artifact_store.put_bytes(json.dumps(json_data).encode(), "json", refs)
+
+
+def read_archive(archive: bytes) -> List[Dict[str, Any]]:
+    """
+    Extracts every *.json member of a zip archive as one machine upload.
+
+    Raises:
+        ValueError: If the archive is not a zip file or holds too many members.
+    """
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(archive))
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Archive is not a zip file: {e}")
+    names = sorted(n for n in zf.namelist() if n.lower().endswith(".json") and not n.startswith("__MACOSX"))
+    if len(names) > MAX_ARCHIVE_MEMBERS:
+        raise ValueError(f"Archive holds {len(names)} JSON files; the limit is {MAX_ARCHIVE_MEMBERS}")
+    return [json.loads(zf.read(name)) for name in names]
+
+
+class BatchStore:
+    """
+    Batch status lives in one JSON file per batch, replaced atomically on every change,
+    so any server process can answer status requests for a batch another one is running.
+    Other background jobs (ensembles) use it with their own id field.
+    """
+
+    def __init__(self, directory: str, key: str = "batchId"):
+        self.directory = directory
+        self.key = key
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+
+    def path(self, batch_id: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}.json")
+
+    def write(self, batch: Dict[str, Any]):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(batch, f)
+        os.replace(tmp_path, self.path(batch[self.key]))
+
+    def read(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path(batch_id), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+
+class BatchRunner:
+    """
+    Fans a batch of machine uploads out over three kinds of workers:
+    ingest (threads), render (a process pool, since plotting is CPU bound and
+    serialized per process) and the Modelica pipeline (threads; LLM bound and
+    throttled by the rate limiter). Up to BATCH_CONCURRENCY items are in flight,
+    so the batch takes roughly as long as its slowest machine.
+    """
+
+    def __init__(self, upload_folder: str):
+        self.upload_folder = upload_folder
+        self.store = BatchStore(os.path.join(upload_folder, "batches"))
+        self.executor = StreamingExecutor(max_in_flight=BATCH_CONCURRENCY, name="batch")
+        self._render_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._render_pool_pid: Optional[int] = None
+        self._batches: Dict[str, Dict[str, Any]] = {}
+        # Per running batch: when its status file was last written, and the pending rewrite
+        self._written: Dict[str, float] = {}
+        self._flushes: Dict[str, threading.Timer] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def render_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        # Created lazily, per process: pools do not survive a gunicorn fork
+        with self.lock:
+            if self._render_pool is None or self._render_pool_pid != os.getpid():
+                self._render_pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=RENDER_PROCESSES,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                self._render_pool_pid = os.getpid()
+            return self._render_pool
+
+    def submit(self, uploads: List[Dict[str, Any]], run_pipeline: bool = True) -> Dict[str, Any]:
+        """Registers a batch, starts processing in the background and returns its status."""
+        batch_id = str(uuid.uuid4())
+        batch = {
+            "batchId": batch_id,
+            "status": "running",
+            "createdAt": datetime.now().isoformat(),
+            "runPipeline": run_pipeline,
+            "items": [
+                {"index": i, "name": upload.get("name") if isinstance(upload, dict) else None, "status": "queued"}
+                for i, upload in enumerate(uploads)
+            ],
+        }
+        with self.lock:
+            self._batches[batch_id] = batch
+            self.store.write(batch)
+            self._written[batch_id] = time.monotonic()
+        threading.Thread(
+            target=self._drive, args=(batch_id, uploads), name=f"batch-{batch_id[:8]}", daemon=True
+        ).start()
+        return self.status(batch_id)
+
+    def _update(self, batch_id: str, index: Optional[int] = None, **fields):
+        with self.lock:
+            batch = self._batches[batch_id]
+            target = batch if index is None else batch["items"][index]
+            target.update(fields)
+            self._persist(batch_id)
+
+    def _persist(self, batch_id: str):
+        """
+        Rewrites a batch's status file at most every BATCH_STATUS_INTERVAL seconds, so a
+        batch of n items costs O(duration) rewrites rather than O(n). Holds self.lock.
+        """
+        wait = self._written.get(batch_id, 0.0) + BATCH_STATUS_INTERVAL - time.monotonic()
+        if wait <= 0:
+            self.store.write(self._batches[batch_id])
+            self._written[batch_id] = time.monotonic()
+        elif batch_id not in self._flushes:
+            # Changes within the interval are written together once it has passed
+            timer = threading.Timer(wait, self._flush, args=(batch_id,))
+            timer.daemon = True
+            self._flushes[batch_id] = timer
+            timer.start()
+
+    def _flush(self, batch_id: str):
+        with self.lock:
+            self._flushes.pop(batch_id, None)
+            # The batch may have finished (and been written) meanwhile
+            if batch_id in self._batches:
+                self.store.write(self._batches[batch_id])
+                self._written[batch_id] = time.monotonic()
+
+    def _process_item(self, batch_id: str, index: int, upload: Dict[str, Any], run_pipeline: bool):
+        try:
+            self._update(batch_id, index, status="ingesting")
+            if not isinstance(upload, dict) or "fields" not in upload:
+                raise ValueError("Upload is missing 'fields'")
+            # The batch keeps each item's upload and plot alive until it expires, whether
+            # or not a pipeline run ever references them
+            file_path = save_upload(upload, refs=[("batch", batch_id, f"upload_{index}")])
+
+            self._update(batch_id, index, status="rendering")
+            # Rendered in another process, so the CPU slot is held here on its behalf
+            with slot("cpu", priority=BATCH_PRIORITY, machine=upload.get("name", "")):
+                stats, image_file_path = self.render_pool.submit(process_data, file_path).result()
+            artifact_store.ref(image_file_path, "batch", batch_id, f"image_{index}")
+            self._update(
+                batch_id,
+                index,
+                machineData=str(stats),
+                statistics=stats.to_dict(),
+                visualizationPath=artifact_store.url(image_file_path),
+            )
+
+            if run_pipeline:
+                run_id = str(uuid.uuid4())
+                # Progress of each item's run streams from /api/runs/<runId>/events
+                self._update(batch_id, index, status="modeling", runId=run_id)
+                run_modelica_pipeline(
+                    file_path, run_id=run_id, src_img=image_file_path, priority=BATCH_PRIORITY
+                )
+            self._update(batch_id, index, status="done")
+        except Exception as e:
+            logger.exception("Batch %s item %d failed", batch_id, index)
+            self._update(batch_id, index, status="failed", error=str(e))
+
+    def _drive(self, batch_id: str, uploads: List[Dict[str, Any]]):
+        run_pipeline = self._batches[batch_id]["runPipeline"]
+        args = ((batch_id, i, upload, run_pipeline) for i, upload in enumerate(uploads))
+        for _ in self.executor.imap(self._process_item, args):
+            pass
+        with self.lock:
+            batch = self._batches.pop(batch_id)
+            self._written.pop(batch_id, None)
+            timer = self._flushes.pop(batch_id, None)
+            if timer is not None:
+                timer.cancel()
+            failed = sum(item["status"] == "failed" for item in batch["items"])
+            batch["status"] = "failed" if failed == len(batch["items"]) and failed else "done"
+            batch["finishedAt"] = datetime.now().isoformat()
+            self.store.write(batch)
+
+    def status(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Current status with per-item results so far, or None for an unknown batch."""
+        with self.lock:
+            batch = self._batches.get(batch_id)
+            batch = json.loads(json.dumps(batch)) if batch is not None else None
+        if batch is None:
+            batch = self.store.read(batch_id)
+        if batch is None:
+            return None
+        counts = {state: 0 for state in ITEM_STATES}
+        for item in batch["items"]:
+            counts[item["status"]] += 1
+        batch["counts"] = counts
+        return batch
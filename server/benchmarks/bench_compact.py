@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Memory per machine of many uploads held in one worker: the union-indexed DataFrame
+(dataScience.load_json), per-field arrays (multiRate.load_dataset) and the compact
+layout (MultiRateDataset.compact: shared time arrays, float32 2-D value blocks).
+
+Memory is what tracemalloc sees allocated while all machines are held at once.
+
+Run from the server directory:
+    python -m benchmarks.bench_compact [--machines 20] [--hours 6] [--rates 1 1 1 5 60]
+"""
+import argparse
+import gc
+import os
+import tempfile
+import tracemalloc
+
+from benchmarks.bench_multirate import make_upload
+from dataScience import load_json
+from multiRate import load_dataset
+
+
+def held(load, paths):
+    """(objects, bytes allocated while they are all held)."""
+    gc.collect()
+    tracemalloc.start()
+    objects = [load(path) for path in paths]
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return objects, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--machines", type=int, default=20)
+    parser.add_argument("--hours", type=float, default=6)
+    # Repeated rates are sensors sampled together, which share one time array when compacted
+    parser.add_argument("--rates", type=float, nargs="+", default=[1, 1, 1, 5, 60])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "upload.json")
+        make_upload(path, args.hours, args.rates, shared_clock=True)
+        paths = [path] * args.machines
+        frames, frame_bytes = held(lambda p: load_json(p)[2], paths)
+        del frames
+        datasets, dataset_bytes = held(lambda p: load_dataset(p, compact=False), paths)
+        del datasets
+        compact, compact_bytes = held(lambda p: load_dataset(p, compact=True), paths)
+
+    mib = 1 / 2**20
+    sample = compact[0]
+    dtypes = sorted({str(f.v.dtype) for f in sample.fields})
+    print(f"{args.machines} machines, {len(args.rates)} fields at {args.rates}s over {args.hours}h: "
+          f"{sample.samples} samples each")
+    for name, size in (("union frame", frame_bytes), ("per-field", dataset_bytes), ("compact", compact_bytes)):
+        print(f"{name:>12}: {size / args.machines * mib:8.2f} MiB/machine  ({size / dataset_bytes:5.0%} of per-field)")
+    print(f"compact values: {', '.join(dtypes)}; "
+          f"{len({id(f.t) for f in sample.fields})} time arrays for {len(sample.fields)} fields")
+
+
+if __name__ == "__main__":
+    main()
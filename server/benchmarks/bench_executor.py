@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Compares the old batch-barrier run_concurrently against the streaming executor on a
+skewed-latency workload (most calls fast, a few very slow - like LLM calls).
+
+Run from the server directory:
+    python -m benchmarks.bench_executor
+"""
+import concurrent.futures
+import random
+import time
+
+from taskExecutor import StreamingExecutor
+
+
+def batch_barrier(main_func, args_list, batch_size):
+    # The pre-streaming implementation of utilityFunctions.run_concurrently
+    results = []
+    for i in range(0, len(args_list), batch_size):
+        batch = args_list[i : i + batch_size]
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            futures = [executor.submit(main_func, *args) for args in batch]
+        results.extend([future.result() for future in futures])
+    return results
+
+
+def streaming(main_func, args_list, batch_size):
+    with StreamingExecutor(max_in_flight=batch_size) as executor:
+        return [r.unwrap() for r in executor.imap(main_func, args_list, ordered=True)]
+
+
+def fake_call(latency: float) -> float:
+    time.sleep(latency)
+    return latency
+
+
+def workload(n: int, slow_fraction: float, fast: float, slow: float, seed: int = 0):
+    rng = random.Random(seed)
+    return [(slow if rng.random() < slow_fraction else fast,) for _ in range(n)]
+
+
+def main():
+    n, batch_size = 400, 16
+    args_list = workload(n, slow_fraction=0.05, fast=0.02, slow=1.0)
+    ideal = sum(a[0] for a in args_list) / batch_size
+    print(f"{n} tasks, {batch_size} in flight, ideal ~{ideal:.2f}s")
+    for name, fn in (("batch_barrier", batch_barrier), ("streaming", streaming)):
+        start = time.perf_counter()
+        results = fn(fake_call, args_list, batch_size)
+        elapsed = time.perf_counter() - start
+        assert results == [a[0] for a in args_list]
+        print(f"{name:>14}: {elapsed:6.2f}s  {n / elapsed:7.1f} tasks/s")
+
+
+if __name__ == "__main__":
+    main()
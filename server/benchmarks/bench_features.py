@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Prompt size with and without the dynamics summary from dynamicsFeatures, for the first
+pass and a refinement call, using the same token estimate the rate limiter and budget
+use (~4 characters per text token, a flat cost per image).
+
+Iterations per run depend on the live model, so they are not measured here; every run
+reports them (with its token totals) in its run_finished event.
+
+Run from the server directory:
+    python -m benchmarks.bench_features [upload.json ...]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "offline")
+os.environ.setdefault("ANTHROPIC_API_KEY", "offline")
+os.environ.setdefault("ARTIFACT_ROOT", tempfile.mkdtemp(prefix="bench_artifacts_"))
+os.environ.setdefault("ARTIFACT_DB_PATH", os.path.join(os.environ["ARTIFACT_ROOT"], "artifacts.db"))
+
+import prompts
+from dataScience import genimg, load_json
+from dataStats import describe
+from dynamicsFeatures import extract_features
+from fakeBackends import fake_simulator
+from pydanticModels import APIParameters
+from rateLimiter import estimate_tokens
+
+DEFAULT_UPLOAD = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "generated_graphs",
+    "1b43356f-1dd1-4d89-833e-8eda69b4c387.json",
+)
+MODES = ("off", "alongside", "replace")
+
+
+def prompt_tokens(messages) -> int:
+    params = APIParameters(vendor="anthropic", model="claude-3-5-sonnet-20241022", messages=messages, max_tokens=0, rag_tokens=0)
+    return estimate_tokens(params)
+
+
+def measure(path: str):
+    name, unit, df = load_json(path)
+    fake_simulator.build_seconds = 0
+    _, simdf = fake_simulator("model Sys end Sys;", df)
+    src_img = genimg(df, name, unit)
+    sim_img = genimg(simdf, name + "_simulation", unit, iteration=1)
+
+    start = time.perf_counter()
+    src_features = str(extract_features(df))
+    sim_features = str(extract_features(simdf))
+    extract_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{os.path.basename(path)}: {len(df)} samples, {len(df.columns) - 1} fields, features in {extract_ms:.1f}ms")
+    print(f"{'mode':>10} {'first pass':>11} {'refinement':>11} {'2-iteration run':>16}")
+    baseline = None
+    for mode in MODES:
+        images = mode != "replace"
+        features = mode != "off"
+        first = prompt_tokens(
+            prompts.generate_modelica_first_pass(
+                str(describe(df)), src_img if images else None, src_features if features else None
+            )
+        )
+        refine = prompt_tokens(
+            prompts.generate_modelica_iteration(
+                str(describe(df)),
+                src_img if images else None,
+                "model Sys end Sys;",
+                str(describe(simdf)),
+                sim_img if images else None,
+                src_features if features else None,
+                sim_features if features else None,
+            )
+        )
+        total = first + refine
+        baseline = baseline or total
+        print(f"{mode:>10} {first:>11} {refine:>11} {total:>10} ({total / baseline - 1:+.0%})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("uploads", nargs="*", default=[DEFAULT_UPLOAD])
+    args = parser.parse_args()
+    for path in args.uploads:
+        measure(path)
+
+
+if __name__ == "__main__":
+    main()
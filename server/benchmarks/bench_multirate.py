@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Memory and load time of an upload whose sensors sample at different rates and offsets,
+kept as per-field arrays (multiRate.load_dataset) versus the union-indexed DataFrame
+(dataScience.load_json), plus the cost of aligning the fields for a simulator.
+
+Run from the server directory:
+    python -m benchmarks.bench_multirate [--hours 6] [--rates 1 2 5 10 60]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataScience import load_json
+from multiRate import load_dataset
+
+
+def make_upload(path: str, hours: float, rates, seed: int = 0, shared_clock: bool = False):
+    """
+    One field per rate (seconds), each with its own phase offset and a little jitter;
+    with shared_clock, fields of the same rate are sampled at the same instants.
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-04-04T00:00:00Z")
+    fields = []
+    clocks = {}
+    for i, rate in enumerate(rates):
+        n = int(hours * 3600 / rate)
+        offsets = np.arange(n) * rate + rng.uniform(0, rate) + rng.uniform(0, 0.01, n)
+        if shared_clock:
+            offsets = clocks.setdefault(rate, offsets)
+        times = (start + pd.to_timedelta(offsets, unit="s")).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        values = np.sin(offsets / (600 * (i + 1))) + rng.normal(0, 0.01, n)
+        fields.append({
+            "name": f"sensor {i} ({rate}s)",
+            "nums": [{"value": float(v), "createdAt": t} for v, t in zip(values, times)],
+        })
+    with open(path, "w") as f:
+        json.dump({"name": "multirate bench", "unit": "C", "fields": fields}, f)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=6)
+    parser.add_argument("--rates", type=float, nargs="+", default=[1, 2, 5, 10, 60])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "upload.json")
+        make_upload(path, args.hours, args.rates)
+        (_, _, df), dense_s = timed(load_json, path)
+        dataset, sparse_s = timed(load_dataset, path)
+        aligned, align_s = timed(dataset.aligned)
+
+    mib = 1 / 2**20
+    print(f"{len(args.rates)} fields at {args.rates}s over {args.hours}h: {dataset.samples} samples")
+    print(f"union frame   {len(df):>8} rows {df.memory_usage(deep=True).sum() * mib:8.1f} MiB  load {dense_s:.2f}s"
+          f"  ({dataset.fill_ratio():.0%} of cells filled)")
+    print(f"per-field     {dataset.samples:>8} pts  {dataset.nbytes * mib:8.1f} MiB  load {sparse_s:.2f}s")
+    print(f"aligned grid  {len(aligned):>8} rows {aligned.memory_usage(deep=True).sum() * mib:8.1f} MiB  in {align_s:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of /api/datascience + run_modelica_pipeline using the offline
+backends (fake LLM and fake simulator), so numbers are reproducible and cost nothing.
+
+Reports per-stage wall time, pipeline throughput and peak traced memory per dataset size.
+tracemalloc stays on during the runs, which inflates the Python-heavy stages (ingest) a
+little; compare sizes against each other rather than against production timings.
+
+Run from the server directory:
+    python -m benchmarks.bench_pipeline --sizes 1000 10000 50000 --runs 3
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+# Offline backends must be selected before the pipeline modules read their configuration
+os.environ.setdefault("LLM_VENDOR", "fake")
+os.environ.setdefault("SIM_BACKEND", "fake")
+os.environ.setdefault("OPENAI_API_KEY", "offline")
+os.environ.setdefault("ANTHROPIC_API_KEY", "offline")
+os.environ.setdefault("USAGE_DB_PATH", os.path.join(tempfile.gettempdir(), "bench_usage.db"))
+os.environ.setdefault("ARTIFACT_ROOT", tempfile.mkdtemp(prefix="bench_artifacts_"))
+os.environ.setdefault("ARTIFACT_DB_PATH", os.path.join(os.environ["ARTIFACT_ROOT"], "artifacts.db"))
+os.environ.setdefault("PIPELINE_EVENTS_DIR", os.path.join(os.environ["ARTIFACT_ROOT"], "runs"))
+# Repeated runs on the same data would be served from the model library; time the generation path
+os.environ.setdefault("MODEL_LIBRARY_ENABLED", "0")
+os.environ.setdefault("MODEL_LIBRARY_DB_PATH", os.path.join(os.environ["ARTIFACT_ROOT"], "model_library.db"))
+
+import numpy as np
+
+import dataScience
+import fakeBackends
+import generateModelica
+import prompts
+import runner
+import utilityFunctions
+
+timings = defaultdict(list)
+timings_lock = threading.Lock()
+
+
+def timed(stage: str, fn):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with timings_lock:
+                timings[stage].append(time.perf_counter() - start)
+
+    return wrapper
+
+
+def instrument():
+    """Wraps each pipeline stage where its callers look it up."""
+    dataScience.load_dataset = timed("ingest", dataScience.load_dataset)
+    runner.load_dataset = dataScience.load_dataset
+    genimg = timed("render", dataScience.genimg)
+    dataScience.genimg = genimg
+    runner.genimg = genimg
+    generateModelica.genimg = genimg
+    prompts.generate_modelica_first_pass = timed("prompt", prompts.generate_modelica_first_pass)
+    prompts.generate_modelica_iteration = timed("prompt", prompts.generate_modelica_iteration)
+    utilityFunctions.create_chat_completion = timed("llm", utilityFunctions.create_chat_completion)
+    fakeBackends.FakeSimulator.__call__ = timed("simulate", fakeBackends.FakeSimulator.__call__)
+
+
+def make_dataset(path: str, samples: int, fields: int, seed: int = 0):
+    """Writes a synthetic upload in the same JSON shape the client posts."""
+    rng = np.random.default_rng(seed)
+    start = datetime(2024, 4, 4, tzinfo=timezone.utc)
+    t = np.arange(samples)
+    data = {"name": f"bench {samples}", "unit": "C", "fields": []}
+    for f in range(fields):
+        values = 20 + 10 * (1 - np.exp(-t / (samples / 5))) + rng.normal(0, 0.2, samples) + f
+        data["fields"].append(
+            {
+                "name": f"field_{f}",
+                "nums": [
+                    {
+                        "value": float(v),
+                        "createdAt": (start + timedelta(seconds=int(i))).isoformat().replace("+00:00", "Z"),
+                    }
+                    for i, v in zip(t, values)
+                ],
+            }
+        )
+    with open(path, "w") as file:
+        json.dump(data, file)
+
+
+def run_once(path: str):
+    stats, image_path = dataScience.do_datascience(path)
+    runner.run_modelica_pipeline(path, src_img=image_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--fields", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--build-seconds", type=float, default=0.5)
+    args = parser.parse_args()
+
+    fakeBackends.fake_llm.latency = args.llm_latency
+    fakeBackends.fake_simulator.build_seconds = args.build_seconds
+    instrument()
+
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.chdir(workdir)
+    devnull = open(os.devnull, "w")
+
+    print(f"llm latency {args.llm_latency}s, build {args.build_seconds}s, {args.fields} fields")
+    header = f"{'samples':>8} {'runs/min':>9} {'peak MiB':>9}  " + " ".join(
+        f"{s:>9}" for s in ("ingest", "render", "prompt", "llm", "simulate")
+    )
+    print(header)
+    for samples in args.sizes:
+        path = os.path.join(workdir, f"upload_{samples}.json")
+        make_dataset(path, samples, args.fields)
+        timings.clear()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            for _ in range(args.runs):
+                run_once(path)
+        finally:
+            sys.stdout = stdout
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        per_run = {stage: sum(v) / args.runs for stage, v in timings.items()}
+        print(
+            f"{samples:>8} {args.runs / elapsed * 60:>9.1f} {peak / 2**20:>9.1f}  "
+            + " ".join(f"{per_run.get(s, 0):>8.3f}s" for s in ("ingest", "render", "prompt", "llm", "simulate"))
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Measures the latency and cost effect of Anthropic prompt caching on the Modelica
+refinement loop, against a local stub of the Messages API.
+
+The stub models prompt processing as a per-token cost on every uncached input token and
+implements cache breakpoints the way the real API does: a prefix ending at a block with
+cache_control is written on first sight and read on later requests.
+
+Run from the server directory:
+    python -m benchmarks.bench_prompt_cache
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Keep the benchmark's plots out of the server's artifact store
+os.environ.setdefault("ARTIFACT_ROOT", tempfile.mkdtemp(prefix="bench_artifacts_"))
+os.environ.setdefault("ARTIFACT_DB_PATH", os.path.join(os.environ["ARTIFACT_ROOT"], "artifacts.db"))
+
+import numpy as np
+import pandas as pd
+from anthropic import Anthropic
+
+import prompts
+import utilityFunctions as util
+from dataScience import genimg
+from pydanticModels import APIParameters
+
+IMAGE_TOKENS = 1600
+SECONDS_PER_INPUT_TOKEN = 0.0001
+OUTPUT_SECONDS = 0.2
+OUTPUT_TOKENS = 800
+MODEL = "claude-3-5-sonnet-20241022"
+
+RESPONSE_TEXT = "<analysis>stub</analysis><modelica_code>model Sys end Sys;</modelica_code>"
+
+
+def block_tokens(block) -> int:
+    if isinstance(block, str):
+        return len(block) // 4
+    if block.get("type") == "image":
+        return IMAGE_TOKENS
+    return len(block.get("text", "")) // 4
+
+
+class StubState:
+    def __init__(self):
+        self.cache = set()
+        self.lock = threading.Lock()
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            system = body.get("system")
+            blocks = [system] if isinstance(system, str) else list(system or [])
+            for message in body["messages"]:
+                content = message["content"]
+                blocks.extend([content] if isinstance(content, str) else content)
+
+            digest = hashlib.sha256()
+            total, cached_upto, written_upto, cached_tokens, written_tokens = 0, 0, 0, 0, 0
+            with state.lock:
+                for block in blocks:
+                    digest.update(json.dumps(block, sort_keys=True).encode())
+                    total += block_tokens(block)
+                    if isinstance(block, dict) and block.get("cache_control"):
+                        key = digest.hexdigest()
+                        if key in state.cache:
+                            cached_tokens = total
+                        else:
+                            state.cache.add(key)
+                            written_tokens = total
+            read = cached_tokens
+            created = max(written_tokens - cached_tokens, 0)
+            uncached = total - read - created
+            time.sleep((uncached + created) * SECONDS_PER_INPUT_TOKEN + OUTPUT_SECONDS)
+
+            response = {
+                "id": f"msg_{time.time_ns()}",
+                "type": "message",
+                "role": "assistant",
+                "model": body["model"],
+                "content": [{"type": "text", "text": RESPONSE_TEXT}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {
+                    "input_tokens": uncached,
+                    "output_tokens": OUTPUT_TOKENS,
+                    "cache_creation_input_tokens": created,
+                    "cache_read_input_tokens": read,
+                },
+            }
+            payload = json.dumps(response).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return Handler
+
+
+def make_images():
+    t = pd.date_range("2024-01-01", periods=600, freq="s")
+    df = pd.DataFrame({"timestamp": t, "x0": 20 + np.cumsum(np.random.randn(600)) * 0.1})
+    src = genimg(df, "bench source", "C")
+    sim = genimg(df, "bench simulation", "C", iteration=1)
+    return str(df.describe()), src, sim
+
+
+def run(iterations: int, caching: bool, desc: str, src: str, sim: str):
+    latencies, costs = [], []
+    for i in range(iterations):
+        messages = (
+            prompts.generate_modelica_first_pass(desc, src)
+            if i == 0
+            else prompts.generate_modelica_iteration(desc, src, "model Sys end Sys;", desc, sim)
+        )
+        params = APIParameters(
+            vendor="anthropic",
+            model=MODEL,
+            messages=messages,
+            temperature=0.4,
+            max_tokens=4000,
+            rag_tokens=0,
+            prompt_caching=caching,
+        )
+        start = time.perf_counter()
+        _, usage = util.create_chat_completetion_anthropic(params)
+        latencies.append(time.perf_counter() - start)
+        costs.append(usage.total_cost)
+    return latencies, costs
+
+
+def main():
+    state = StubState()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    util.anthropic_client = Anthropic(
+        api_key="stub", base_url=f"http://127.0.0.1:{server.server_address[1]}"
+    )
+
+    iterations = 6
+    desc, src, sim = make_images()
+    for caching in (False, True):
+        state.cache.clear()
+        latencies, costs = run(iterations, caching, desc, src, sim)
+        print(
+            f"caching={str(caching):5}  total {sum(latencies):5.2f}s  "
+            f"refinement calls avg {np.mean(latencies[1:]):.3f}s  "
+            f"cost ${sum(costs):.4f}"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Closed-loop HTTP load test for a running server: N client threads, each with its own
+keep-alive connection, issue requests back to back for a fixed duration.
+
+Start the server with the offline backends so /api/datascience is measurable:
+    cd server
+    LLM_VENDOR=fake SIM_BACKEND=fake gunicorn -c gunicorn.conf.py wsgi:app
+    python -m benchmarks.bench_server --url http://127.0.0.1:8080 --image box_dT_combined.png
+
+Compare against the dev server (python app.py) by pointing --url at it.
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+import numpy as np
+
+
+def small_upload(samples: int = 200) -> bytes:
+    start = datetime(2024, 4, 4, tzinfo=timezone.utc)
+    nums = [
+        {
+            "value": float(20 + np.sin(i / 20)),
+            "createdAt": (start + timedelta(seconds=i)).isoformat().replace("+00:00", "Z"),
+        }
+        for i in range(samples)
+    ]
+    data = {"name": "load test", "unit": "C", "fields": [{"name": "t", "nums": nums}]}
+    return json.dumps({"jsonData": data}).encode()
+
+
+def load(url: str, method: str, path: str, body: bytes | None, clients: int, duration: float):
+    parsed = urlparse(url)
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=600)
+        headers = {"Content-Type": "application/json"} if body else {}
+        local = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=600)
+            if ok:
+                local.append(time.perf_counter() - start)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    if latencies:
+        p50, p95 = np.percentile(latencies, [50, 95])
+    else:
+        p50 = p95 = float("nan")
+    print(
+        f"{method} {path[:40]:<40} clients={clients:<3} "
+        f"{len(latencies) / elapsed:8.1f} req/s  p50 {p50 * 1000:7.1f}ms  "
+        f"p95 {p95 * 1000:7.1f}ms  errors {errors[0]}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--image", help="file name under /generated_graphs/ to fetch")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--datascience", action="store_true", help="also POST /api/datascience")
+    args = parser.parse_args()
+
+    for clients in args.clients:
+        if args.image:
+            load(args.url, "GET", f"/generated_graphs/{args.image}", None, clients, args.duration)
+        if args.datascience:
+            load(args.url, "POST", "/api/datascience", small_upload(), clients, args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pydanticModels import APIUsage, pricing_data
+import usageStore
+
+# Models to fall back to, most to least capable, when a budget can't cover the preferred one
+MODEL_FALLBACKS: Dict[str, List[str]] = {
+    "anthropic": [
+        "claude-3-5-sonnet-20241022",
+        "claude-3-haiku-20240307",
+    ],
+    "openai": [
+        "gpt-4o",
+        "gpt-3.5-turbo",
+    ],
+}
+
+
+# Seconds a machine's spend read from the usage store is trusted before it is re-read to
+# pick up other server processes' calls (this process's own are added as they finish)
+BUDGET_REFRESH_SECONDS = float(os.getenv("BUDGET_REFRESH_SECONDS", "30"))
+
+# Worst-case cost of LLM calls in flight per machine, across this process's runs
+_reserved: Dict[str, float] = {}
+# Recorded spend per machine and when it was last read from the usage store (monotonic)
+_spent: Dict[str, Tuple[float, float]] = {}
+# Cost this process's runs have recorded per machine, ever; lets a refresh keep calls
+# recorded while it was reading
+_recorded: Dict[str, float] = {}
+# Guards _reserved and _spent; never held around I/O
+_reserved_lock = threading.Lock()
+
+
+def _refresh_spent(machine_name: str):
+    """Re-reads a machine's recorded spend if it is stale; the query runs outside the lock."""
+    with _reserved_lock:
+        entry = _spent.get(machine_name)
+        recorded = _recorded.get(machine_name, 0.0)
+    if entry is not None and time.monotonic() - entry[1] < BUDGET_REFRESH_SECONDS:
+        return
+    spent = usageStore.machine_spent(machine_name)
+    with _reserved_lock:
+        # Calls recorded during the read may or may not be in it; counting them is the safe side
+        spent += _recorded.get(machine_name, 0.0) - recorded
+        _spent[machine_name] = (spent, time.monotonic())
+
+
+class BudgetExceeded(Exception):
+    """Raised when no model is cheap enough to fit the remaining run or machine budget."""
+
+
+def estimate_cost(vendor: str, model: str, input_tokens: int, output_tokens: int) -> float:
+    """Upper-bound USD cost of a call, using pricing_data (prices are per million tokens)."""
+    model_pricing = pricing_data.get(vendor, {}).get(model)
+    if model_pricing is None:
+        return 0.0
+    input_price = float(model_pricing.get("input_price") or 0)
+    output_price = float(model_pricing.get("output_price") or 0)
+    return (input_tokens * input_price + output_tokens * output_price) / 1e6
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+class RunBudget:
+    """
+    Tracks spend for one pipeline run and decides which model the next call may use.
+
+    The run limit caps this run alone; the machine limit caps everything ever recorded for
+    the machine in the usage store. Either may be None (unlimited). The machine's spend is
+    kept in memory: read from the usage store at most every BUDGET_REFRESH_SECONDS, plus
+    this process's calls as they are recorded. Each call reserves its worst-case cost until
+    record() or release(), so concurrent runs on one machine cannot together overspend it.
+    """
+
+    def __init__(
+        self,
+        run_id: str,
+        machine_name: str,
+        run_limit: Optional[float] = None,
+        machine_limit: Optional[float] = None,
+    ):
+        self.run_id = run_id
+        self.machine_name = machine_name
+        self.run_limit = run_limit
+        self.machine_limit = machine_limit
+        self.run_spent = 0.0
+        self.run_input_tokens = 0
+        self.run_output_tokens = 0
+        self.reserved = 0.0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, run_id: str, machine_name: str) -> "RunBudget":
+        """Reads RUN_BUDGET_USD and MACHINE_BUDGET_USD (unset means unlimited)."""
+        return cls(
+            run_id,
+            machine_name,
+            run_limit=_env_float("RUN_BUDGET_USD"),
+            machine_limit=_env_float("MACHINE_BUDGET_USD"),
+        )
+
+    def remaining(self) -> Optional[float]:
+        if self.machine_limit is not None:
+            _refresh_spent(self.machine_name)
+        with _reserved_lock:
+            return self._remaining()
+
+    def _remaining(self) -> Optional[float]:
+        # Called with _reserved_lock held, after _refresh_spent
+        limits = []
+        if self.machine_limit is not None:
+            # Recorded spend (other runs' and processes' finished calls included) less calls in flight
+            spent = _spent[self.machine_name][0]
+            limits.append(self.machine_limit - spent - _reserved.get(self.machine_name, 0.0))
+        with self.lock:
+            if self.run_limit is not None:
+                limits.append(self.run_limit - self.run_spent)
+        return min(limits) if limits else None
+
+    def choose_model(self, vendor: str, model: str, input_tokens: int, max_tokens: int) -> str:
+        """
+        Returns `model` if its worst-case cost fits the remaining budget, otherwise the most
+        capable cheaper fallback that does. The chosen model's worst-case cost is reserved
+        against the machine until release().
+
+        Raises:
+            BudgetExceeded: If even the cheapest fallback would overspend.
+        """
+        if self.run_limit is None and self.machine_limit is None:
+            return model
+        fallbacks = MODEL_FALLBACKS.get(vendor, [])
+        if model in fallbacks:
+            fallbacks = fallbacks[fallbacks.index(model) + 1:]
+        if self.machine_limit is not None:
+            _refresh_spent(self.machine_name)
+        # Held from reading the spend to reserving, so concurrent runs see each other's calls
+        with _reserved_lock:
+            remaining = self._remaining()
+            for candidate in [model] + fallbacks:
+                cost = estimate_cost(vendor, candidate, input_tokens, max_tokens)
+                if cost <= remaining:
+                    if candidate != model:
+                        print(f"Budget: downgrading {model} -> {candidate} (${remaining:.4f} left)")
+                    if self.machine_limit is not None:
+                        _reserved[self.machine_name] = _reserved.get(self.machine_name, 0.0) + cost
+                        self.reserved += cost
+                    return candidate
+        raise BudgetExceeded(
+            f"Run {self.run_id} for {self.machine_name} has ${remaining:.4f} left, not enough for another call"
+        )
+
+    def release(self):
+        """Drops this run's reservation (the call failed, or record() counted its cost)."""
+        with _reserved_lock:
+            self._release()
+
+    def _release(self):
+        # Called with _reserved_lock held
+        if self.reserved:
+            left = _reserved.get(self.machine_name, 0.0) - self.reserved
+            if left > 1e-12:
+                _reserved[self.machine_name] = left
+            else:
+                _reserved.pop(self.machine_name, None)
+            self.reserved = 0.0
+
+    def record(self, usage: APIUsage):
+        """Counts a finished call against the run and machine, in place of its reservation."""
+        cost = usage.total_cost or 0.0
+        with self.lock:
+            self.run_spent += cost
+            self.run_input_tokens += usage.input_tokens or 0
+            self.run_output_tokens += usage.output_tokens or 0
+        with _reserved_lock:
+            _recorded[self.machine_name] = _recorded.get(self.machine_name, 0.0) + cost
+            if self.machine_name in _spent:
+                spent, refreshed = _spent[self.machine_name]
+                _spent[self.machine_name] = (spent + cost, refreshed)
+            self._release()
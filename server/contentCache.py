@@ -0,0 +1,80 @@
+import base64
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from pydanticModels import Content
+
+DEFAULT_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+MEDIA_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+
+
+class ImageContentCache:
+    """
+    LRU cache of base64-encoded image payloads, keyed by (path, mtime, size).
+
+    A re-rendered file gets a new mtime and therefore a new entry; the stale one ages out.
+    The byte budget counts the encoded strings, which dominate memory use.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def encoded(self, path: str) -> str:
+        """Returns the base64 payload for the file at path, reading it only on a miss."""
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+
+        with open(path, "rb") as f:
+            data = base64.standard_b64encode(f.read()).decode("utf-8")
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = data
+                self.size += len(data)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+        return data
+
+    def content(self, path: str, cache_control: Optional[Dict[str, str]] = None) -> Content:
+        """Builds an image Content block. The payload string is shared, not copied."""
+        media_type = MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "image/png")
+        return Content(
+            type="image",
+            source={"type": "base64", "media_type": media_type, "data": self.encoded(path)},
+            cache_control=cache_control,
+        )
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+image_cache = ImageContentCache()
@@ -1,17 +1,53 @@
 #!/usr/bin/env python3
-import json
-from datetime import datetime
 import matplotlib
 matplotlib.use('Agg')  # Use non-interactive backend
 import matplotlib.pyplot as plt
 import seaborn as sns
+import concurrent.futures
+import multiprocessing
 import os
-from typing import Union, Optional
+import threading
+import time
+import uuid
+from typing import Iterable, Union, Optional
 from pathlib import Path
 from pandas import DataFrame
 import pandas as pd
 from matplotlib.dates import DateFormatter
 from matplotlib.ticker import AutoMinorLocator
+from artifactServing import render_variants
+from artifactStore import Ref, artifact_store
+from dataStats import describe
+from datasetStore import dataset_store
+from multiRate import MultiRateDataset, load_dataset
+from scheduler import slot
+from sharedFrames import shared_frames
+from tracing import bind, current_attributes, span
+
+
+# pyplot keeps global figure/style state and is not thread-safe; threaded servers
+# (gunicorn gthread, the Flask dev server) must render one plot at a time per process
+PLOT_LOCK = threading.Lock()
+# Plots rendered in this many spawned processes, in parallel, with the data handed over in
+# shared memory (sharedFrames.py); 0 renders in the calling process, one at a time
+PLOT_PROCESSES = int(os.getenv("PLOT_PROCESSES", "0"))
+
+_plot_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+_plot_pool_pid: Optional[int] = None
+_plot_pool_lock = threading.Lock()
+
+
+def _get_plot_pool() -> concurrent.futures.ProcessPoolExecutor:
+    # Created lazily, per process: pools do not survive a gunicorn fork
+    global _plot_pool, _plot_pool_pid
+    with _plot_pool_lock:
+        if _plot_pool is None or _plot_pool_pid != os.getpid():
+            _plot_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=PLOT_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _plot_pool_pid = os.getpid()
+        return _plot_pool
 
 
 def get_optimal_colors(num_colors):
@@ -69,24 +105,41 @@ def set_plot_style():
     )
 
 
-def create_time_series_plot(df: pd.DataFrame, title: str, unit: str, output_path: str):
+def plot_series(data: Union[DataFrame, MultiRateDataset]):
+    """
+    (column, timestamps, values) for every field, holding only that field's own samples, so
+    fields sampled at different times draw as connected lines rather than NaN-broken dots.
+    """
+    if isinstance(data, MultiRateDataset):
+        for f in data.fields:
+            yield f.name, f.times(), f.v
+        return
+    for column in data.columns:
+        if column == "timestamp":
+            continue
+        values = data[column]
+        present = values.notna().to_numpy()
+        yield column, data["timestamp"][present], values[present].to_numpy()
+
+
+def create_time_series_plot(
+    data: Union[DataFrame, MultiRateDataset], title: str, unit: str, output_path: str
+):
     """Create a beautiful time series plot using seaborn and matplotlib"""
     fig, ax = plt.subplots(figsize=(15, 8), dpi=300)
 
-    # Get number of variables (excluding timestamp column)
-    data_columns = [col for col in df.columns if col != "timestamp"]
-    num_vars = len(data_columns)
+    series = list(plot_series(data))
+    num_vars = len(series)
 
     # Get optimal colors for this number of variables
     colors = get_optimal_colors(num_vars)
 
-    # Plot each column (except timestamp)
-    for idx, column in enumerate(data_columns):
+    # Plot each field against its own sample times
+    for idx, (column, times, values) in enumerate(series):
         # First pass: plot the line with lower intensity
         line = sns.lineplot(
-            data=df,
-            x="timestamp",
-            y=column,
+            x=times,
+            y=values,
             label=column,
             marker=None,  # No markers for the line
             linewidth=1,  # Thin line
@@ -97,8 +150,8 @@ def create_time_series_plot(df: pd.DataFrame, title: str, unit: str, output_path
 
         # Second pass: plot just the points with higher intensity
         ax.plot(
-            df["timestamp"],
-            df[column],
+            times,
+            values,
             ".",  # Dot marker
             markersize=1,  # Small dots
             alpha=1.0,  # Full intensity for points
@@ -107,11 +160,12 @@ def create_time_series_plot(df: pd.DataFrame, title: str, unit: str, output_path
         )
 
         # Add confidence intervals if enough data points
-        if len(df) > 10:
-            rolling_mean = df[column].rolling(window=5, center=True).mean()
-            rolling_std = df[column].rolling(window=5, center=True).std()
+        if len(values) > 10:
+            rolling = pd.Series(values).rolling(window=5, center=True)
+            rolling_mean = rolling.mean().to_numpy()
+            rolling_std = rolling.std().to_numpy()
             ax.fill_between(
-                df["timestamp"],
+                times,
                 rolling_mean - rolling_std,
                 rolling_mean + rolling_std,
                 alpha=0.2,
@@ -166,78 +220,60 @@ def create_time_series_plot(df: pd.DataFrame, title: str, unit: str, output_path
 
 
 def load_json(path: str) -> tuple[str, str, DataFrame]:
-    # Read JSON file
-    with open(path, "r") as file:
-        data = json.load(file)
-
-    # First, collect all timestamps from all fields
-    all_timestamps = set()
-    for field in data["fields"]:
-        for num in field.get("nums", []):
-            try:
-                timestamp = datetime.fromisoformat(
-                    num["createdAt"].replace("Z", "+00:00")
-                )
-                all_timestamps.add(timestamp)
-            except (ValueError, KeyError) as e:
-                print(f"Warning: Invalid timestamp in field {field['name']}: {e}")
-
-    if not all_timestamps:
-        raise ValueError("No valid timestamps found in the data")
-
-    # Sort timestamps
-    all_timestamps = sorted(list(all_timestamps))
-
-    # Create DataFrame with timestamps as index
-    df = pd.DataFrame(index=all_timestamps)
-    df.index.name = "timestamp"
-
-    idx = 0
-    # Process each field
-    for field in data["fields"]:
-        field_name = hex(idx)[1:]
-        idx += 1
-        field_data = {}
-
-        # Create a dictionary of timestamp: value pairs for this field
-        for num in field.get("nums", []):
-            try:
-                timestamp = datetime.fromisoformat(
-                    num["createdAt"].replace("Z", "+00:00")
-                )
-                value = float(num["value"])
-                field_data[timestamp] = value
-            except (ValueError, KeyError) as e:
-                print(f"Warning: Invalid data point in field {field_name}: {e}")
-
-        # Convert to series and add to DataFrame
-        series = pd.Series(field_data)
-        df[field_name] = series
-
-    # Reset index to make timestamp a column
-    df = df.reset_index()
+    """
+    Reads an upload as one DataFrame: a timestamp column with every field's sample times
+    and a column per field (x0, x1, ...), NaN where that field has no sample.
 
-    # Drop any columns that are all NaN
-    df = df.dropna(axis=1, how="all")
-    return (data["name"], data.get("unit", "N/A"), df)
+    Fields sampled at different times make this mostly NaN; the pipeline works on the
+    per-field arrays of multiRate.load_dataset instead and only aligns them on demand.
+    """
+    dataset = load_dataset(path)
+    return (dataset.name, dataset.unit, dataset.frame())
 
 
 def genimg(
-    df: DataFrame, name: str, unit: Union[str, None], output_dir="generated_graphs", iteration: int = 0
+    df: Union[DataFrame, MultiRateDataset],
+    name: str,
+    unit: Union[str, None],
+    iteration: int = 0,
+    refs: Iterable[Ref] = (),
 ):
-    """Process time series data from JSON and generate enhanced visualizations"""
-    set_plot_style()
-    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    """
+    Process time series data from JSON and generate enhanced visualizations.
 
-    # Generate filename
+    The plot is rendered to a unique temp file and moved into the artifact store, so
+    concurrent runs for machines with the same name never overwrite each other.
+    Returns the stored object's path.
+    """
     safe_name = name.replace(" ", "_").replace("/", "_")
-    filename = os.path.join(output_dir, f"{safe_name}{iteration}_combined.png")
+    filename = artifact_store.temp_path("png", prefix=f"{safe_name}{iteration}_")
 
     # Create and save the plot
-    output_path = create_time_series_plot(
-        df, f"{name} - Time Series Analysis", unit or "N/A", filename
-    )
-    print(f"graph saved as {filename}")
+    title = f"{name} - Time Series Analysis"
+    # Pool workers (e.g. batch renders) draw in place rather than starting pools of their own
+    in_pool = PLOT_PROCESSES > 0 and multiprocessing.parent_process() is None
+    with span("render", machine=name, iteration=iteration, process=in_pool) as s:
+        waited = time.perf_counter()
+        if in_pool:
+            # Only a descriptor crosses to the worker; a run's frames are freed when it finishes
+            run_id = current_attributes().get("run_id")
+            owner = run_id or f"render-{uuid.uuid4()}"
+            frame = shared_frames.share(df, owner)
+            try:
+                with slot("cpu"):
+                    s.set(lock_wait_ms=round((time.perf_counter() - waited) * 1000, 3))
+                    _get_plot_pool().submit(_render_shared, frame, title, unit or "N/A", filename).result()
+            finally:
+                if run_id is None:
+                    shared_frames.release(owner)
+        else:
+            # The CPU slot is taken under the lock so renders queued behind it don't hold one
+            with PLOT_LOCK, slot("cpu"):
+                s.set(lock_wait_ms=round((time.perf_counter() - waited) * 1000, 3))
+                set_plot_style()
+                create_time_series_plot(df, title, unit or "N/A", filename)
+        output_path = artifact_store.put_file(filename, "png", refs, on_create=render_variants)
+    print(f"graph saved as {output_path}")
 
     
     
@@ -247,13 +283,24 @@ def genimg(
 
 
 
+def _render_shared(frame, title: str, unit: str, output_path: str) -> str:
+    """genimg's worker side: draws a sharedFrames.SharedFrame straight from shared memory."""
+    with shared_frames.attach(frame) as data:
+        set_plot_style()
+        create_time_series_plot(data, title, unit, output_path)
+    return output_path
+
+
 def do_datascience(input_data_file_path:str):
-   
-    name, unit, df = load_json(input_data_file_path)
-    image_file_path = genimg(df, name, unit)
+    """Returns the dataset's summary statistics (str() gives the describe() table) and its plot."""
+    dataset = load_dataset(input_data_file_path)
+    with bind(machine=dataset.name):
+        # Added to the machine's partitioned history, which range reads serve from
+        dataset_store.ingest(dataset)
+        image_file_path = genimg(dataset, dataset.name, dataset.unit)
    
 
-    return str(df.describe()), image_file_path
+    return describe(dataset), image_file_path
 
 def main():
     """Example usage of the enhanced time series processor"""
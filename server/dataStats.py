@@ -0,0 +1,264 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+STATS_CACHE_ENTRIES = int(os.getenv("STATS_CACHE_ENTRIES", "256"))
+# Samples kept per column by StatsAccumulator for approximate quantiles
+RESERVOIR_SIZE = 10_000
+
+STAT_NAMES = ["count", "mean", "std", "min", "25%", "50%", "75%", "max"]
+QUANTILES = [25, 50, 75]
+
+
+@dataclass
+class Describe:
+    """
+    The numbers of DataFrame.describe() for numeric columns, as a (stat x column) array.
+
+    str() renders exactly what str(df.describe()) prints, so prompts are unchanged;
+    to_dict() is the JSON form for the API.
+    """
+
+    columns: List[str]
+    values: np.ndarray  # shape (len(STAT_NAMES), len(columns))
+    approximate: bool = False
+
+    def frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.values, index=STAT_NAMES, columns=self.columns)
+
+    def __str__(self) -> str:
+        return str(self.frame())
+
+    def to_dict(self) -> Dict[str, Dict[str, Optional[float]]]:
+        return {
+            column: {
+                stat: (None if np.isnan(value) else float(value))
+                for stat, value in zip(STAT_NAMES, self.values[:, i])
+            }
+            for i, column in enumerate(self.columns)
+        }
+
+
+def numeric_block(df: pd.DataFrame):
+    """Numeric columns (what describe() reports) as one float64 array, columns in order."""
+    numeric = df.select_dtypes(include=[np.number])
+    return list(map(str, numeric.columns)), numeric.to_numpy(dtype=np.float64)
+
+
+def compute(columns: List[str], a: np.ndarray) -> Describe:
+    """
+    All describe() statistics for every column of a in one vectorized pass: a single
+    column-wise sort yields min, max and the (linearly interpolated) quantiles.
+    """
+    values = np.full((len(STAT_NAMES), len(columns)), np.nan)
+    nan = np.isnan(a)
+    has_nan = nan.any()
+    count = a.shape[0] - nan.sum(axis=0) if has_nan else np.full(len(columns), a.shape[0])
+    values[0] = count
+    present = count > 0
+    if not present.any():
+        return Describe(columns, values)
+
+    # all-NaN columns keep NaN statistics, like describe()
+    filled = np.where(nan, 0.0, a) if has_nan else a
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = filled.sum(axis=0) / count
+        deviations = filled - mean
+        if has_nan:
+            deviations[nan] = 0.0
+        values[1] = mean
+        values[2] = np.where(count > 1, np.sqrt((deviations**2).sum(axis=0) / (count - 1)), np.nan)
+
+    ordered = np.sort(a, axis=0)  # NaN sorts last
+    last = np.maximum(count - 1, 0)
+    cols = np.arange(len(columns))
+    values[3] = ordered[0]
+    values[7] = ordered[last, cols]
+    for row, q in zip(range(4, 7), QUANTILES):
+        position = last * (q / 100)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, last)
+        fraction = position - low
+        values[row] = ordered[low, cols] + (ordered[high, cols] - ordered[low, cols]) * fraction
+    values[1:, ~present] = np.nan
+    return Describe(columns, values)
+
+
+def describe_fields(columns: List[str], fields: List[np.ndarray]) -> Describe:
+    """
+    describe() of fields with their own sample counts, without padding them to a shared
+    length with NaN first. Matches compute() on the union-aligned frame.
+    """
+    values = np.full((len(STAT_NAMES), len(columns)), np.nan)
+    for i, v in enumerate(fields):
+        values[:, i] = compute(columns[i:i + 1], np.asarray(v, dtype=np.float64).reshape(-1, 1)).values[:, 0]
+    return Describe(list(columns), values)
+
+
+def dataset_hash(columns: List[str], a: np.ndarray) -> str:
+    h = hashlib.sha1(usedforsecurity=False)
+    h.update("\0".join(columns).encode())
+    h.update(str(a.shape).encode())
+    h.update(np.ascontiguousarray(a).data)
+    return h.hexdigest()
+
+
+class StatsCache:
+    """LRU of Describe results keyed by a hash of the numeric data they describe."""
+
+    def __init__(self, max_entries: int = STATS_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Describe]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def describe(self, data) -> Describe:
+        """Statistics of a DataFrame's numeric columns, or of each field of a MultiRateDataset."""
+        if hasattr(data, "fields"):
+            return self._lookup(
+                data.fingerprint(), lambda: describe_fields(data.columns, [f.v for f in data.fields])
+            )
+        columns, a = numeric_block(data)
+        return self._lookup(dataset_hash(columns, a), lambda: compute(columns, a))
+
+    def _lookup(self, key: str, make) -> Describe:
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+        result = make()
+        with self.lock:
+            self.entries[key] = result
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+stats_cache = StatsCache()
+
+
+def describe(data) -> Describe:
+    """
+    Cached replacement for df.describe() on numeric columns; str() it for prompts.
+    Also takes a multiRate.MultiRateDataset, described field by field.
+    """
+    return stats_cache.describe(data)
+
+
+class StatsAccumulator:
+    """
+    Incremental describe() over data arriving in chunks (e.g. a live machine feed).
+
+    Count, mean and variance use Welford/Chan updates and min/max are exact. Quantiles
+    come from a per-column reservoir sample, exact until RESERVOIR_SIZE values have been
+    seen and approximate after that. Accumulators over disjoint data can be merged.
+    """
+
+    def __init__(self, columns: List[str], reservoir_size: int = RESERVOIR_SIZE, seed: Optional[int] = None):
+        k = len(columns)
+        self.columns = list(columns)
+        self.reservoir_size = reservoir_size
+        self.count = np.zeros(k, dtype=np.int64)
+        self.mean = np.zeros(k)
+        self.m2 = np.zeros(k)
+        self.min = np.full(k, np.inf)
+        self.max = np.full(k, -np.inf)
+        self.reservoirs = [np.empty(0) for _ in range(k)]
+        self.rng = np.random.default_rng(seed)
+
+    def _merge_moments(self, count, mean, m2):
+        total = self.count + count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = mean - self.mean
+            new_mean = np.where(total > 0, self.mean + delta * count / total, 0.0)
+            new_m2 = self.m2 + m2 + np.where(total > 0, delta**2 * self.count * count / total, 0.0)
+        self.count, self.mean, self.m2 = total, new_mean, new_m2
+
+    def _sample(self, i: int, seen_before: int, values: np.ndarray):
+        """Reservoir sampling (Algorithm R), vectorized over a chunk."""
+        reservoir = self.reservoirs[i]
+        room = self.reservoir_size - len(reservoir)
+        if room > 0:
+            filled = min(room, len(values))
+            reservoir = np.concatenate([reservoir, values[:filled]])
+            values = values[filled:]
+            seen_before += filled
+        if len(values):
+            positions = seen_before + np.arange(1, len(values) + 1)
+            slots = (self.rng.random(len(values)) * positions).astype(np.int64)
+            keep = slots < self.reservoir_size
+            reservoir = reservoir.copy()
+            reservoir[slots[keep]] = values[keep]
+        self.reservoirs[i] = reservoir
+
+    def update(self, chunk) -> "StatsAccumulator":
+        """Adds rows: a DataFrame with these columns, or a 2-D array in column order."""
+        a = chunk[self.columns].to_numpy(dtype=np.float64) if isinstance(chunk, pd.DataFrame) else np.asarray(chunk, dtype=np.float64)
+        if a.ndim == 1:
+            a = a.reshape(-1, len(self.columns))
+        mask = ~np.isnan(a)
+        count = mask.sum(axis=0)
+        present = count > 0
+        mean = np.zeros(len(self.columns))
+        m2 = np.zeros(len(self.columns))
+        if present.any():
+            sub = a[:, present]
+            mean[present] = np.nanmean(sub, axis=0)
+            m2[present] = np.nansum((sub - mean[present]) ** 2, axis=0)
+            self.min[present] = np.minimum(self.min[present], np.nanmin(sub, axis=0))
+            self.max[present] = np.maximum(self.max[present], np.nanmax(sub, axis=0))
+        seen = self.count.copy()
+        self._merge_moments(count, mean, m2)
+        for i in np.flatnonzero(present):
+            self._sample(i, int(seen[i]), a[mask[:, i], i])
+        return self
+
+    def merge(self, other: "StatsAccumulator") -> "StatsAccumulator":
+        """Combines another accumulator over the same columns into this one."""
+        if other.columns != self.columns:
+            raise ValueError("Cannot merge accumulators over different columns")
+        seen = self.count.copy()
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        for i in range(len(self.columns)):
+            mine, theirs = self.reservoirs[i], other.reservoirs[i]
+            if seen[i] + other.count[i] <= self.reservoir_size:
+                self.reservoirs[i] = np.concatenate([mine, theirs])
+                continue
+            # Draw from each side in proportion to how many values it stands for
+            k = int(round(self.reservoir_size * seen[i] / (seen[i] + other.count[i])))
+            k = min(k, len(mine))
+            j = min(self.reservoir_size - k, len(theirs))
+            self.reservoirs[i] = np.concatenate([
+                self.rng.choice(mine, k, replace=False),
+                self.rng.choice(theirs, j, replace=False),
+            ])
+        return self
+
+    def result(self) -> Describe:
+        values = np.full((len(STAT_NAMES), len(self.columns)), np.nan)
+        values[0] = self.count
+        present = self.count > 0
+        values[1, present] = self.mean[present]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values[2, self.count > 1] = np.sqrt(self.m2[self.count > 1] / (self.count[self.count > 1] - 1))
+        values[3, present] = self.min[present]
+        values[7, present] = self.max[present]
+        for i in np.flatnonzero(present):
+            values[4:7, i] = np.percentile(self.reservoirs[i], QUANTILES)
+        return Describe(self.columns, values, approximate=bool((self.count > self.reservoir_size).any()))
@@ -0,0 +1,328 @@
+import fcntl
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import replace
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from logConfig import get_logger
+from multiRate import DATASET_COMPACT, FieldSeries, MultiRateDataset, to_ns
+from tracing import span
+
+logger = get_logger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Partitioned history of every machine's measurements (kept outside the served artifact root)
+DATASET_ROOT = os.getenv("DATASET_ROOT", os.path.join(BASE_DIR, "datasets"))
+# Time span of one chunk file; range reads only open the chunks they overlap
+DATASET_CHUNK_SECONDS = int(os.getenv("DATASET_CHUNK_SECONDS", "86400"))
+
+MANIFEST = "manifest.json"
+
+
+class DatasetStore:
+    """
+    Every machine's measurements across uploads and live readings, partitioned by field
+    and time. Each chunk holds one field's samples within one DATASET_CHUNK_SECONDS span
+    (UTC-aligned, so daily by default) as a pair of sorted .npy columns:
+
+        <root>/<machine key>/manifest.json            id, name, unit, fields, chunk bounds
+        <root>/<machine key>/<column>/<chunk>.t.npy   timestamps, int64 ns
+        <root>/<machine key>/<column>/<chunk>.v.npy   values, float64
+
+    Fields are filed under their stable key (FieldSeries.key: the upload field's "key" or
+    "id"; readings without one are matched by label), so uploads listing the sensors in
+    another order, or only some of them, extend the right history. Each stored field
+    keeps the column (x0, x1, ...) it was first stored as, and reads return that column.
+
+    The manifest records each chunk's first and last timestamp, so a range read opens only
+    the chunks it overlaps and binary-searches their time columns; its cost follows the
+    window, not the history. Ingesting merges new samples into the chunks they fall in
+    (a repeated timestamp takes the newer value) and leaves every other chunk alone.
+
+    Writers hold an exclusive and readers a shared flock on the machine's directory, so
+    gunicorn workers on one host can ingest and read the same machine concurrently.
+    Reads memory-map the chunks read-only: a field within one chunk comes back as a view
+    of the OS page cache, shared by every worker reading it rather than copied into each.
+    Files are replaced by rename, never rewritten in place, so a mapping outlives writes.
+    """
+
+    def __init__(self, root: str = DATASET_ROOT, chunk_seconds: int = DATASET_CHUNK_SECONDS):
+        self.root = root
+        self.chunk_ns = int(chunk_seconds) * 1_000_000_000
+        self.lock = threading.Lock()
+        self.counters = {"ingested": 0, "chunks_written": 0, "reads": 0, "chunks_read": 0, "chunks_skipped": 0}
+
+    # ===== Layout =====
+
+    @staticmethod
+    def key(machine: str) -> str:
+        """Directory name of a machine (MultiRateDataset.machine); ids may hold anything."""
+        return hashlib.sha1(machine.encode(), usedforsecurity=False).hexdigest()[:20]
+
+    def directory(self, machine: str) -> str:
+        return os.path.join(self.root, self.key(machine))
+
+    def _chunk_path(self, directory: str, column: str, chunk: int, kind: str) -> str:
+        return os.path.join(directory, column, f"{chunk}.{kind}.npy")
+
+    @contextmanager
+    def _locked(self, directory: str, exclusive: bool) -> Iterator[None]:
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _manifest(self, directory: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(directory, MANIFEST), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _replace(path: str, write) -> None:
+        # Written beside the target and renamed over it, so a crash never leaves half a file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _count(self, **deltas: int):
+        with self.lock:
+            for name, delta in deltas.items():
+                self.counters[name] += delta
+
+    @staticmethod
+    def _assign(fields: Dict[str, Any], dataset: MultiRateDataset) -> List[str]:
+        """The manifest key of each of dataset's fields; entries for new ones are added to fields."""
+        used = {entry.get("column", key) for key, entry in fields.items()}
+        keys = []
+        for f in dataset.fields:
+            key = f.key or f.label or f.name
+            if key not in fields and f.label:
+                # Readings without a key, and fields stored by position before fields were
+                # keyed, are matched by label
+                match = next(
+                    (k for k, entry in fields.items()
+                     if entry["label"] == f.label and (f.key is None or "column" not in entry)),
+                    None,
+                )
+                if match is not None and "column" not in fields[match]:
+                    fields[key] = dict(fields.pop(match), column=match)
+                elif match is not None:
+                    key = match
+            if key not in fields:
+                column = f.name
+                if column in used:
+                    column = next(c for c in (hex(i)[1:] for i in itertools.count()) if c not in used)
+                fields[key] = {"column": column, "label": f.label, "chunks": {}}
+                used.add(column)
+            keys.append(key)
+        return keys
+
+    def conform(self, dataset: MultiRateDataset) -> MultiRateDataset:
+        """
+        The dataset with its fields renamed to the columns their sensors are stored as
+        (those not stored yet to the ones ingest would give them), so a model fitted on the
+        history applies to it. Unchanged if nothing is stored for the machine.
+        """
+        directory = self.directory(dataset.machine)
+        with self._locked(directory, exclusive=False):
+            manifest = self._manifest(directory)
+        if manifest is None:
+            return dataset
+        fields = dict(manifest["fields"])
+        keys = self._assign(fields, dataset)
+        return MultiRateDataset(
+            dataset.name, dataset.unit,
+            [replace(f, name=fields[key].get("column", key)) for f, key in zip(dataset.fields, keys)],
+            dataset.id,
+        )
+
+    # ===== Writes =====
+
+    def ingest(self, dataset: MultiRateDataset) -> Dict[str, int]:
+        """Merges an upload's or reading's samples into its machine's chunks; returns counts."""
+        directory = self.directory(dataset.machine)
+        written = 0
+        with span("dataset.ingest", machine=dataset.machine, samples=dataset.samples) as s, self._locked(directory, exclusive=True):
+            manifest = self._manifest(directory) or {"id": dataset.machine, "fields": {}, "version": 0}
+            manifest.update(name=dataset.name, unit=dataset.unit)
+            for f, key in zip(dataset.fields, self._assign(manifest["fields"], dataset)):
+                field = manifest["fields"][key]
+                field["label"] = f.label or field["label"]
+                column = field.get("column", key)
+                os.makedirs(os.path.join(directory, column), exist_ok=True)
+                chunks = f.t // self.chunk_ns
+                bounds = np.flatnonzero(np.diff(chunks)) + 1
+                for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(chunks)]):
+                    chunk = int(chunks[lo])
+                    t, v = f.t[lo:hi], f.v[lo:hi].astype(np.float64)
+                    if str(chunk) in field["chunks"]:
+                        t, v = _merge(*self._load_chunk(directory, column, chunk), t, v)
+                    self._replace(self._chunk_path(directory, column, chunk, "t"), lambda out: np.save(out, t))
+                    self._replace(self._chunk_path(directory, column, chunk, "v"), lambda out: np.save(out, v))
+                    field["chunks"][str(chunk)] = [int(t[0]), int(t[-1]), len(t)]
+                    written += 1
+            manifest["version"] += 1
+            self._replace(os.path.join(directory, MANIFEST), lambda out: out.write(json.dumps(manifest).encode()))
+            s.set(chunks=written)
+        self._count(ingested=dataset.samples, chunks_written=written)
+        return {"samples": dataset.samples, "chunks": written}
+
+    def delete(self, machine: str) -> bool:
+        """Drops a machine's whole history; False if none was stored."""
+        directory = self.directory(machine)
+        with self._locked(directory, exclusive=True):
+            manifest = self._manifest(directory)
+            if manifest is None:
+                return False
+            os.unlink(os.path.join(directory, MANIFEST))
+            for key, field in manifest["fields"].items():
+                column = field.get("column", key)
+                for chunk in field["chunks"]:
+                    for kind in ("t", "v"):
+                        os.unlink(self._chunk_path(directory, column, int(chunk), kind))
+        return True
+
+    # ===== Reads =====
+
+    def _load_chunk(self, directory: str, column: str, chunk: int, mmap: bool = False):
+        mode = "r" if mmap else None
+        return (
+            np.asarray(np.load(self._chunk_path(directory, column, chunk, "t"), mmap_mode=mode)),
+            np.asarray(np.load(self._chunk_path(directory, column, chunk, "v"), mmap_mode=mode)),
+        )
+
+    def read(self, machine: str, start=None, end=None, columns: Optional[Sequence[str]] = None,
+             compact: bool = DATASET_COMPACT) -> MultiRateDataset:
+        """
+        The machine's samples within [start, end] (int ns or anything pd.Timestamp accepts;
+        open-ended if None) for all or the named fields. Fields without samples in the
+        range are left out, so the result may have no fields at all. Fields within one
+        chunk are read-only views of the mapped files; compact copies them into
+        MultiRateDataset.compact()'s private, smaller layout instead.
+
+        Raises:
+            LookupError: If nothing is stored for the machine.
+        """
+        start = None if start is None else to_ns(start)
+        end = None if end is None else to_ns(end)
+        directory = self.directory(machine)
+        read = skipped = 0
+        with span("dataset.read", machine=machine) as s, self._locked(directory, exclusive=False):
+            manifest = self._manifest(directory)
+            if manifest is None:
+                raise LookupError(f"No data stored for machine {machine!r}")
+            fields = []
+            for key, field in manifest["fields"].items():
+                column = field.get("column", key)
+                if columns is not None and column not in columns:
+                    continue
+                stable = key if "column" in field else None
+                ts, vs = [], []
+                for chunk, (first, last, _) in sorted(field["chunks"].items(), key=lambda item: int(item[0])):
+                    if (start is not None and last < start) or (end is not None and first > end):
+                        skipped += 1
+                        continue
+                    series = FieldSeries(column, field["label"], *self._load_chunk(directory, column, int(chunk), mmap=True))
+                    series = series.window(start, end)
+                    ts.append(series.t)
+                    vs.append(series.v)
+                    read += 1
+                if len(ts) == 1 and len(ts[0]):
+                    fields.append(FieldSeries(column, field["label"], ts[0], vs[0], stable))
+                elif ts and sum(len(t) for t in ts):
+                    fields.append(FieldSeries(column, field["label"], np.concatenate(ts), np.concatenate(vs), stable))
+            s.set(chunks=read, skipped=skipped)
+        self._count(reads=1, chunks_read=read, chunks_skipped=skipped)
+        dataset = MultiRateDataset(manifest["name"], manifest.get("unit"), fields, manifest.get("id"))
+        return dataset.compact() if compact else dataset
+
+    def last(self, machine: str, seconds: float, columns: Optional[Sequence[str]] = None,
+             compact: bool = DATASET_COMPACT) -> MultiRateDataset:
+        """The latest `seconds` of the machine's data, ending at its newest sample."""
+        end = self.info(machine)["end"]
+        return self.read(machine, end - int(seconds * 1e9), None, columns, compact)
+
+    def info(self, machine: str) -> Dict[str, Any]:
+        """
+        Id, name, unit, version (bumped by every ingest) and per-field sample counts and
+        time bounds (int ns), from the manifest alone.
+
+        Raises:
+            LookupError: If nothing is stored for the machine.
+        """
+        directory = self.directory(machine)
+        with self._locked(directory, exclusive=False):
+            manifest = self._manifest(directory)
+        if manifest is None:
+            raise LookupError(f"No data stored for machine {machine!r}")
+        fields = []
+        for key, field in manifest["fields"].items():
+            bounds = list(field["chunks"].values())
+            if not bounds:
+                continue
+            fields.append({
+                "column": field.get("column", key),
+                "key": key if "column" in field else None,
+                "label": field["label"],
+                "samples": sum(b[2] for b in bounds),
+                "start": min(b[0] for b in bounds),
+                "end": max(b[1] for b in bounds),
+                "chunks": len(bounds),
+            })
+        return {
+            "id": manifest.get("id", manifest["name"]),
+            "name": manifest["name"],
+            "unit": manifest.get("unit"),
+            "version": manifest["version"],
+            "fields": fields,
+            "start": min(f["start"] for f in fields),
+            "end": max(f["end"] for f in fields),
+        }
+
+    def contains(self, machine: str) -> bool:
+        return os.path.exists(os.path.join(self.directory(machine), MANIFEST))
+
+    def machines(self) -> List[str]:
+        """Keys (ids) of every machine with stored data."""
+        names = []
+        if not os.path.isdir(self.root):
+            return names
+        for key in sorted(os.listdir(self.root)):
+            manifest = self._manifest(os.path.join(self.root, key))
+            if manifest is not None:
+                names.append(manifest.get("id", manifest["name"]))
+        return names
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters)
+
+
+def _merge(t_old: np.ndarray, v_old: np.ndarray, t_new: np.ndarray, v_new: np.ndarray):
+    """Sorted union of two chunks' samples; the new value wins for a repeated timestamp."""
+    t = np.concatenate([t_old, t_new])
+    v = np.concatenate([v_old, v_new])
+    order = np.argsort(t, kind="stable")
+    t, v = t[order], v[order]
+    last = np.append(t[1:] != t[:-1], True)
+    return t[last], v[last]
+
+
+dataset_store = DatasetStore()
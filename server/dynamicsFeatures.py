@@ -0,0 +1,329 @@
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dataStats import dataset_hash, numeric_block
+
+# Signals are resampled onto at most this many uniform points for FFT and correlation
+MAX_GRID_POINTS = 8192
+# A sample-to-sample change this many robust sigmas above normal is a step/event
+STEP_THRESHOLD = 8.0
+MAX_EVENTS = 6
+# Changes within this many samples of each other belong to one event
+EVENT_GAP = 3
+# Events smaller than this share of the column's range are noise
+MIN_STEP_FRACTION = 0.05
+# Only report a dominant frequency holding at least this share of (detrended) power
+MIN_PERIODIC_POWER = 0.2
+MIN_CYCLES = 3
+# Only report cross-correlation lags at least this strong
+MIN_CORRELATION = 0.5
+FEATURE_CACHE_ENTRIES = 256
+
+# 1 - 1/e: a first-order response covers this fraction of a step after one time constant
+FIRST_ORDER_FRACTION = 1 - np.exp(-1)
+
+
+@dataclass
+class StepEvent:
+    time: float
+    change: float
+    # Seconds to cover 63.2% of the change; None when no first-order settling is visible
+    time_constant: Optional[float] = None
+
+
+@dataclass
+class ColumnFeatures:
+    name: str
+    start: float
+    end: float
+    minimum: float
+    maximum: float
+    max_rate: float
+    max_rate_time: float
+    steps: List[StepEvent] = field(default_factory=list)
+    dominant_frequency: Optional[float] = None
+    periodic_power: Optional[float] = None
+
+
+@dataclass
+class LagFeature:
+    leader: str
+    follower: str
+    lag: float
+    correlation: float
+
+
+@dataclass
+class DynamicsSummary:
+    """Compact description of a dataset's dynamics; times are seconds from the first sample."""
+
+    duration: float
+    dt: float
+    samples: int
+    columns: List[ColumnFeatures]
+    lags: List[LagFeature]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def __str__(self) -> str:
+        """The prompt form: one line per variable plus one per notable lag."""
+        lines = [f"duration {_g(self.duration)}s, dt~{_g(self.dt)}s, {self.samples} samples (t in s from start)"]
+        for c in self.columns:
+            parts = [
+                f"{c.name}: start {_g(c.start)} end {_g(c.end)} range [{_g(c.minimum)}, {_g(c.maximum)}]",
+                f"max|d/dt| {_g(c.max_rate)}/s at t={_g(c.max_rate_time)}",
+            ]
+            if c.steps:
+                parts.append(
+                    "steps "
+                    + ", ".join(
+                        f"t={_g(s.time)} {s.change:+.3g}"
+                        + (f" (tau~{_g(s.time_constant)}s)" if s.time_constant is not None else "")
+                        for s in c.steps
+                    )
+                )
+            if c.dominant_frequency is not None:
+                parts.append(
+                    f"periodic {_g(c.dominant_frequency)}Hz (period {_g(1 / c.dominant_frequency)}s, "
+                    f"{c.periodic_power:.0%} of power)"
+                )
+            lines.append("; ".join(parts))
+        for lag in self.lags:
+            lines.append(f"{lag.leader} leads {lag.follower} by {_g(lag.lag)}s (r={lag.correlation:.2f})")
+        return "\n".join(lines)
+
+
+def _g(value: float) -> str:
+    return f"{value:.4g}"
+
+
+def elapsed_seconds(df: pd.DataFrame) -> np.ndarray:
+    """Time axis in seconds from the first sample (datetime or numeric 'timestamp', else row index)."""
+    if "timestamp" not in df:
+        return np.arange(len(df), dtype=np.float64)
+    t = df["timestamp"]
+    if pd.api.types.is_datetime64_any_dtype(t):
+        return (t - t.iloc[0]).dt.total_seconds().to_numpy(dtype=np.float64)
+    t = t.to_numpy(dtype=np.float64)
+    return t - t[0]
+
+
+def uniform_grid(t: np.ndarray, a: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Resamples each column of a onto an evenly spaced grid (NaNs skipped), capped at MAX_GRID_POINTS."""
+    steps = np.diff(t)
+    dt = float(np.median(steps[steps > 0])) if (steps > 0).any() else 1.0
+    points = int(min(MAX_GRID_POINTS, max(2, np.floor(t[-1] / dt) + 1)))
+    grid = np.linspace(0.0, t[-1], points)
+    resampled = np.empty((points, a.shape[1]))
+    for i in range(a.shape[1]):
+        ok = ~np.isnan(a[:, i])
+        resampled[:, i] = np.interp(grid, t[ok], a[ok, i]) if ok.any() else np.nan
+    return grid, resampled
+
+
+def _time_constant(t: np.ndarray, x: np.ndarray, start: int, stop: int, change: float) -> Optional[float]:
+    """Time from the step (at sample start) until 63.2% of its final change is covered, before stop."""
+    segment = x[start + 1:stop]
+    if len(segment) < 4:
+        return None
+    base = x[start]
+    # Settled level: median of the last fifth of the segment
+    final = np.median(segment[-max(1, len(segment) // 5):])
+    total = final - base
+    if abs(total) < abs(change) * 0.5 or total == 0:
+        return None
+    progress = (segment - base) / total
+    reached = np.flatnonzero(progress >= FIRST_ORDER_FRACTION)
+    # A jump that lands at once is a step, not a lag
+    if len(reached) == 0 or reached[0] == 0:
+        return None
+    return float(t[start + 1 + reached[0]] - t[start])
+
+
+def column_features(name: str, t: np.ndarray, x: np.ndarray, grid: np.ndarray, xg: np.ndarray) -> ColumnFeatures:
+    ok = ~np.isnan(x)
+    t, x = t[ok], x[ok]
+    tail = max(1, len(x) // 10)
+    dx = np.diff(x)
+    dt = np.diff(t)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.where(dt > 0, dx / dt, 0.0)
+    i_rate = int(np.argmax(np.abs(rate))) if len(rate) else 0
+    features = ColumnFeatures(
+        name=name,
+        start=float(np.median(x[:tail])),
+        end=float(np.median(x[-tail:])),
+        minimum=float(x.min()),
+        maximum=float(x.max()),
+        max_rate=float(abs(rate[i_rate])) if len(rate) else 0.0,
+        max_rate_time=float(t[i_rate + 1]) if len(rate) else 0.0,
+    )
+
+    # Steps: changes far outside the robust spread of ordinary sample-to-sample changes
+    if len(dx) > 2:
+        mad = np.median(np.abs(dx - np.median(dx))) * 1.4826
+        scale = max(mad, 1e-9 * max(1.0, np.abs(x).max()))
+        candidates = np.flatnonzero(np.abs(dx) > STEP_THRESHOLD * scale)
+        # Merge nearby samples of one ramp into a single event
+        groups = np.split(candidates, np.flatnonzero(np.diff(candidates) > EVENT_GAP) + 1) if len(candidates) else []
+        span = features.maximum - features.minimum
+        groups = [g for g in groups if abs(x[g[-1] + 1] - x[g[0]]) >= MIN_STEP_FRACTION * span]
+        events = sorted(groups, key=lambda g: -abs(x[g[-1] + 1] - x[g[0]]))[:MAX_EVENTS]
+        events = sorted(events, key=lambda g: g[0])
+        for k, g in enumerate(events):
+            start = g[0]
+            stop = events[k + 1][0] + 1 if k + 1 < len(events) else len(x)
+            change = float(x[g[-1] + 1] - x[g[0]])
+            features.steps.append(
+                StepEvent(
+                    time=float(t[g[0] + 1]),
+                    change=change,
+                    time_constant=_time_constant(t, x, start, stop, change),
+                )
+            )
+
+    # Dominant frequency of the detrended signal
+    if len(xg) >= 16 and np.isfinite(xg).all():
+        detrended = xg - np.polyval(np.polyfit(grid, xg, 1), grid)
+        power = np.abs(np.fft.rfft(detrended * np.hanning(len(detrended)))) ** 2
+        power[0] = 0.0
+        total = power.sum()
+        if total > 0:
+            k = int(np.argmax(power))
+            share = float(power[max(k - 1, 0):k + 2].sum() / total)
+            # At least MIN_CYCLES periods must fit in the record to call it periodic
+            if share >= MIN_PERIODIC_POWER and k >= MIN_CYCLES:
+                features.dominant_frequency = float(k / (grid[-1] - grid[0]) * (len(grid) - 1) / len(grid))
+                features.periodic_power = share
+    return features
+
+
+def cross_lags(names: List[str], grid: np.ndarray, a: np.ndarray) -> List[LagFeature]:
+    """Lag of the strongest cross-correlation for every pair of columns (FFT based)."""
+    n = len(grid)
+    if n < 8 or a.shape[1] < 2:
+        return []
+    step = (grid[-1] - grid[0]) / (n - 1)
+    diffs = np.diff(a, axis=0)  # correlate changes, not levels, so trends don't dominate
+    diffs = diffs - diffs.mean(axis=0)
+    norms = np.sqrt((diffs**2).sum(axis=0))
+    size = 1 << int(np.ceil(np.log2(2 * len(diffs))))
+    spectra = np.fft.rfft(diffs, size, axis=0)
+    lags = []
+    for i in range(a.shape[1]):
+        for j in range(i + 1, a.shape[1]):
+            if norms[i] == 0 or norms[j] == 0 or not np.isfinite(norms[[i, j]]).all():
+                continue
+            xcorr = np.fft.irfft(spectra[:, j] * np.conj(spectra[:, i]), size)
+            # Index k > 0: column j follows column i by k samples; wrap-around are negative lags
+            max_lag = len(diffs) // 4
+            candidates = np.concatenate([xcorr[: max_lag + 1], xcorr[-max_lag:]]) if max_lag else xcorr[:1]
+            shifts = np.concatenate([np.arange(max_lag + 1), np.arange(-max_lag, 0)]) if max_lag else np.zeros(1, int)
+            best = int(np.argmax(candidates))
+            r = float(candidates[best] / (norms[i] * norms[j]))
+            shift = int(shifts[best])
+            if r < MIN_CORRELATION or shift == 0:
+                continue
+            leader, follower = (names[i], names[j]) if shift > 0 else (names[j], names[i])
+            lags.append(LagFeature(leader, follower, abs(shift) * step, r))
+    return lags
+
+
+def dataset_features(dataset) -> DynamicsSummary:
+    """
+    extract_features for a multiRate.MultiRateDataset: each field is analysed on its own
+    samples, and only the spectra and cross-lags use a shared grid at the finest field rate.
+    """
+    times = [dataset.elapsed(f) for f in dataset.fields]
+    duration = max(float(t[-1]) for t in times)
+    dt = (dataset.finest_interval() or 0) / 1e9
+    if duration <= 0 or dt <= 0:
+        return DynamicsSummary(duration, 0.0, len(dataset), [], [])
+    points = int(min(MAX_GRID_POINTS, max(2, np.floor(duration / dt) + 1)))
+    grid = np.linspace(0.0, duration, points)
+    # Outside a field's own span, hold its first/last value like uniform_grid does
+    ag = np.column_stack([np.interp(grid, t, f.v) for t, f in zip(times, dataset.fields)])
+    columns = [
+        column_features(f.name, t, f.v, grid, ag[:, i])
+        for i, (t, f) in enumerate(zip(times, dataset.fields))
+    ]
+    return DynamicsSummary(
+        duration=duration,
+        dt=dt,
+        samples=len(dataset),
+        columns=columns,
+        lags=cross_lags(dataset.columns, grid, ag),
+    )
+
+
+def extract_features(df: pd.DataFrame) -> DynamicsSummary:
+    """Vectorized dynamics features of every numeric column of a load_json/simulation DataFrame."""
+    if hasattr(df, "fields"):
+        return dataset_features(df)
+    names, a = numeric_block(df.drop(columns=["timestamp"], errors="ignore"))
+    t = elapsed_seconds(df)
+    if len(t) < 2 or not names:
+        return DynamicsSummary(float(t[-1]) if len(t) else 0.0, 0.0, len(t), [], [])
+    grid, ag = uniform_grid(t, a)
+    columns = [
+        column_features(name, t, a[:, i], grid, ag[:, i])
+        for i, name in enumerate(names)
+        if (~np.isnan(a[:, i])).any()
+    ]
+    steps = np.diff(t)
+    return DynamicsSummary(
+        duration=float(t[-1]),
+        dt=float(np.median(steps[steps > 0])) if (steps > 0).any() else 0.0,
+        samples=len(t),
+        columns=columns,
+        lags=cross_lags(names, grid, ag),
+    )
+
+
+class FeatureCache:
+    """LRU of summaries keyed by a hash of the data and its time axis."""
+
+    def __init__(self, max_entries: int = FEATURE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, DynamicsSummary]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def summarize(self, df: pd.DataFrame) -> DynamicsSummary:
+        if hasattr(df, "fields"):
+            key = df.fingerprint()
+        else:
+            names, a = numeric_block(df.drop(columns=["timestamp"], errors="ignore"))
+            key = dataset_hash(names + ["timestamp"], np.column_stack([elapsed_seconds(df), a]) if len(a) else a)
+        with self.lock:
+            summary = self.entries.get(key)
+            if summary is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return summary
+            self.misses += 1
+        summary = extract_features(df)
+        with self.lock:
+            self.entries[key] = summary
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return summary
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+feature_cache = FeatureCache()
+
+
+def summarize(df: pd.DataFrame) -> DynamicsSummary:
+    """Cached extract_features (of a DataFrame or MultiRateDataset); str() it for prompts, to_dict() it for JSON."""
+    return feature_cache.summarize(df)
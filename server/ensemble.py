@@ -0,0 +1,336 @@
+import io
+import os
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+
+from artifactStore import artifact_store
+from batchJobs import BatchStore
+from logConfig import get_logger
+from modelLibrary import parameters
+from multiRate import MultiRateDataset
+from scheduler import PRIORITIES
+from simWindows import Window, choose_windows
+from taskExecutor import StreamingExecutor
+from tracing import bind, propagate, span
+
+logger = get_logger(__name__)
+
+# Sample simulations in flight per server process; each OpenModelica run is its own process
+ENSEMBLE_WORKERS = int(os.getenv("ENSEMBLE_WORKERS", str(min(4, os.cpu_count() or 1))))
+ENSEMBLE_MAX_SAMPLES = int(os.getenv("ENSEMBLE_MAX_SAMPLES", "4096"))
+# Without explicit ranges every parameter varies +-this fraction around its model value
+ENSEMBLE_DEFAULT_SPREAD = float(os.getenv("ENSEMBLE_DEFAULT_SPREAD", "0.2"))
+# Memory one reduction step may read from the on-disk outputs
+ENSEMBLE_CHUNK_BYTES = int(os.getenv("ENSEMBLE_CHUNK_BYTES", str(64 * 2**20)))
+ENSEMBLE_PRIORITY = "batch"
+
+SAMPLING_METHODS = ("lhs", "sobol")
+PERCENTILES = (5, 25, 50, 75, 95)
+# Bands in the status JSON are thinned to this many time points; the CSV has them all
+MAX_BAND_POINTS = 500
+# Status is rewritten every this many finished samples
+PROGRESS_EVERY = 16
+
+
+# ===== Sampling =====
+
+
+def parameter_ranges(code: str, requested: Optional[Dict[str, Sequence[float]]] = None,
+                     spread: float = ENSEMBLE_DEFAULT_SPREAD) -> Dict[str, Tuple[float, float]]:
+    """
+    The (low, high) range of each varied parameter: the requested ones, or every literal
+    parameter of the model +-spread around its value.
+
+    Raises:
+        ValueError: If a requested parameter is not a literal parameter of the model or its range is empty.
+    """
+    nominal = parameters(code)
+    if requested is not None and not isinstance(requested, dict):
+        raise ValueError("parameters must map parameter names to [low, high]")
+    if requested:
+        ranges = {}
+        for name, bounds in requested.items():
+            if name not in nominal:
+                raise ValueError(f"'{name}' is not a numeric parameter of the model ({', '.join(nominal) or 'none'})")
+            try:
+                if isinstance(bounds, (str, dict)):
+                    raise TypeError(bounds)
+                low, high = (float(b) for b in bounds)
+            except (TypeError, ValueError):
+                raise ValueError(f"Range for '{name}' must be [low, high]")
+            if not low < high:
+                raise ValueError(f"Range for '{name}' must have low < high")
+            ranges[name] = (low, high)
+        return ranges
+    ranges = {}
+    for name, value in nominal.items():
+        delta = abs(value) * spread
+        if delta > 0:
+            ranges[name] = (value - delta, value + delta)
+    if not ranges:
+        raise ValueError("The model has no nonzero numeric parameters to vary")
+    return ranges
+
+
+def sample(ranges: Dict[str, Tuple[float, float]], n: int, method: str = "lhs", seed: Optional[int] = None) -> np.ndarray:
+    """n parameter sets, one row each, with columns in ranges' order."""
+    if method == "lhs":
+        sampler = qmc.LatinHypercube(d=len(ranges), seed=seed)
+    elif method == "sobol":
+        sampler = qmc.Sobol(d=len(ranges), scramble=True, seed=seed)
+    else:
+        raise ValueError(f"Unknown sampling method {method!r}; expected one of {', '.join(SAMPLING_METHODS)}")
+    low, high = np.array(list(ranges.values())).T
+    return qmc.scale(sampler.random(n), low, high)
+
+
+# ===== Reductions =====
+# Outputs live in an on-disk (samples, variables, times) float32 array; failed samples are
+# NaN rows. Reductions read it a block of time points at a time.
+
+
+def _time_blocks(outputs: np.ndarray, chunk_bytes: int):
+    samples, variables, times = outputs.shape
+    step = max(1, chunk_bytes // max(1, samples * variables * 8))
+    for start in range(0, times, step):
+        yield slice(start, min(times, start + step))
+
+
+def percentile_bands(outputs: np.ndarray, ok: np.ndarray, percentiles: Sequence[float] = PERCENTILES,
+                     chunk_bytes: int = ENSEMBLE_CHUNK_BYTES) -> np.ndarray:
+    """(percentiles, variables, times) across the successful samples."""
+    bands = np.full((len(percentiles), outputs.shape[1], outputs.shape[2]), np.nan, dtype=np.float32)
+    for block in _time_blocks(outputs, chunk_bytes):
+        values = np.asarray(outputs[ok, :, block], dtype=np.float64)
+        bands[:, :, block] = np.nanpercentile(values, percentiles, axis=0)
+    return bands
+
+
+def sensitivity_indices(outputs: np.ndarray, ok: np.ndarray, samples: np.ndarray,
+                        chunk_bytes: int = ENSEMBLE_CHUNK_BYTES) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Squared standardized regression coefficients of each output on the parameters, per
+    time point: the share of output variance each parameter explains under a linear fit.
+    They approximate first-order Sobol indices when R^2 is near 1.
+
+    Returns:
+        SRC^2 as (parameters, variables, times) and R^2 as (variables, times).
+    """
+    x = samples[ok]
+    x = (x - x.mean(axis=0)) / np.where(x.std(axis=0) > 0, x.std(axis=0), 1.0)
+    n, d = x.shape
+    _, variables, times = outputs.shape
+    src2 = np.full((d, variables, times), np.nan, dtype=np.float32)
+    r2 = np.full((variables, times), np.nan, dtype=np.float32)
+    if n <= d + 1:
+        return src2, r2
+    # One least-squares solve per block covers every variable and time point in it
+    pinv = np.linalg.pinv(x)
+    for block in _time_blocks(outputs, chunk_bytes):
+        y = np.asarray(outputs[ok, :, block], dtype=np.float64).reshape(n, -1)
+        std = y.std(axis=0)
+        varying = std > 0
+        ys = np.zeros_like(y)
+        ys[:, varying] = (y[:, varying] - y[:, varying].mean(axis=0)) / std[varying]
+        beta = pinv @ ys
+        explained = 1 - ((ys - x @ beta) ** 2).mean(axis=0)
+        beta[:, ~varying] = np.nan
+        explained[~varying] = np.nan
+        width = block.stop - block.start
+        src2[:, :, block] = (beta**2).reshape(d, variables, width)
+        r2[:, block] = explained.reshape(variables, width)
+    return src2, r2
+
+
+def _thin(times: np.ndarray, max_points: int = MAX_BAND_POINTS) -> np.ndarray:
+    return np.unique(np.linspace(0, len(times) - 1, min(len(times), max_points)).astype(int))
+
+
+def _finite(reduce, a: np.ndarray) -> Optional[float]:
+    """reduce(a) over its finite entries, or None when there are none (e.g. an output no parameter moves)."""
+    a = a[np.isfinite(a)]
+    return round(float(reduce(a)), 6) if len(a) else None
+
+
+def _json_floats(a: np.ndarray) -> List[Optional[float]]:
+    return [None if not np.isfinite(v) else round(float(v), 6) for v in np.asarray(a, dtype=np.float64).ravel()]
+
+
+# ===== Runs =====
+
+
+class EnsembleRunner:
+    """
+    Monte Carlo runs of a machine's model over sampled parameters. The model is built
+    once; every sample is a run of the built executable with parameter overrides
+    (sim.compile_model), ENSEMBLE_WORKERS at a time. Each finished sample is written
+    straight into a memory-mapped .npy file, so thousands of runs need memory for
+    the samples in flight only. Status and results are kept like batch status.
+    """
+
+    def __init__(self, directory: str):
+        self.store = BatchStore(directory, key="ensembleId")
+        self._executor: Optional[StreamingExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self.lock = threading.Lock()
+
+    @property
+    def executor(self) -> StreamingExecutor:
+        # Per process, and separate from the segment pool each sample's simulate() may use
+        with self.lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = StreamingExecutor(max_in_flight=ENSEMBLE_WORKERS, name="ensemble")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def backlog(self) -> Dict[str, int]:
+        with self.lock:
+            executor = self._executor if self._executor_pid == os.getpid() else None
+        return executor.backlog() if executor is not None else {"queued": 0, "in_flight": 0, "completed": 0}
+
+    def submit(self, machine: str, code: str, dataset: MultiRateDataset, samples: int = 256,
+               method: str = "lhs", ranges: Optional[Dict[str, Sequence[float]]] = None,
+               spread: float = ENSEMBLE_DEFAULT_SPREAD, seed: Optional[int] = None,
+               windows: Optional[List[List[float]]] = None, priority: str = ENSEMBLE_PRIORITY) -> Dict[str, Any]:
+        """
+        Validates the request, starts the ensemble in the background and returns its status.
+
+        Raises:
+            ValueError: For an unknown method or priority, a bad sample count or parameter range.
+        """
+        if method not in SAMPLING_METHODS:
+            raise ValueError(f"method must be one of {', '.join(SAMPLING_METHODS)}")
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+        if not 2 <= samples <= ENSEMBLE_MAX_SAMPLES:
+            raise ValueError(f"samples must be between 2 and {ENSEMBLE_MAX_SAMPLES}")
+        bounds = parameter_ranges(code, ranges, spread)
+        sim_windows = choose_windows(dataset, windows)
+        ensemble_id = str(uuid.uuid4())
+        status = {
+            "ensembleId": ensemble_id,
+            "machine": machine,
+            "status": "running",
+            "createdAt": datetime.now().isoformat(),
+            "method": method,
+            "samples": samples,
+            "parameters": {k: list(v) for k, v in bounds.items()},
+            "completed": 0,
+            "failed": 0,
+        }
+        self.store.write(status)
+        task = propagate(lambda: self._run(status, code, dataset, bounds, sim_windows, seed, priority))
+        threading.Thread(target=task, name=f"ensemble-{ensemble_id[:8]}", daemon=True).start()
+        return status
+
+    def status(self, ensemble_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.read(ensemble_id)
+
+    def _run(self, status: Dict[str, Any], code: str, dataset: MultiRateDataset,
+             bounds: Dict[str, Tuple[float, float]], windows: List[Window], seed: Optional[int], priority: str):
+        from sim import compile_model
+
+        ensemble_id = status["ensembleId"]
+        with bind(machine=status["machine"], priority=priority, ensemble_id=ensemble_id), span("ensemble"):
+            outputs_path = None
+            try:
+                df = dataset.aligned()
+                x = sample(bounds, status["samples"], status["method"], seed)
+                names = list(bounds)
+                compiled = compile_model(code)
+                try:
+                    # The nominal run fixes the time grid and the compared variables
+                    nominal = compiled.simulate(df, windows)
+                    times = nominal["timestamp"].to_numpy(dtype=np.float64)
+                    variables = [c for c in dataset.columns if c in nominal]
+                    if not variables or not len(times):
+                        raise ValueError("The model's simulation has none of the measured variables")
+                    outputs_path = artifact_store.temp_path("npy", prefix="ensemble_")
+                    outputs = np.lib.format.open_memmap(
+                        outputs_path, mode="w+", dtype=np.float32, shape=(len(x), len(variables), len(times))
+                    )
+
+                    def run(i: int) -> np.ndarray:
+                        simdf = compiled.simulate(df, windows, dict(zip(names, x[i].tolist())))
+                        t = simdf["timestamp"].to_numpy(dtype=np.float64)
+                        return np.stack([np.interp(times, t, simdf[v].to_numpy(dtype=np.float64)) for v in variables])
+
+                    ok = np.zeros(len(x), dtype=bool)
+                    for done, result in enumerate(self.executor.imap(propagate(run), ((i,) for i in range(len(x)))), 1):
+                        i = result.args[0]
+                        if result.ok:
+                            outputs[i] = result.value
+                            ok[i] = True
+                        else:
+                            outputs[i] = np.nan
+                            logger.debug("Ensemble %s sample %d failed: %s", ensemble_id, i, result.error)
+                        if done % PROGRESS_EVERY == 0:
+                            self.store.write(dict(status, completed=int(ok.sum()), failed=done - int(ok.sum())))
+                finally:
+                    compiled.close()
+                outputs.flush()
+                status.update(completed=int(ok.sum()), failed=int(len(x) - ok.sum()))
+                if ok.sum() < 2:
+                    raise RuntimeError("Fewer than two samples simulated successfully")
+                with span("ensemble.reduce"):
+                    status.update(self._summarize(status, outputs, ok, x, names, variables, times, nominal))
+                del outputs
+                # The machine's latest ensemble stays; earlier ones are released to the collector
+                stored = artifact_store.put_file(outputs_path, "npy")
+                outputs_path = None
+                artifact_store.pin(stored, status["machine"], "ensemble_outputs")
+                status["outputsUrl"] = artifact_store.url(stored)
+                status["status"] = "done"
+            except Exception as e:
+                logger.exception("Ensemble %s failed", ensemble_id)
+                status.update(status="failed", error=str(e))
+            finally:
+                if outputs_path and os.path.exists(outputs_path):
+                    os.remove(outputs_path)
+                status["finishedAt"] = datetime.now().isoformat()
+                self.store.write(status)
+
+    def _summarize(self, status, outputs, ok, x, names, variables, times, nominal) -> Dict[str, Any]:
+        bands = percentile_bands(outputs, ok)
+        src2, r2 = sensitivity_indices(outputs, ok, x)
+        machine = status["machine"]
+
+        # Full-resolution bands as CSV: time plus <variable>_p<percentile> columns
+        table = {"time": times}
+        for vi, v in enumerate(variables):
+            for pi, p in enumerate(PERCENTILES):
+                table[f"{v}_p{p}"] = bands[pi, vi]
+        buffer = io.StringIO()
+        pd.DataFrame(table).to_csv(buffer, index=False)
+        bands_path = artifact_store.put_bytes(buffer.getvalue().encode(), "csv")
+        artifact_store.pin(bands_path, machine, "ensemble_bands")
+
+        thin = _thin(times)
+        return {
+            "bandsUrl": artifact_store.url(bands_path),
+            "times": _json_floats(times[thin]),
+            "bands": {
+                v: {
+                    "nominal": _json_floats(nominal[v].to_numpy(dtype=np.float64)[thin]),
+                    **{f"p{p}": _json_floats(bands[pi, vi, thin]) for pi, p in enumerate(PERCENTILES)},
+                }
+                for vi, v in enumerate(variables)
+            },
+            # Time-averaged SRC^2 (and its peak) per variable and parameter, with the linear fit's R^2
+            "sensitivity": {
+                v: {
+                    "r2": _finite(np.nanmean, r2[vi]),
+                    "parameters": {
+                        name: {"src2": _finite(np.nanmean, src2[di, vi]), "src2_max": _finite(np.nanmax, src2[di, vi])}
+                        for di, name in enumerate(names)
+                    },
+                }
+                for vi, v in enumerate(variables)
+            },
+        }
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Serves pipeline progress streams (GET /api/runs/<runId>/events) from one asyncio event
+loop, so open dashboards cost a future each instead of a gunicorn request thread.
+
+Runs beside the Flask app and reads the same PIPELINE_EVENTS_DIR, so it sees every run
+whichever worker publishes it. gunicorn.conf.py starts it on EVENTS_PORT; on its own:
+
+    cd server && python eventServer.py
+"""
+import os
+
+from aiohttp import web
+
+from logConfig import get_logger
+from pipelineEvents import event_bus, format_sse
+
+logger = get_logger(__name__)
+
+# Port of the event stream server; 0 turns it off (Flask then streams events itself)
+EVENTS_PORT = int(os.getenv("EVENTS_PORT", "8081"))
+
+HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+    # The dashboard is served from another origin, as with flask_cors on the app
+    "Access-Control-Allow-Origin": "*",
+}
+
+
+async def run_events(request: web.Request) -> web.StreamResponse:
+    run_id = request.match_info["run_id"]
+    # EventSource resends the last id it saw when reconnecting
+    try:
+        after = int(request.headers.get("Last-Event-ID") or request.query.get("after", 0))
+    except ValueError:
+        after = 0
+
+    response = web.StreamResponse(headers=dict(HEADERS, **{"Content-Type": "text/event-stream"}))
+    await response.prepare(request)
+    await response.write(b"retry: 2000\n\n")
+    try:
+        async for event in event_bus.subscribe_async(run_id, after):
+            await response.write(format_sse(event).encode())
+    except ConnectionResetError:
+        pass
+    return response
+
+
+async def health(request: web.Request) -> web.Response:
+    streams = sum(log.subscribers for log in list(event_bus.runs.values()))
+    return web.json_response({"status": "ok", "streams": streams})
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/api/runs/{run_id}/events", run_events)
+    app.router.add_get("/health", health)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), port=EVENTS_PORT, access_log=None)
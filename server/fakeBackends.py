@@ -0,0 +1,250 @@
+import glob
+import hashlib
+import itertools
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pandas import DataFrame
+
+from modelLibrary import parameters
+from pydanticModels import APIParameters, APIUsage, Content
+from rateLimiter import CHARS_PER_TOKEN, IMAGE_TOKEN_ESTIMATE
+from simWindows import elapsed, plan, run_segments, step_size, stitch
+from scheduler import slot
+from tracing import span
+
+# ===== Fake LLM =====
+# Replays recorded "<analysis>/<modelica_code>" responses with configurable latency, so the
+# pipeline can run without network access or API spend. Selected with vendor="fake".
+
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.5"))
+FAKE_LLM_SECONDS_PER_TOKEN = float(os.getenv("FAKE_LLM_SECONDS_PER_TOKEN", "0.0"))
+FAKE_LLM_RECORDINGS = os.getenv("FAKE_LLM_RECORDINGS")
+# Lifetime of an emulated prompt-cache entry, refreshed by every hit (Anthropic's is 5 minutes)
+FAKE_LLM_CACHE_TTL = float(os.getenv("FAKE_LLM_CACHE_TTL", "300"))
+LLM_RECORD_DIR = os.getenv("LLM_RECORD_DIR")
+
+DEFAULT_RESPONSE = """<analysis>
+Each measured variable relaxes towards its mean with a first-order lag.
+</analysis>
+<modelica_code>
+model Sys
+{declarations}
+equation
+{equations}
+end Sys;
+</modelica_code>"""
+
+
+def default_response(prompt: str) -> str:
+    """A generic first-order model over the columns named in the df.describe() header."""
+    columns = []
+    for line in prompt.splitlines():
+        names = line.split()
+        if names and all(re.fullmatch(r"x[0-9a-f]+", n) for n in names):
+            columns = names
+            break
+    columns = columns or ["x0"]
+    declarations = "\n".join(
+        f"  parameter Real tau_{c} = 100;\n  parameter Real mean_{c} = 0;\n  Real {c}(start = mean_{c});"
+        for c in columns
+    )
+    equations = "\n".join(f"  der({c}) = (mean_{c} - {c}) / tau_{c};" for c in columns)
+    return DEFAULT_RESPONSE.format(declarations=declarations, equations=equations)
+
+
+class FakeLLM:
+    def __init__(
+        self,
+        recordings: Optional[List[str]] = None,
+        latency: float = FAKE_LLM_LATENCY,
+        seconds_per_token: float = FAKE_LLM_SECONDS_PER_TOKEN,
+    ):
+        self.recordings = recordings or []
+        self.latency = latency
+        self.seconds_per_token = seconds_per_token
+        self._cycle = itertools.cycle(self.recordings) if self.recordings else None
+        self.lock = threading.Lock()
+        # Emulated prompt cache: prefix digest -> expiry
+        self._cache: Dict[str, float] = {}
+
+    @classmethod
+    def from_directory(cls, directory: str, **kwargs) -> "FakeLLM":
+        """Loads every *.txt file in directory as one recorded response, in name order."""
+        recordings = []
+        for path in sorted(glob.glob(os.path.join(directory, "*.txt"))):
+            with open(path, "r") as f:
+                recordings.append(f.read())
+        return cls(recordings, **kwargs)
+
+    def respond(self, params: APIParameters) -> Tuple[str, APIUsage]:
+        prompt = "\n".join(
+            part
+            for message in params.messages
+            for part in (message.content if isinstance(message.content, list) else [message.content])
+            if not isinstance(part, Content)
+        )
+        images = sum(
+            isinstance(part, Content)
+            for message in params.messages
+            for part in (message.content if isinstance(message.content, list) else [])
+        )
+        prompt_tokens = len(prompt) // CHARS_PER_TOKEN + images * IMAGE_TOKEN_ESTIMATE
+        cache_read, cache_creation = self._cached(params)
+        with self.lock:
+            content = next(self._cycle) if self._cycle else default_response(prompt)
+        input_tokens = prompt_tokens - cache_read - cache_creation
+        output_tokens = len(content) // 4
+        start = time.time()
+        time.sleep(self.latency + output_tokens * self.seconds_per_token)
+        usage = APIUsage(
+            model=params.model,
+            vendor="fake",
+            response_id=f"FAKE-{uuid.uuid4()}",
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            total_tokens=prompt_tokens + output_tokens,
+            cache_creation_input_tokens=cache_creation,
+            cache_read_input_tokens=cache_read,
+            request_status=200,
+            calling_function=params.calling_function,
+            timestamp=datetime.now(),
+            duration=time.time() - start,
+            rag_tokens=params.rag_tokens,
+        )
+        return content, usage
+
+    def _cached(self, params: APIParameters) -> Tuple[int, int]:
+        """(cache read, cache creation) tokens, following Anthropic's prefix caching rules."""
+        if not params.prompt_caching:
+            return 0, 0
+        # prompts imports utilityFunctions, which imports this module
+        from prompts import PROMPT_CACHE_MIN_TOKENS, cached_prefix_tokens
+
+        prefix = cached_prefix_tokens(params)
+        if prefix < PROMPT_CACHE_MIN_TOKENS:
+            return 0, 0
+        # Digest of every block up to the last breakpoint, i.e. the prefix that was cached
+        digest = hashlib.sha256(params.model.encode())
+        blocks = [
+            (message.role, part)
+            for message in params.messages
+            for part in (message.content if isinstance(message.content, list) else [message.content])
+        ]
+        last = max(
+            i for i, (role, part) in enumerate(blocks)
+            if role == "system" or (isinstance(part, Content) and part.cache_control)
+        )
+        for role, part in blocks[:last + 1]:
+            digest.update(role.encode())
+            digest.update((part.source.get("data", "") if isinstance(part, Content) else part).encode())
+        key, now = digest.hexdigest(), time.time()
+        with self.lock:
+            hit = self._cache.get(key, 0) > now
+            self._cache[key] = now + FAKE_LLM_CACHE_TTL
+        return (prefix, 0) if hit else (0, prefix)
+
+
+fake_llm = (
+    FakeLLM.from_directory(FAKE_LLM_RECORDINGS) if FAKE_LLM_RECORDINGS else FakeLLM()
+)
+
+
+def create_chat_completion_fake(params: APIParameters) -> Tuple[str, APIUsage]:
+    return fake_llm.respond(params)
+
+
+def record_response(content: Optional[str]):
+    """Saves a live response to LLM_RECORD_DIR so it can be replayed by FakeLLM later."""
+    if not LLM_RECORD_DIR or not content:
+        return
+    os.makedirs(LLM_RECORD_DIR, exist_ok=True)
+    path = os.path.join(LLM_RECORD_DIR, f"{time.time_ns()}.txt")
+    with open(path, "w") as f:
+        f.write(content)
+
+
+# ===== Fake simulator =====
+# Stands in for OMPython's build + simulate with a configurable cost model and returns a
+# DataFrame in the same layout as sim.sim (one column per variable, timestamp in seconds).
+
+FAKE_SIM_BUILD_SECONDS = float(os.getenv("FAKE_SIM_BUILD_SECONDS", "2.0"))
+FAKE_SIM_SECONDS_PER_SAMPLE = float(os.getenv("FAKE_SIM_SECONDS_PER_SAMPLE", "0.00001"))
+
+
+class FakeSimulator:
+    def __init__(
+        self,
+        build_seconds: float = FAKE_SIM_BUILD_SECONDS,
+        seconds_per_sample: float = FAKE_SIM_SECONDS_PER_SAMPLE,
+    ):
+        self.build_seconds = build_seconds
+        self.seconds_per_sample = seconds_per_sample
+
+    def compile(self, model: str) -> "FakeCompiledModel":
+        with slot("cpu"), span("sim.build"):
+            time.sleep(self.build_seconds)
+        return FakeCompiledModel(self, parameters(model))
+
+    def __call__(self, model: str, df: DataFrame, windows=None) -> Tuple[bool, DataFrame]:
+        # Same segmenting as sim.sim: build once, then one run per (parallel) segment
+        return False, self.compile(model).simulate(df, windows)
+
+
+class FakeCompiledModel:
+    """
+    sim.CompiledModel stand-in. Parameter overrides scale each variable's swing around its
+    mean, by the override's log-ratio to the model's value weighted 1, 1/2, 1/3... in the
+    model's parameter order, so ensembles and re-fits see a distinct response per parameter.
+    """
+
+    def __init__(self, simulator: FakeSimulator, nominal: Optional[Dict[str, float]] = None):
+        self.simulator = simulator
+        self.nominal = nominal or {}
+
+    def _gain(self, parameters: Optional[Dict[str, float]]) -> float:
+        exponent = 0.0
+        for j, (name, value) in enumerate(self.nominal.items()):
+            override = (parameters or {}).get(name)
+            if override is not None and value != 0 and override / value > 0:
+                exponent += np.log(override / value) / (j + 1)
+        return float(np.exp(exponent))
+
+    def simulate(self, df: DataFrame, windows=None, parameters=None) -> DataFrame:
+        dt = step_size(df)
+        t = elapsed(df)
+        ks = [k for k in df.keys() if k != "timestamp"]
+        gain = self._gain(parameters)
+
+        def run(segment):
+            window = segment.window
+            steps = np.arange(window.start, window.stop + dt / 2, dt)
+            with slot("cpu"), span("sim.segment", start=window.start, stop=window.stop):
+                time.sleep(len(steps) * self.simulator.seconds_per_sample)
+            inside = (t >= window.start) & (t <= window.stop)
+            rows = df[inside]
+            # A smoothed copy of the measurements looks like a plausible first-order fit
+            smoothed = rows[ks].interpolate(limit_direction="both").ewm(alpha=0.05).mean()
+            smoothed = smoothed.mean() + (smoothed - smoothed.mean()) * gain
+            sim = DataFrame({"timestamp": steps})
+            for k in ks:
+                if len(rows):
+                    sim[k] = np.interp(steps, t[inside], smoothed[k].to_numpy())
+                else:
+                    sim[k] = segment.initial.get(k, np.nan)
+            return sim[ks + ["timestamp"]]
+
+        segments = plan(df, windows)
+        return stitch(run_segments(run, segments), [s.window for s in segments])
+
+    def close(self):
+        pass
+
+
+fake_simulator = FakeSimulator()
@@ -0,0 +1,49 @@
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from multiRate import MultiRateDataset
+from simWindows import Window, in_windows
+
+# A simulation fits when its mean NRMSE (RMSE over each variable's measured range) is at most this
+FIT_ACCEPT_NRMSE = float(os.getenv("FIT_ACCEPT_NRMSE", "0.05"))
+
+
+def simulation_metrics(dataset: MultiRateDataset, simdf: pd.DataFrame, windows: Optional[List[Window]] = None) -> Dict[str, Any]:
+    """
+    Size of the simulated result, and RMSE and NRMSE of each variable it shares with the
+    measurements, compared at that field's own sample times inside the simulated windows.
+    """
+    metrics = {"rows": len(simdf), "columns": [k for k in simdf.keys() if k != "timestamp"], "rmse": {}, "nrmse": {}}
+    if "timestamp" not in simdf or simdf.empty:
+        return metrics
+    sim_t = simdf["timestamp"].to_numpy(dtype=float)
+    spans = [w.to_list() for w in windows] if windows else None
+    for f in dataset.fields:
+        if f.name in simdf:
+            t = dataset.elapsed(f)
+            inside = in_windows(t, spans)
+            if not inside.any():
+                continue
+            measured = f.v[inside]
+            simulated = np.interp(t[inside], sim_t, simdf[f.name].to_numpy(dtype=float))
+            rmse = float(np.sqrt(np.mean((simulated - measured) ** 2)))
+            # Flat signals are scaled by their level instead of a zero range
+            scale = float(np.ptp(measured)) or abs(float(np.mean(measured))) or 1.0
+            metrics["rmse"][f.name] = rmse
+            metrics["nrmse"][f.name] = rmse / scale
+    return metrics
+
+
+def fit_error(metrics: Dict[str, Any]) -> float:
+    """Mean NRMSE over the compared variables; inf when nothing (or a NaN result) was compared."""
+    values = list(metrics.get("nrmse", {}).values())
+    if not values or not np.all(np.isfinite(values)):
+        return float("inf")
+    return float(np.mean(values))
+
+
+def accepted(metrics: Dict[str, Any], threshold: float = FIT_ACCEPT_NRMSE) -> bool:
+    return fit_error(metrics) <= threshold
@@ -7,31 +7,87 @@ import prompts
 import json
 from pandas import DataFrame
 from dataScience import genimg
+from budget import RunBudget
+from rateLimiter import estimate_tokens
+from dataStats import describe
+from dynamicsFeatures import summarize
+from multiRate import MultiRateDataset
+from tracing import span
 
+USAGE_USER = "modelicaSim"
+# LLM_VENDOR=fake replays recorded responses offline (see fakeBackends.py)
+LLM_VENDOR = os.getenv("LLM_VENDOR", "anthropic")
+LLM_MODEL = os.getenv("LLM_MODEL", "claude-3-5-sonnet-20241022")
+# How dynamicsFeatures summaries enter prompts: "alongside" the plots, "replace" the plots, or "off"
+PROMPT_FEATURES = os.getenv("PROMPT_FEATURES", "alongside")
+# Cache the system prompt + source plot shared by a run's calls (0 turns it off); only used
+# when that prefix is long enough for the vendor to cache, otherwise writes would cost extra
+PROMPT_CACHING = os.getenv("PROMPT_CACHING", "1") == "1"
 
-def generateModelica(name: str, unit: str | None, df: DataFrame, last_run: None | tuple[str, DataFrame], iteration: int) -> str:
-    messages = (
-        prompts.generate_modelica_first_pass(str(df.describe()), genimg(df, name, unit))
-        if last_run is None
-        else prompts.generate_modelica_iteration(
-            str(df.describe()),
-            genimg(df, name, unit, iteration=iteration+1),
-            last_run[0],
-            str(last_run[1].describe()),
-            genimg(last_run[1], name + "_simulation", unit, iteration+1),
-        )
-    )
+
+def generateModelica(name: str, unit: str | None, df: DataFrame | MultiRateDataset, last_run: None | tuple[str, DataFrame | None] | tuple[str, DataFrame, str], iteration: int, budget: RunBudget | None = None, src_img: str | None = None, problems: str | None = None) -> str:
+    use_images = PROMPT_FEATURES != "replace"
+    use_features = PROMPT_FEATURES != "off"
+    # The source plot only depends on the data; render it once per run and reuse it
+    if src_img is None and use_images:
+        src_img = genimg(df, name, unit)
+    with span("prompt", iteration=iteration, features=PROMPT_FEATURES):
+        if last_run is None:
+            messages = prompts.generate_modelica_first_pass(
+                str(describe(df)),
+                src_img if use_images else None,
+                str(summarize(df)) if use_features else None,
+            )
+        else:
+            sim_img = None
+            # A model that failed validation comes back without a simulation, with its problems
+            simulated = last_run[1] is not None
+            if use_images and simulated:
+                # The runner passes the simulation plot it already rendered as a third element
+                sim_img = last_run[2] if len(last_run) > 2 else genimg(last_run[1], name + "_simulation", unit, iteration=iteration+1)
+            messages = prompts.generate_modelica_iteration(
+                str(describe(df)),
+                src_img if use_images else None,
+                last_run[0],
+                str(describe(last_run[1])) if simulated else "(not simulated)",
+                sim_img,
+                str(summarize(df)) if use_features else None,
+                str(summarize(last_run[1])) if use_features and simulated else None,
+                problems,
+            )
     params = APIParameters(
-        vendor="anthropic",
-        model="claude-3-5-sonnet-20241022",
+        vendor=LLM_VENDOR,
+        model=LLM_MODEL,
         messages=messages,
         temperature=0.4,
         max_tokens=4000,
         rag_tokens=0,
+        prompt_caching=PROMPT_CACHING,
+        session_id=budget.run_id if budget else None,
+        # Usage and budgets are keyed by machine id; display names are neither unique nor stable
+        machine_name=df.machine if isinstance(df, MultiRateDataset) else name,
     )
+    if params.prompt_caching and prompts.cached_prefix_tokens(params) < prompts.PROMPT_CACHE_MIN_TOKENS:
+        params.prompt_caching = False
+    if budget is not None:
+        # Raises BudgetExceeded if even the cheapest fallback model would overspend
+        params.model = budget.choose_model(
+            params.vendor,
+            params.model,
+            estimate_tokens(params) - params.max_tokens,
+            params.max_tokens,
+        )
 
-    completion_response = util.create_chat_completion(params, insert_usage=False)
-    response: str = completion_response[0]
+    try:
+        completion_response = util.create_chat_completion(params, user=USAGE_USER)
+    except BaseException:
+        if budget is not None:
+            budget.release()
+        raise
+    if budget is not None:
+        # Swaps the call's reservation for its real cost
+        budget.record(completion_response[1])
+    response: str = completion_response[0] or ""
 
     # Response is an XML string
     # Extract <analysis></analysis> and <modelica_code></modelica_code> into {"analysis": "", "modelica_code": ""}
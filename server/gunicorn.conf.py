@@ -0,0 +1,64 @@
+# Gunicorn settings for serving app.py in production:
+#     cd server && gunicorn -c gunicorn.conf.py wsgi:app
+import multiprocessing
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8080')}")
+chdir = BASE_DIR
+
+# Pipeline stages (rendering, C compiles, simulation) are CPU bound: one process per core.
+# Threads cover the I/O-bound part (LLM calls, image serving) inside each process.
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "8"))
+
+# Import pandas/matplotlib/LLM clients once in the master, then fork
+preload_app = True
+
+# A full Modelica pipeline run can take minutes
+timeout = int(os.getenv("WEB_TIMEOUT", "900"))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth from long-lived plotting state
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.getenv("ACCESS_LOG", "-")
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+
+# Every worker shares the same vendor API quota; rateLimiter divides limits by this
+os.environ["MODELICASIM_WORKERS"] = str(workers)
+
+# Live event streams are served by eventServer.py on its own event loop, so open
+# dashboards do not each hold one of the threads above; 0 streams from the workers
+events_port = int(os.getenv("EVENTS_PORT", "8081"))
+if events_port:
+    os.environ.setdefault("EVENTS_URL", f"http://localhost:{events_port}")
+_event_server = None
+
+
+def when_ready(server):
+    global _event_server
+    if events_port:
+        _event_server = subprocess.Popen(
+            [sys.executable, os.path.join(BASE_DIR, "eventServer.py")],
+            cwd=BASE_DIR, env=dict(os.environ, EVENTS_PORT=str(events_port)),
+        )
+
+
+def on_exit(server):
+    if _event_server is not None:
+        _event_server.terminate()
+
+
+def post_fork(server, worker):
+    # Threads started in the master (log listener) don't survive the fork
+    from logConfig import setup_logging
+
+    setup_logging()
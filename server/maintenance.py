@@ -0,0 +1,298 @@
+import datetime
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from artifactStore import artifact_store
+from datasetStore import dataset_store
+from fitMetrics import FIT_ACCEPT_NRMSE, accepted, fit_error, simulation_metrics
+from logConfig import get_logger
+from modelLibrary import model_library, refit
+from multiRate import MultiRateDataset
+from simWindows import Window
+from tracing import bind, span
+
+logger = get_logger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Seconds between maintenance passes; 0 (default) turns scheduled maintenance off
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", "0"))
+# Local time of day passes may start in, "HH:MM-HH:MM" (may wrap midnight); empty for any time
+MAINTENANCE_WINDOW = os.getenv("MAINTENANCE_WINDOW", "01:00-05:00")
+# Models are scored on this many of the latest seconds of their machine's data
+MAINTENANCE_DATA_SECONDS = float(os.getenv("MAINTENANCE_DATA_SECONDS", "86400"))
+# Past this error (mean NRMSE) after re-fitting, the model is regenerated by the LLM
+MAINTENANCE_REGENERATE_NRMSE = float(os.getenv("MAINTENANCE_REGENERATE_NRMSE", str(2 * FIT_ACCEPT_NRMSE)))
+# Caps per pass: machines checked, and full LLM pipeline runs started
+MAINTENANCE_MAX_MACHINES = int(os.getenv("MAINTENANCE_MAX_MACHINES", "200"))
+MAINTENANCE_MAX_REGENERATIONS = int(os.getenv("MAINTENANCE_MAX_REGENERATIONS", "10"))
+# A machine whose model and data are unchanged is re-checked after this long
+MAINTENANCE_RECHECK_SECONDS = float(os.getenv("MAINTENANCE_RECHECK_SECONDS", str(7 * 24 * 3600)))
+# Per-machine results of the last checks (kept outside the served artifact root)
+MAINTENANCE_STATE_PATH = os.getenv("MAINTENANCE_STATE_PATH", os.path.join(BASE_DIR, "maintenance.json"))
+
+# Maintenance yields every CPU and LLM slot to interactive and batch work
+MAINTENANCE_PRIORITY = "nightly"
+# Outcomes of checking one machine
+ACTIONS = ("ok", "refit", "regenerated", "degraded", "failed")
+
+
+def parse_window(spec: str) -> Optional[Tuple[datetime.time, datetime.time]]:
+    """ "01:00-05:00" -> (01:00, 05:00); None for an empty spec (any time).
+
+    Raises:
+        ValueError: If spec is not HH:MM-HH:MM.
+    """
+    if not spec.strip():
+        return None
+    try:
+        start, end = (datetime.time.fromisoformat(part.strip()) for part in spec.split("-"))
+    except ValueError:
+        raise ValueError(f"Invalid maintenance window {spec!r}; expected HH:MM-HH:MM")
+    return start, end
+
+
+def in_window(window: Optional[Tuple[datetime.time, datetime.time]], now: Optional[datetime.datetime] = None) -> bool:
+    if window is None:
+        return True
+    t = (now or datetime.datetime.now()).time()
+    start, end = window
+    return start <= t < end if start <= end else t >= start or t < end
+
+
+def data_version(machine: str, upload_path: str) -> str:
+    """Changes whenever the machine's data does: the stored history's version, else the upload's digest."""
+    if dataset_store.contains(machine):
+        return f"v{dataset_store.info(machine)['version']}"
+    return artifact_store.digest_of(upload_path)
+
+
+def latest_window(dataset: MultiRateDataset, seconds: float = MAINTENANCE_DATA_SECONDS) -> List[Window]:
+    """The last `seconds` of the data, in seconds from its first sample."""
+    duration = (dataset.end - dataset.start) / 1e9
+    return [Window(max(0.0, duration - seconds), duration)]
+
+
+class Maintenance:
+    """
+    Keeps stored models fitting their machines. Each pass scores every machine's latest
+    model on the latest window of its data (its datasetStore history, or its latest
+    upload) by re-simulating it. A model that no longer fits is first re-fitted locally
+    (modelLibrary.refit, no LLM). Only if it is still worse than
+    MAINTENANCE_REGENERATE_NRMSE is the full LLM pipeline re-run.
+
+    Scheduled passes run inside MAINTENANCE_WINDOW (stopping between machines once it
+    closes), check one machine at a time at "nightly" priority, and are capped in
+    machines and regenerations. A host-wide file lock lets
+    only one server process run a pass.
+    """
+
+    def __init__(self, interval: float = MAINTENANCE_INTERVAL, window: str = MAINTENANCE_WINDOW,
+                 state_path: str = MAINTENANCE_STATE_PATH):
+        self.interval = interval
+        self.window = parse_window(window)
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        self.running = False
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    # ===== State =====
+
+    def state(self) -> Dict[str, Dict[str, Any]]:
+        """Last check of each machine: action, errors before/after, model digest and data version."""
+        try:
+            with open(self.state_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save(self, state: Dict[str, Dict[str, Any]]):
+        directory = os.path.dirname(self.state_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    # ===== Checks =====
+
+    def check(self, machine: str, allow_regenerate: bool = True) -> Dict[str, Any]:
+        """Scores one machine's model and re-fits or regenerates it if needed; returns the outcome."""
+        from runner import keep, run_modelica_pipeline
+        from sim import compile_model
+
+        model_path = artifact_store.pinned(machine, "latest_model")
+        upload_path = artifact_store.pinned(machine, "upload")
+        record: Dict[str, Any] = {"checkedAt": datetime.datetime.now().isoformat()}
+        if model_path is None or upload_path is None:
+            return dict(record, action="failed", error="No model or upload stored")
+        record.update(model=artifact_store.digest_of(model_path), data=data_version(machine, upload_path))
+        with bind(machine=machine, priority=MAINTENANCE_PRIORITY), span("maintenance.check") as s:
+            with open(model_path) as f:
+                code = f.read()
+            # Only the chunks of the latest window are read from the machine's history
+            sliced = dataset_store.contains(machine)
+            if sliced:
+                dataset = dataset_store.last(machine, MAINTENANCE_DATA_SECONDS)
+            else:
+                dataset = MultiRateDataset.load(upload_path)
+            windows = latest_window(dataset)
+            df = dataset.aligned()
+            compiled = compile_model(code)
+            try:
+                metrics = simulation_metrics(dataset, compiled.simulate(df, windows), windows)
+                record["error"] = fit_error(metrics)
+                if accepted(metrics):
+                    s.set(action="ok")
+                    return dict(record, action="ok")
+                fitted, _, refit_metrics, evaluations = refit(compiled, code, dataset, df, windows)
+            finally:
+                compiled.close()
+            record.update(refitError=fit_error(refit_metrics), evaluations=evaluations)
+            if fit_error(refit_metrics) < record["error"]:
+                # Keep the better parameters even if a regeneration follows
+                run_id = f"maintenance-{int(time.time())}"
+                fitted_path = artifact_store.put_bytes(fitted.encode(), "mo", refs=[("run", run_id, "model_refit")])
+                keep(fitted_path, run_id, machine, "latest_model")
+                record["model"] = artifact_store.digest_of(fitted_path)
+                if accepted(refit_metrics):
+                    model_library.add(machine, dataset, fitted, refit_metrics)
+                    s.set(action="refit")
+                    return dict(record, action="refit")
+            if fit_error(refit_metrics) <= MAINTENANCE_REGENERATE_NRMSE or not allow_regenerate:
+                s.set(action="degraded")
+                return dict(record, action="degraded")
+            run_id = str(uuid.uuid4())
+            if sliced:
+                # The windows count from the slice's first sample, so the run gets the scored slice as its upload
+                upload_path = artifact_store.put_bytes(
+                    json.dumps(dataset.to_dict()).encode(), "json", refs=[("run", run_id, "upload")]
+                )
+            run_modelica_pipeline(
+                upload_path, run_id=run_id, windows=[w.to_list() for w in windows], priority=MAINTENANCE_PRIORITY
+            )
+            s.set(action="regenerated")
+            return dict(record, action="regenerated", runId=run_id)
+
+    def run_pass(self, window: Optional[Tuple[datetime.time, datetime.time]] = None) -> Dict[str, int]:
+        """
+        Checks the machines due for it, least recently checked first; returns counts per
+        action. With a window, machines left when it closes wait for the next pass.
+        """
+        with self.lock:
+            if self.running:
+                return {}
+            self.running = True
+        try:
+            with _host_lock(self.state_path + ".lock") as acquired:
+                if not acquired:
+                    return {}
+                return self._pass(window)
+        finally:
+            with self.lock:
+                self.running = False
+
+    def _pass(self, window: Optional[Tuple[datetime.time, datetime.time]]) -> Dict[str, int]:
+        state = self.state()
+        now = time.time()
+        due = []
+        for machine in artifact_store.machines("latest_model"):
+            model_path = artifact_store.pinned(machine, "latest_model")
+            upload_path = artifact_store.pinned(machine, "upload")
+            last = state.get(machine, {})
+            unchanged = (
+                model_path is not None and upload_path is not None
+                and last.get("model") == artifact_store.digest_of(model_path)
+                and last.get("data") == data_version(machine, upload_path)
+            )
+            if unchanged and now - last.get("checkedTs", 0) < MAINTENANCE_RECHECK_SECONDS:
+                continue
+            due.append((last.get("checkedTs", 0), machine))
+        counts = {action: 0 for action in ACTIONS}
+        regenerations = 0
+        with span("maintenance.pass", due=len(due)):
+            for _, machine in sorted(due)[:MAINTENANCE_MAX_MACHINES]:
+                if window is not None and not in_window(window):
+                    logger.info("Maintenance window closed; %s and later machines wait for the next pass", machine)
+                    break
+                try:
+                    record = self.check(machine, allow_regenerate=regenerations < MAINTENANCE_MAX_REGENERATIONS)
+                except Exception as e:
+                    logger.exception("Maintenance of %s failed", machine)
+                    record = {"checkedAt": datetime.datetime.now().isoformat(), "action": "failed", "error": str(e)}
+                record["checkedTs"] = time.time()
+                regenerations += record["action"] == "regenerated"
+                counts[record["action"]] += 1
+                state[machine] = record
+                self._save(state)
+        logger.info("Maintenance pass: %s", counts)
+        return counts
+
+    # ===== Scheduling =====
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            if not in_window(self.window):
+                continue
+            try:
+                self.run_pass(self.window)
+            except Exception:
+                logger.exception("Maintenance pass failed")
+
+    def start_pass(self) -> bool:
+        """Runs a pass now in the background, whatever the time; False if one is already running."""
+        if self.running:
+            return False
+        threading.Thread(target=self.run_pass, name="maintenance-pass", daemon=True).start()
+        return True
+
+    def ensure_started(self):
+        """Starts the scheduler thread in this process (again after a fork) if an interval is set."""
+        if self.interval <= 0 or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self.lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._thread = threading.Thread(target=self._loop, name="maintenance", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.state()
+        counts = {action: 0 for action in ACTIONS}
+        for record in state.values():
+            counts[record.get("action", "failed")] = counts.get(record.get("action", "failed"), 0) + 1
+        return {"machines": len(state), "running": self.running, "lastActions": counts}
+
+
+class _host_lock:
+    """Non-blocking exclusive flock; yields whether it was acquired."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def __enter__(self) -> bool:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, "w")
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self.file.close()
+            self.file = None
+            return False
+
+    def __exit__(self, *exc):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+
+
+maintenance = Maintenance()
@@ -0,0 +1,309 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+
+from dynamicsFeatures import DynamicsSummary, MAX_EVENTS, summarize
+from fitMetrics import accepted, fit_error, simulation_metrics
+from logConfig import get_logger
+from multiRate import MultiRateDataset
+from simWindows import Window
+from tracing import span
+
+logger = get_logger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Set to 0 to always start runs from the LLM
+MODEL_LIBRARY_ENABLED = os.getenv("MODEL_LIBRARY_ENABLED", "1").lower() not in ("0", "false", "no")
+MODEL_LIBRARY_DB_PATH = os.getenv("MODEL_LIBRARY_DB_PATH", os.path.join(BASE_DIR, "model_library.db"))
+# Prior models tried (nearest first) before a run falls back to the LLM
+MODEL_LIBRARY_TOP_K = int(os.getenv("MODEL_LIBRARY_TOP_K", "3"))
+# Candidates further than this (RMS difference per signature feature) are not tried
+MODEL_LIBRARY_MAX_DISTANCE = float(os.getenv("MODEL_LIBRARY_MAX_DISTANCE", "0.5"))
+# Simulations spent re-fitting one candidate's parameters
+MODEL_LIBRARY_REFIT_EVALS = int(os.getenv("MODEL_LIBRARY_REFIT_EVALS", "40"))
+# Accepted models kept per machine; older ones are dropped
+MAX_MODELS_PER_MACHINE = 5
+# Nelder-Mead's first simplex moves each parameter by this factor (in log space for nonzero values)
+REFIT_INITIAL_STEP = 0.2
+
+# Numeric literal parameters: `parameter Real k_heating(unit="1/s") = 0.5 "..."`
+_PARAMETER = re.compile(
+    r"(\bparameter\s+Real\s+(\w+)\s*(?:\([^)]*\))?\s*=\s*)([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"
+)
+
+
+# ===== Signatures =====
+
+
+def feature_vector(summary: DynamicsSummary) -> np.ndarray:
+    """
+    Fixed-length description of a dataset's dynamics, roughly unit-scaled per entry, so
+    two machines of the same kind land close together. Columns are taken in upload order.
+    """
+    values = [np.log10(max(summary.duration, 1e-3)) / 2, np.log10(max(summary.dt, 1e-3))]
+    for c in summary.columns:
+        span_ = c.maximum - c.minimum
+        level = (c.maximum + c.minimum) / 2
+        taus = [s.time_constant for s in c.steps if s.time_constant]
+        values += [
+            np.sign(level) * np.log10(1 + abs(level)),
+            np.log10(1e-6 + span_),
+            (c.end - c.start) / span_ if span_ > 0 else 0.0,
+            len(c.steps) / MAX_EVENTS,
+            np.log10(float(np.median(taus))) if taus else 0.0,
+            c.periodic_power or 0.0,
+            np.log10(1 / c.dominant_frequency) / 2 if c.dominant_frequency else 0.0,
+        ]
+    return np.asarray(values, dtype=np.float32)
+
+
+@dataclass
+class Signature:
+    """What a stored model is looked up by: unit and column count must match exactly."""
+
+    unit: str
+    columns: int
+    features: np.ndarray
+
+    @classmethod
+    def of(cls, dataset: MultiRateDataset) -> "Signature":
+        return cls(str(dataset.unit), len(dataset.fields), feature_vector(summarize(dataset)))
+
+
+@dataclass
+class LibraryModel:
+    id: int
+    machine: str
+    code: str
+    metrics: Dict[str, Any]
+    distance: float = 0.0
+
+
+@dataclass
+class WarmStart:
+    """A prior model re-fitted to a new upload, with its simulation and scores."""
+
+    code: str
+    simdf: pd.DataFrame
+    metrics: Dict[str, Any]
+    source: LibraryModel
+    evaluations: int
+
+
+# ===== Parameter re-fitting =====
+
+
+def parameters(code: str) -> Dict[str, float]:
+    """The model's parameters with literal numeric values."""
+    return {m.group(2): float(m.group(3)) for m in _PARAMETER.finditer(code)}
+
+
+def with_parameters(code: str, values: Dict[str, float]) -> str:
+    """The model source with those parameters' literal values replaced."""
+
+    def substitute(m: re.Match) -> str:
+        name = m.group(2)
+        return f"{m.group(1)}{values[name]:.6g}" if name in values else m.group(0)
+
+    return _PARAMETER.sub(substitute, code)
+
+
+def refit(compiled, code: str, dataset: MultiRateDataset, df: pd.DataFrame, windows: Optional[List[Window]],
+          max_evals: int = MODEL_LIBRARY_REFIT_EVALS) -> Tuple[str, pd.DataFrame, Dict[str, Any], int]:
+    """
+    Tunes a built model's literal parameters to the dataset with Nelder-Mead, each
+    evaluation one simulation with parameter overrides (no rebuild). Nonzero parameters
+    are searched in log space so they keep their sign and scale.
+
+    Returns:
+        The source with fitted values, its simulation, metrics and the evaluations used.
+    """
+    start = parameters(code)
+    names = list(start)
+    p0 = np.array([start[k] for k in names], dtype=np.float64)
+    log_scaled = p0 != 0
+    best: Dict[str, Any] = {"error": float("inf"), "values": {}, "simdf": None, "metrics": {}}
+    evaluations = 0
+
+    def values_at(z: np.ndarray) -> Dict[str, float]:
+        p = np.where(log_scaled, p0 * np.exp(z), z)
+        return dict(zip(names, p.tolist()))
+
+    def objective(z: np.ndarray) -> float:
+        nonlocal evaluations
+        evaluations += 1
+        values = values_at(z)
+        try:
+            simdf = compiled.simulate(df, windows, values)
+        except Exception as e:
+            logger.debug("Re-fit evaluation failed: %s", e)
+            return float("inf")
+        metrics = simulation_metrics(dataset, simdf, windows)
+        error = fit_error(metrics)
+        if error < best["error"]:
+            best.update(error=error, values=values, simdf=simdf, metrics=metrics)
+        return error
+
+    z0 = np.zeros(len(names))
+    first = objective(z0)
+    if names and max_evals > 1 and np.isfinite(first) and not accepted(best["metrics"]):
+        simplex = np.vstack([z0, z0 + REFIT_INITIAL_STEP * np.eye(len(names))])
+        minimize(
+            objective, z0, method="Nelder-Mead",
+            options={"maxfev": max_evals - 1, "initial_simplex": simplex, "fatol": 1e-4},
+        )
+    if best["simdf"] is None:
+        raise RuntimeError("Model could not be simulated on this dataset")
+    return with_parameters(code, best["values"]), best["simdf"], best["metrics"], evaluations
+
+
+# ===== Library =====
+
+
+class ModelLibrary:
+    """
+    Accepted models with their dataset signatures, in a small SQLite file. Lookups scan
+    the (unit, column count) bucket's feature matrix, cached in memory per process and
+    reloaded when another process adds to the bucket.
+    """
+
+    def __init__(self, db_path: str = MODEL_LIBRARY_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        # (unit, columns) -> ((count, max id), ids, feature matrix)
+        self._buckets: Dict[Tuple[str, int], Tuple[Tuple[int, int], np.ndarray, np.ndarray]] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def connect(self) -> sqlite3.Connection:
+        # One connection per thread (and per process after a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS models ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, machine TEXT, unit TEXT, columns INTEGER, "
+            "features BLOB, code TEXT, code_digest TEXT, metrics TEXT, error REAL, created REAL, "
+            "UNIQUE (machine, code_digest))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS models_bucket ON models (unit, columns)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def add(self, machine: str, dataset: MultiRateDataset, code: str, metrics: Dict[str, Any]) -> None:
+        """Stores an accepted model for the machine, keeping its MAX_MODELS_PER_MACHINE most recent."""
+        signature = Signature.of(dataset)
+        conn = self.connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO models "
+            "(machine, unit, columns, features, code, code_digest, metrics, error, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                machine, signature.unit, signature.columns, signature.features.tobytes(), code,
+                hashlib.sha256(code.encode()).hexdigest(), json.dumps(metrics, default=float),
+                fit_error(metrics), time.time(),
+            ),
+        )
+        conn.execute(
+            "DELETE FROM models WHERE machine = ? AND id NOT IN "
+            "(SELECT id FROM models WHERE machine = ? ORDER BY created DESC LIMIT ?)",
+            (machine, machine, MAX_MODELS_PER_MACHINE),
+        )
+
+    def _bucket(self, unit: str, columns: int) -> Tuple[np.ndarray, np.ndarray]:
+        conn = self.connect()
+        version = conn.execute(
+            "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM models WHERE unit = ? AND columns = ?", (unit, columns)
+        ).fetchone()
+        with self.lock:
+            cached = self._buckets.get((unit, columns))
+        if cached is not None and cached[0] == tuple(version):
+            return cached[1], cached[2]
+        rows = conn.execute(
+            "SELECT id, features FROM models WHERE unit = ? AND columns = ?", (unit, columns)
+        ).fetchall()
+        ids = np.array([r[0] for r in rows], dtype=np.int64)
+        matrix = (
+            np.stack([np.frombuffer(r[1], dtype=np.float32) for r in rows])
+            if rows else np.empty((0, 0), dtype=np.float32)
+        )
+        with self.lock:
+            self._buckets[(unit, columns)] = (tuple(version), ids, matrix)
+        return ids, matrix
+
+    def nearest(self, signature: Signature, k: int = MODEL_LIBRARY_TOP_K,
+                max_distance: float = MODEL_LIBRARY_MAX_DISTANCE) -> List[LibraryModel]:
+        """Up to k stored models for the same unit and column count, nearest signature first."""
+        ids, matrix = self._bucket(signature.unit, signature.columns)
+        if not len(ids) or matrix.shape[1] != len(signature.features):
+            return []
+        distances = np.sqrt(np.mean((matrix - signature.features) ** 2, axis=1))
+        order = [i for i in np.argsort(distances)[:k] if distances[i] <= max_distance]
+        if not order:
+            return []
+        rows = {
+            r[0]: r
+            for r in self.connect().execute(
+                f"SELECT id, machine, code, metrics FROM models WHERE id IN ({','.join('?' * len(order))})",
+                [int(ids[i]) for i in order],
+            )
+        }
+        return [
+            LibraryModel(r[0], r[1], r[2], json.loads(r[3]), float(distances[i]))
+            for i in order
+            if (r := rows.get(int(ids[i]))) is not None
+        ]
+
+    def warm_start(self, dataset: MultiRateDataset, df: pd.DataFrame, windows: Optional[List[Window]] = None,
+                   k: int = MODEL_LIBRARY_TOP_K) -> Optional[WarmStart]:
+        """
+        Re-fits the k nearest prior models to the dataset and returns the first one that
+        is accepted (fitMetrics.accepted), or None if there is none and the run needs the LLM.
+        """
+        from sim import compile_model
+
+        with span("library.search") as s:
+            candidates = self.nearest(Signature.of(dataset), k)
+            s.set(candidates=len(candidates))
+        for candidate in candidates:
+            with span("library.refit", source=candidate.machine, distance=round(candidate.distance, 4)) as s:
+                try:
+                    compiled = compile_model(candidate.code)
+                    try:
+                        code, simdf, metrics, evaluations = refit(compiled, candidate.code, dataset, df, windows)
+                    finally:
+                        compiled.close()
+                except Exception as e:
+                    logger.info("Library model %d did not simulate for %s: %s", candidate.id, dataset.name, e)
+                    continue
+                s.set(evaluations=evaluations, error=fit_error(metrics))
+            if accepted(metrics):
+                with self.lock:
+                    self.hits += 1
+                return WarmStart(code, simdf, metrics, candidate, evaluations)
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        models = self.connect().execute("SELECT COUNT(*) FROM models").fetchone()[0]
+        with self.lock:
+            return {"models": models, "hits": self.hits, "misses": self.misses}
+
+
+model_library = ModelLibrary()
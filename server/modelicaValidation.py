@@ -0,0 +1,403 @@
+import os
+import queue
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from logConfig import get_logger
+from scheduler import slot
+from tracing import span
+
+logger = get_logger(__name__)
+
+# "structural" (default): fast source checks only; "omc": also OpenModelica's checkModel
+# on a pooled session; "off": send every model straight to the simulator
+MODELICA_VALIDATION = os.getenv("MODELICA_VALIDATION", "structural")
+# OMC sessions kept per server process for checkModel
+MODELICA_CHECK_SESSIONS = int(os.getenv("MODELICA_CHECK_SESSIONS", "1"))
+
+MODEL_NAME = "Sys"
+SCALAR_TYPES = ("Real", "Integer", "Boolean")
+# Prefixes that make a declaration something other than an unknown the equations must solve
+FIXED_PREFIXES = {"parameter", "constant", "input"}
+DECLARATION_PREFIXES = FIXED_PREFIXES | {"discrete", "output", "final", "flow", "stream", "inner", "outer"}
+KEYWORDS = {
+    "if", "then", "else", "elseif", "end", "when", "elsewhen", "for", "in", "loop", "while",
+    "and", "or", "not", "true", "false", "time", "annotation",
+}
+
+_COMMENTS = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRINGS = re.compile(r'"(?:[^"\\]|\\.)*"')
+_SECTION = re.compile(
+    r"\b(initial\s+equation|initial\s+algorithm|equation|algorithm|public|protected)\b"
+)
+_DECLARATION = re.compile(
+    r"^((?:(?:%s)\s+)*)([A-Za-z_][\w.]*)\s*(\[[^\]]*\])?\s+(.+)$" % "|".join(sorted(DECLARATION_PREFIXES)),
+    re.DOTALL,
+)
+# The start of a class definition nested in the model (function, record, block, ...)
+_CLASS = re.compile(
+    r"\b(?:(?:encapsulated|partial|final|replaceable|redeclare|inner|outer|pure|impure)\s+)*"
+    r"(model|block|function|record|connector|type|package|class|"
+    r"operator\s+record|operator\s+function|operator|expandable\s+connector)\s+([A-Za-z_]\w*)\s*(=)?"
+)
+# An identifier not preceded by '.' (so qualified names are taken whole) with what follows it
+_IDENTIFIER = re.compile(r"(?<![\w.])([A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*)\s*(\(?)")
+# An equation's "=", not "==", "<=", ">=", "<>" or ":="
+_EQUALS = re.compile(r"(?<![=<>:])=(?!=)")
+
+
+@dataclass
+class Variable:
+    name: str
+    type: str
+    prefixes: Tuple[str, ...]
+    array: bool
+
+    @property
+    def unknown(self) -> bool:
+        return not FIXED_PREFIXES.intersection(self.prefixes)
+
+
+@dataclass
+class ValidationResult:
+    """What is wrong with a generated model, phrased for the refinement prompt."""
+
+    errors: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+    equations: Optional[int] = None
+    unknowns: Optional[int] = None
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "ok": self.ok, "errors": self.errors, "warnings": self.warnings,
+            "equations": self.equations, "unknowns": self.unknowns,
+        }
+
+    def __str__(self) -> str:
+        return "\n".join([f"- error: {e}" for e in self.errors] + [f"- warning: {w}" for w in self.warnings])
+
+
+# ===== Structural checks =====
+
+
+def _strip(code: str) -> str:
+    """The source without comments, and with string literals emptied (so ';' etc. in them don't count)."""
+    return _STRINGS.sub('""', _COMMENTS.sub(" ", code))
+
+
+def _split_top_level(text: str, separator: str) -> List[str]:
+    """Splits text at separators outside (), [] and {}."""
+    parts, depth, start = [], 0, 0
+    for i, ch in enumerate(text):
+        if ch in "([{":
+            depth += 1
+        elif ch in ")]}":
+            depth -= 1
+        elif ch == separator and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _unbalanced(text: str) -> Optional[str]:
+    stack = []
+    pairs = {")": "(", "]": "[", "}": "{"}
+    for ch in text:
+        if ch in "([{":
+            stack.append(ch)
+        elif ch in pairs:
+            if not stack or stack.pop() != pairs[ch]:
+                return f"Unmatched '{ch}'"
+    return f"Unclosed '{stack[-1]}'" if stack else None
+
+
+def _nested_classes(body: str, result: ValidationResult) -> Tuple[str, List[str]]:
+    """
+    The model body with nested class definitions cut out (their declarations and sections
+    are not the model's), and the names of those classes.
+    """
+    names = []
+    while True:
+        match = _CLASS.search(body)
+        if match is None:
+            return body, names
+        kind, class_name = " ".join(match.group(1).split()), match.group(2)
+        names.append(class_name)
+        if match.group(3):
+            # Short definition: type Voltage = Real(unit="V");
+            stop = len(_split_top_level(body[match.end():], ";")[0]) + match.end() + 1
+        else:
+            end = re.compile(r"\bend\s+%s\s*;" % re.escape(class_name)).search(body, match.end())
+            if end is None:
+                result.errors.append(f"The nested {kind} '{class_name}' does not close with 'end {class_name};'")
+                return body[:match.start()], names
+            stop = end.end()
+        body = body[:match.start()] + " " + body[stop:]
+
+
+def _declarations(section: str, result: ValidationResult) -> Tuple[Dict[str, Variable], int, bool]:
+    """
+    Variables declared in a section, how many unknowns get a binding equation there
+    (`Real y = 2 * x;`), and whether all of them are flat scalars of builtin types.
+    """
+    variables: Dict[str, Variable] = {}
+    bindings = 0
+    flat = True
+    for statement in _split_top_level(section, ";"):
+        statement = " ".join(statement.split())
+        if not statement or statement.startswith("annotation"):
+            continue
+        if statement.startswith(("extends ", "import ")):
+            flat = False
+            continue
+        match = _DECLARATION.match(statement)
+        if match is None:
+            result.errors.append(f"Cannot parse the declaration '{statement[:80]}'")
+            continue
+        prefixes = tuple(match.group(1).split())
+        type_name, type_dims, rest = match.group(2), match.group(3), match.group(4)
+        if type_name not in SCALAR_TYPES:
+            # Components (Modelica.Blocks..., connectors) bring equations we cannot count here
+            flat = False
+        for component in _split_top_level(rest, ","):
+            name = re.match(r"\s*([A-Za-z_]\w*)\s*(\[)?", component)
+            if name is None:
+                result.errors.append(f"Cannot parse the declaration '{statement[:80]}'")
+                continue
+            array = bool(type_dims or name.group(2))
+            flat = flat and not array
+            if name.group(1) in variables:
+                result.errors.append(f"'{name.group(1)}' is declared more than once")
+            variables[name.group(1)] = Variable(name.group(1), type_name, prefixes, array)
+            if variables[name.group(1)].unknown and len(_split_top_level(component, "=")) > 1:
+                bindings += 1
+    return variables, bindings, flat
+
+
+def _count_equations(section: str, result: ValidationResult) -> Tuple[int, List[str], bool]:
+    """
+    Equations in an equation section (an if/when-equation counts its first branch), the
+    statements' text for the identifier check, and whether the count is exact.
+    """
+    count = 0
+    exact = True
+    # One entry per open if/when/for: whether equations inside still count
+    blocks: List[bool] = []
+    texts = []
+    for statement in _split_top_level(section, ";"):
+        s = " ".join(statement.split())
+        if not s:
+            continue
+        if s.startswith("annotation"):
+            continue
+        texts.append(s)
+        head = s.split(" ", 1)[0]
+        if head == "end":
+            if blocks:
+                blocks.pop()
+            continue
+        counting = all(blocks)
+        if head in ("if", "when"):
+            blocks.append(True)
+            s = s.split(" then ", 1)[1] if " then " in s else ""
+        elif head == "for":
+            exact = False
+            blocks.append(True)
+            s = s.split(" loop ", 1)[1] if " loop " in s else ""
+        elif head in ("elseif", "else", "elsewhen"):
+            if blocks:
+                blocks[-1] = False
+            counting = all(blocks)
+            s = s.split(" then ", 1)[1] if " then " in s else s[len(head):].strip()
+        if s.startswith(("connect", "assert", "terminate", "reinit")):
+            exact = exact and not s.startswith("connect")
+            continue
+        if counting and _EQUALS.search(s):
+            count += 1
+        elif s and counting and not _EQUALS.search(s):
+            result.errors.append(f"'{s[:80]}' in the equation section is not an equation")
+    if blocks:
+        result.errors.append("An if/when/for block in the equation section is missing its 'end'")
+    return count, texts, exact
+
+
+def check_structure(code: str, columns: Sequence[str], name: str = MODEL_NAME) -> ValidationResult:
+    """
+    Checks a model's source without OpenModelica: that it is model `name`, declares every
+    data column as a variable, uses only declared names, and (for flat models of scalar
+    Real/Integer/Boolean variables) has one equation per unknown.
+    """
+    result = ValidationResult()
+    if not code or not code.strip():
+        result.errors.append("The response contained no Modelica code inside <modelica_code> tags")
+        return result
+    text = _strip(code)
+    problem = _unbalanced(text)
+    if problem:
+        result.errors.append(f"{problem} bracket in the model source")
+        return result
+
+    # Helper classes may be defined before the model itself
+    header = re.search(r"\bmodel\s+(%s)\b" % re.escape(name), text) or re.search(r"\bmodel\s+([A-Za-z_]\w*)", text)
+    if header is None:
+        result.errors.append(f"No 'model {name}' declaration found")
+        return result
+    if header.group(1) != name:
+        result.errors.append(f"The model is named '{header.group(1)}'; it must be named '{name}'")
+    end = re.search(r"\bend\s+%s\s*;" % re.escape(header.group(1)), text)
+    if end is None:
+        result.errors.append(f"The model does not close with 'end {header.group(1)};'")
+        body = text[header.end():]
+    else:
+        body = text[header.end():end.start()]
+    # Skip the optional description string after the model name
+    body = re.sub(r'^\s*""', "", body)
+    errors = len(result.errors)
+    body, classes = _nested_classes(body, result)
+    if len(result.errors) > errors:
+        # The rest of the body cannot be told apart from the unclosed class
+        return result
+
+    parts = _SECTION.split(body)
+    variables: Dict[str, Variable] = {}
+    flat = True
+    equations = 0
+    equation_texts: List[str] = []
+    kind = "public"
+    for i, part in enumerate(parts):
+        if i % 2 == 1:
+            kind = " ".join(part.split())
+            continue
+        if kind in ("public", "protected"):
+            declared, bindings, section_flat = _declarations(part, result)
+            equations += bindings
+            for duplicate in set(declared) & set(variables):
+                result.errors.append(f"'{duplicate}' is declared more than once")
+            variables.update(declared)
+            flat = flat and section_flat
+        elif kind == "equation":
+            count, texts, exact = _count_equations(part, result)
+            equations += count
+            equation_texts += texts
+            flat = flat and exact
+        elif kind == "algorithm":
+            flat = False
+        elif kind == "initial equation":
+            equation_texts += [" ".join(s.split()) for s in _split_top_level(part, ";")]
+
+    for column in columns:
+        variable = variables.get(column)
+        if variable is None:
+            result.errors.append(f"Data column '{column}' is not declared as a variable of the model")
+        elif not variable.unknown:
+            result.errors.append(f"Data column '{column}' is declared as a {' '.join(variable.prefixes)}; it must be a variable")
+
+    undeclared = set()
+    for statement in equation_texts:
+        for identifier, call in _IDENTIFIER.findall(statement):
+            if call or "." in identifier or identifier in KEYWORDS or identifier in classes:
+                continue
+            if identifier not in variables:
+                undeclared.add(identifier)
+    if undeclared:
+        result.errors.append(f"Undeclared names used in equations: {', '.join(sorted(undeclared))}")
+
+    unknowns = [v.name for v in variables.values() if v.unknown]
+    if flat:
+        result.equations, result.unknowns = equations, len(unknowns)
+        if equations != len(unknowns):
+            result.errors.append(
+                f"The model has {equations} equation(s) for {len(unknowns)} unknown variable(s) "
+                f"({', '.join(unknowns)}); it needs exactly one equation per variable"
+            )
+    else:
+        result.warnings.append("Equation count not checked (arrays, components, loops or algorithms)")
+    return result
+
+
+# ===== OpenModelica checkModel =====
+
+
+class OmcCheckPool:
+    """
+    OMC sessions reused across checks. Each check loads the source, runs checkModel and
+    deletes the class again, which costs milliseconds instead of a build's C compile.
+    """
+
+    def __init__(self, size: int = MODELICA_CHECK_SESSIONS):
+        self.size = max(1, size)
+        self._idle: "queue.Queue" = queue.Queue()
+        self._created = 0
+        self._pid: Optional[int] = None
+        self.lock = threading.Lock()
+
+    def _acquire(self):
+        with self.lock:
+            if self._pid != os.getpid():
+                # Sessions talk to an omc process over a socket that must not be shared after a fork
+                self._idle = queue.Queue()
+                self._created = 0
+                self._pid = os.getpid()
+            if self._idle.empty() and self._created < self.size:
+                from OMPython import OMCSessionZMQ
+
+                self._created += 1
+                return OMCSessionZMQ()
+        return self._idle.get()
+
+    def check(self, code: str, name: str = MODEL_NAME) -> List[str]:
+        """checkModel's errors for the source (empty when it checks out)."""
+        session = self._acquire()
+        healthy = True
+        try:
+            escaped = code.replace("\\", "\\\\").replace('"', '\\"')
+            if not session.sendExpression(f'loadString("{escaped}")'):
+                return [e for e in str(session.sendExpression("getErrorString()")).strip().splitlines() if e]
+            message = str(session.sendExpression(f"checkModel({name})") or "")
+            errors = str(session.sendExpression("getErrorString()") or "").strip()
+            session.sendExpression(f"deleteClass({name})")
+            if "completed successfully" in message:
+                return []
+            return [line for line in (errors or message).splitlines() if line.strip()] or [
+                f"checkModel({name}) failed"
+            ]
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            if healthy:
+                self._idle.put(session)
+            else:
+                with self.lock:
+                    self._created -= 1
+
+
+omc_check_pool = OmcCheckPool()
+
+
+def validate(code: str, columns: Sequence[str], name: str = MODEL_NAME, mode: str = MODELICA_VALIDATION) -> ValidationResult:
+    """
+    Checks a generated model before it is built and simulated: structurally, then (with
+    mode "omc" and a structurally sound model) with OpenModelica's checkModel.
+    """
+    if mode == "off":
+        return ValidationResult()
+    with span("validate", mode=mode) as s:
+        result = check_structure(code, columns, name)
+        if result.ok and mode == "omc":
+            try:
+                with slot("cpu"):
+                    result.errors += omc_check_pool.check(code, name)
+            except Exception as e:
+                # An unusable checker should not block runs; the build reports real errors
+                logger.warning("checkModel unavailable: %s", e)
+                result.warnings.append("OpenModelica checkModel could not run")
+        s.set(ok=result.ok, errors=len(result.errors))
+    return result
@@ -0,0 +1,336 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from tracing import traced
+
+# aligned() grids are coarsened past this many points, so one fast sensor on a long
+# recording cannot blow up the dense frame
+MAX_ALIGNED_POINTS = 200_000
+# Load uploads and stored history in the compact layout (see MultiRateDataset.compact)
+DATASET_COMPACT = os.getenv("DATASET_COMPACT", "0") == "1"
+# Compact values drop to float32 when that moves no sample by more than this share of the field's range
+DATASET_FLOAT32_TOLERANCE = float(os.getenv("DATASET_FLOAT32_TOLERANCE", "1e-6"))
+
+
+@dataclass
+class FieldSeries:
+    """
+    One sensor's samples: sorted, unique UTC timestamps (int64 ns) and float64 values
+    (float32 and read-only in a compact dataset, where t may be shared with other fields).
+
+    name is the positional column (x0, x1, ...) models refer to; key is the upload
+    field's stable "key" or "id", which stored history is filed under.
+    """
+
+    name: str
+    label: str
+    t: np.ndarray
+    v: np.ndarray
+    key: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    @property
+    def nbytes(self) -> int:
+        return self.t.nbytes + self.v.nbytes
+
+    def times(self) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(self.t.astype("datetime64[ns]")).tz_localize("UTC")
+
+    def median_interval(self) -> Optional[int]:
+        steps = np.diff(self.t)
+        return int(np.median(steps)) if len(steps) else None
+
+    def window(self, start: Optional[int], end: Optional[int]) -> "FieldSeries":
+        lo = 0 if start is None else np.searchsorted(self.t, start, side="left")
+        hi = len(self.t) if end is None else np.searchsorted(self.t, end, side="right")
+        return FieldSeries(self.name, self.label, self.t[lo:hi], self.v[lo:hi], self.key)
+
+
+def _parse_field(name: str, label: str, nums: List[Dict[str, Any]], key: Optional[str] = None) -> FieldSeries:
+    created = pd.to_datetime(
+        [n.get("createdAt") if isinstance(n, dict) else None for n in nums],
+        utc=True,
+        format="ISO8601",
+        errors="coerce",
+    )
+    values = pd.to_numeric(
+        pd.Series([n.get("value") if isinstance(n, dict) else None for n in nums], dtype=object),
+        errors="coerce",
+    ).to_numpy(dtype=np.float64)
+    t = created.as_unit("ns").asi8
+    valid = ~created.isna() & ~np.isnan(values)
+    if not valid.all():
+        print(f"Warning: skipped {int((~valid).sum())} invalid data points in field {name} ({label})")
+    t, v = t[valid], values[valid]
+    # Sorted with the last value winning for repeated timestamps, as a dict keyed by time would
+    order = np.argsort(t, kind="stable")
+    t, v = t[order], v[order]
+    if len(t) > 1:
+        last = np.append(t[1:] != t[:-1], True)
+        t, v = t[last], v[last]
+    return FieldSeries(name, label, t, v, key)
+
+
+class MultiRateDataset:
+    """
+    A machine upload kept as one (time, value) array pair per field.
+
+    Sensors that sample at different rates or offsets cost sum(samples) here, where the
+    union-indexed DataFrame from load_json costs union(samples) x fields, mostly NaN.
+    Fields are aligned only when a consumer asks for a common grid (aligned()), and
+    frame() still produces the exact load_json layout for code that wants it.
+
+    `name` is for display; `machine` (the upload's "id", or the name if it has none)
+    is the stable key that stored artifacts, history and models are filed under.
+    """
+
+    def __init__(self, name: str, unit: Optional[str], fields: List[FieldSeries], id: Optional[str] = None):
+        self.name = name
+        self.unit = unit
+        self.fields = fields
+        self.id = id
+        self._union: Optional[np.ndarray] = None
+        self._fingerprint: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MultiRateDataset":
+        fields = []
+        # Columns are named x0, x1, ... by position, counting fields that end up empty
+        for idx, field in enumerate(data["fields"]):
+            key = field.get("key") or field.get("id")
+            series = _parse_field(hex(idx)[1:], field.get("name", ""), field.get("nums", []), str(key) if key else None)
+            if len(series):
+                fields.append(series)
+        if not fields:
+            raise ValueError("No valid timestamps found in the data")
+        return cls(data["name"], data.get("unit", "N/A"), fields, str(data["id"]) if data.get("id") else None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The upload JSON from_dict reads: fields in order, with their keys and labels."""
+        fields = []
+        for f in self.fields:
+            created = np.datetime_as_string(f.t.astype("datetime64[ns]"), unit="ns").tolist()
+            field = {"name": f.label, "nums": [{"createdAt": c + "Z", "value": v} for c, v in zip(created, f.v.tolist())]}
+            if f.key:
+                field["key"] = f.key
+            fields.append(field)
+        data = {"name": self.name, "unit": self.unit, "fields": fields}
+        if self.id:
+            data["id"] = self.id
+        return data
+
+    @classmethod
+    def load(cls, path: str) -> "MultiRateDataset":
+        with open(path, "r") as file:
+            return cls.from_dict(json.load(file))
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, name: str = "", unit: Optional[str] = None) -> "MultiRateDataset":
+        """Splits a union-indexed frame (timestamp + value columns) back into per-field arrays."""
+        t = pd.DatetimeIndex(df["timestamp"]).as_unit("ns").asi8
+        fields = []
+        for column in df.columns:
+            if column == "timestamp":
+                continue
+            v = df[column].to_numpy(dtype=np.float64)
+            ok = ~np.isnan(v)
+            fields.append(FieldSeries(str(column), str(column), t[ok], v[ok]))
+        return cls(name, unit, fields)
+
+    @property
+    def machine(self) -> str:
+        return self.id or self.name
+
+    # ===== Size =====
+
+    @property
+    def columns(self) -> List[str]:
+        return [f.name for f in self.fields]
+
+    def series(self) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+        """(column, timestamps as int64 ns, values) for every field."""
+        for f in self.fields:
+            yield f.name, f.t, f.v
+
+    def union_times(self) -> np.ndarray:
+        if self._union is None:
+            self._union = np.unique(np.concatenate([f.t for f in self.fields]))
+        return self._union
+
+    def __len__(self) -> int:
+        return len(self.union_times())
+
+    def fingerprint(self) -> str:
+        """sha1 of every field's name, timestamps and values, for cache keys."""
+        if self._fingerprint is None:
+            h = hashlib.sha1(usedforsecurity=False)
+            for f in self.fields:
+                h.update(f.name.encode() + b"\0")
+                h.update(str(len(f)).encode())
+                h.update(np.ascontiguousarray(f.t).data)
+                h.update(np.ascontiguousarray(f.v).data)
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
+    def elapsed(self, f: FieldSeries) -> np.ndarray:
+        """A field's timestamps as seconds since the dataset's first sample."""
+        return (f.t - self.start) / 1e9
+
+    @property
+    def samples(self) -> int:
+        return sum(len(f) for f in self.fields)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the arrays the fields hold, each counted once however many fields share it."""
+        owners = {}
+        for f in self.fields:
+            for a in (f.t, f.v):
+                while isinstance(a.base, np.ndarray):
+                    a = a.base
+                owners[id(a)] = a.nbytes
+        return sum(owners.values())
+
+    def dense_nbytes(self) -> int:
+        """Bytes the union-indexed frame would take (timestamps + one float64 per field per row)."""
+        return len(self) * 8 * (1 + len(self.fields))
+
+    def fill_ratio(self) -> float:
+        """Share of the union frame's cells that hold a value."""
+        return self.samples / (len(self) * len(self.fields))
+
+    @property
+    def start(self) -> int:
+        return min(int(f.t[0]) for f in self.fields)
+
+    @property
+    def end(self) -> int:
+        return max(int(f.t[-1]) for f in self.fields)
+
+    def finest_interval(self) -> Optional[int]:
+        """Smallest median sampling interval of any field, in ns."""
+        intervals = [i for i in (f.median_interval() for f in self.fields) if i]
+        return min(intervals) if intervals else None
+
+    # ===== Views =====
+
+    def compact(self, tolerance: Optional[float] = DATASET_FLOAT32_TOLERANCE) -> "MultiRateDataset":
+        """
+        The same samples in less memory, for holding many machines per worker. Fields with
+        identical timestamps share one time array and keep their values as rows of one
+        contiguous 2-D block; the block is float32 when every one of its fields survives
+        the cast within tolerance x its range (None keeps float64). All arrays are
+        read-only, so the views can be handed around without defensive copies.
+        """
+        groups: Dict[bytes, List[FieldSeries]] = {}
+        for f in self.fields:
+            key = hashlib.sha1(np.ascontiguousarray(f.t).data, usedforsecurity=False).digest()
+            groups.setdefault(key, []).append(f)
+        compacted = {}
+        for members in groups.values():
+            t = np.array(members[0].t, dtype=np.int64)
+            t.flags.writeable = False
+            dtype = np.float32 if tolerance is not None and all(_fits_float32(f.v, tolerance) for f in members) else np.float64
+            block = np.empty((len(members), len(t)), dtype=dtype)
+            for row, f in zip(block, members):
+                row[:] = f.v
+            block.flags.writeable = False
+            for f, row in zip(members, block):
+                compacted[f.name] = FieldSeries(f.name, f.label, t, row, f.key)
+        return MultiRateDataset(self.name, self.unit, [compacted[f.name] for f in self.fields], self.id)
+
+    def window(self, start=None, end=None) -> "MultiRateDataset":
+        """Fields restricted to [start, end] (timestamps, ns or anything pd.Timestamp accepts)."""
+        start = None if start is None else to_ns(start)
+        end = None if end is None else to_ns(end)
+        fields = [f.window(start, end) for f in self.fields]
+        return MultiRateDataset(self.name, self.unit, [f for f in fields if len(f)], self.id)
+
+    def frame(self) -> pd.DataFrame:
+        """The union-indexed DataFrame load_json has always returned (timestamp + x0, x1, ...)."""
+        union = self.union_times()
+        df = pd.DataFrame({"timestamp": pd.DatetimeIndex(union.astype("datetime64[ns]")).tz_localize("UTC").as_unit("us")})
+        for f in self.fields:
+            column = np.full(len(union), np.nan)
+            column[np.searchsorted(union, f.t)] = f.v
+            df[f.name] = column
+        return df
+
+    def grid(
+        self, step: Optional[int] = None, start=None, end=None, max_points: int = MAX_ALIGNED_POINTS
+    ) -> np.ndarray:
+        """
+        Evenly spaced timestamps (ns) over [start, end], by default at the finest field rate,
+        widened if needed to stay within max_points.
+        """
+        start = self.start if start is None else to_ns(start)
+        end = self.end if end is None else to_ns(end)
+        step = step or self.finest_interval() or max(end - start, 1)
+        step = max(step, -(-(end - start) // max(max_points - 1, 1)))
+        return np.arange(start, end + 1, step, dtype=np.int64)
+
+    def aligned(
+        self,
+        times: Optional[Sequence] = None,
+        method: str = "linear",
+        columns: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        All (or the named) fields on one time grid, as a dense timestamp + value frame.
+
+        Args:
+            times: Timestamps (int64 ns) to align to; defaults to grid().
+            method (str): "linear" interpolation, or "previous" to hold the last sample
+                (zero-order hold, for switching signals). Outside a field's samples the
+                value is NaN.
+            columns (List[str], optional): Subset of fields to include.
+        """
+        if method not in ("linear", "previous"):
+            raise ValueError(f"Unknown alignment method {method!r}; expected 'linear' or 'previous'")
+        times = self.grid() if times is None else np.asarray(times, dtype=np.int64)
+        fields = [f for f in self.fields if columns is None or f.name in columns]
+        # Filled column by column into one 2-D block, so the frame holds a single float64 block
+        block = np.empty((len(times), len(fields)), dtype=np.float64, order="F")
+        for i, f in enumerate(fields):
+            if method == "linear":
+                block[:, i] = np.interp(times, f.t, f.v, left=np.nan, right=np.nan)
+            else:
+                idx = np.searchsorted(f.t, times, side="right") - 1
+                block[:, i] = np.where(idx >= 0, f.v[np.maximum(idx, 0)], np.nan)
+        df = pd.DataFrame(block, columns=[f.name for f in fields], copy=False)
+        df.insert(0, "timestamp", pd.DatetimeIndex(times.astype("datetime64[ns]")).tz_localize("UTC"))
+        return df
+
+
+def _fits_float32(v: np.ndarray, tolerance: float) -> bool:
+    if v.dtype == np.float32:
+        return True
+    if not len(v):
+        return True
+    scale = float(np.ptp(v)) or float(np.abs(v).max()) or 1.0
+    return bool(np.abs(v.astype(np.float32).astype(np.float64) - v).max() <= tolerance * scale)
+
+
+def to_ns(value) -> int:
+    """A timestamp (int ns, or anything pd.Timestamp accepts; naive means UTC) as int64 ns."""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize("UTC")
+    return int(ts.as_unit("ns").value)
+
+
+@traced("ingest")
+def load_dataset(path: str, compact: bool = DATASET_COMPACT) -> MultiRateDataset:
+    """Reads an uploaded machine JSON file without aligning its fields (compact() if asked)."""
+    dataset = MultiRateDataset.load(path)
+    return dataset.compact() if compact else dataset
@@ -0,0 +1,276 @@
+import asyncio
+import bisect
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from logConfig import get_logger
+
+logger = get_logger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EVENTS_DIR = os.getenv("PIPELINE_EVENTS_DIR", os.path.join(BASE_DIR, "generated_graphs", "runs"))
+# Runs kept in memory per process; older ones are re-read from their event file on demand
+MAX_RUNS = 256
+# Latest events kept in memory per run (the event file keeps them all)
+MAX_EVENTS_PER_RUN = 2000
+HEARTBEAT_SECONDS = 15.0
+TAIL_INTERVAL = 0.25
+
+TERMINAL_EVENTS = ("run_finished", "run_failed")
+
+
+class RunLog:
+    """
+    Ordered events of one pipeline run. Event ids count up from 1 in the order events
+    were written to the run's event file, whichever process wrote them.
+    """
+
+    def __init__(self, run_id: str, local: bool):
+        self.run_id = run_id
+        # local: this process is publishing the run; otherwise events are tailed from disk
+        self.local = local
+        self.events: List[Dict[str, Any]] = []
+        self.last_id = 0
+        self.finished = False
+        # Bytes of the event file already read into events
+        self.offset = 0
+        self.subscribers = 0
+        self.condition = threading.Condition()
+        # Futures of async subscribers waiting for the next event, with their event loops
+        self.waiters: List[Any] = []
+
+    def append(self, event: Dict[str, Any]):
+        with self.condition:
+            if event["id"] <= self.last_id:
+                return
+            self.events.append(event)
+            self.last_id = event["id"]
+            if len(self.events) > MAX_EVENTS_PER_RUN:
+                del self.events[0]
+            if event["type"] in TERMINAL_EVENTS:
+                self.finished = True
+            self.condition.notify_all()
+            for loop, waiter in self.waiters:
+                loop.call_soon_threadsafe(_wake, waiter)
+            self.waiters = []
+
+    def since(self, after: int) -> List[Dict[str, Any]]:
+        """Events kept in memory with id > after; call with condition held."""
+        return self.events[bisect.bisect_right(self.events, after, key=lambda e: e["id"]):]
+
+
+class EventBus:
+    """
+    Per-run event logs for pipeline progress, shared by every subscriber in the process.
+
+    Publishing appends to memory and to EVENTS_DIR/<run_id>.jsonl, so a subscriber
+    connected to a different gunicorn worker than the one running the pipeline still
+    sees every event: one tail thread per process reads the files of the remote runs
+    that have subscribers and wakes those subscribers.
+
+    subscribe() blocks its thread on a condition variable; subscribe_async() waits on a
+    future instead, so eventServer.py serves any number of streams from one event loop
+    without holding a thread per subscriber.
+    """
+
+    def __init__(self, directory: str = EVENTS_DIR):
+        self.directory = directory
+        self.runs: "OrderedDict[str, RunLog]" = OrderedDict()
+        self.lock = threading.Lock()
+        self._tail_thread: Optional[threading.Thread] = None
+        self._tail_pid: Optional[int] = None
+
+    def path(self, run_id: str) -> str:
+        return os.path.join(self.directory, f"{os.path.basename(run_id)}.jsonl")
+
+    def _get(self, run_id: str, local: bool) -> RunLog:
+        with self.lock:
+            log = self.runs.get(run_id)
+            if log is None:
+                log = self.runs[run_id] = RunLog(run_id, local)
+                if len(self.runs) > MAX_RUNS:
+                    for old_id, old in list(self.runs.items()):
+                        if old.subscribers == 0 and (old.finished or not old.local):
+                            del self.runs[old_id]
+                            break
+            elif local:
+                log.local = True
+            self.runs.move_to_end(run_id)
+            return log
+
+    def publish(self, run_id: str, event_type: str, **data) -> Dict[str, Any]:
+        """Appends an event to a run's log, persists it and wakes the run's subscribers."""
+        log = self._get(run_id, local=True)
+        os.makedirs(self.directory, exist_ok=True)
+        with log.condition, open(self.path(run_id), "a+b") as f:
+            # Locked from reading the last id to appending, so another process (or this
+            # log re-created after eviction) continues the file's ids instead of reusing them
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self._read_from(log, f)
+                event = {
+                    "id": log.last_id + 1,
+                    "type": event_type,
+                    "time": time.time(),
+                    "data": data,
+                }
+                line = (json.dumps(event, default=str) + "\n").encode()
+                f.write(line)
+                f.flush()
+                log.offset += len(line)
+                log.append(event)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return event
+
+    def _ensure_tail_thread(self):
+        with self.lock:
+            if self._tail_thread is not None and self._tail_pid == os.getpid():
+                return
+            self._tail_thread = threading.Thread(target=self._tail, name="pipeline-events-tail", daemon=True)
+            self._tail_pid = os.getpid()
+            self._tail_thread.start()
+
+    def _read_new(self, log: RunLog):
+        # Under the log's lock: the tail thread and subscribers may read the same run at once
+        with log.condition:
+            try:
+                with open(self.path(log.run_id), "rb") as f:
+                    self._read_from(log, f)
+            except FileNotFoundError:
+                return
+
+    def _read_from(self, log: RunLog, f):
+        """Appends the events written past log.offset; call with log.condition held."""
+        f.seek(log.offset)
+        chunk = f.read()
+        # Only whole lines; a partially written one is picked up on the next pass
+        end = chunk.rfind(b"\n") + 1
+        if end == 0:
+            return
+        log.offset += end
+        for line in chunk[:end].splitlines():
+            try:
+                log.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning("Skipping corrupt event in %s", self.path(log.run_id))
+
+    def _tail(self):
+        while True:
+            with self.lock:
+                remote = [log for log in self.runs.values() if not log.local and log.subscribers and not log.finished]
+            for log in remote:
+                self._read_new(log)
+            time.sleep(TAIL_INTERVAL)
+
+    def events(self, run_id: str, after: int = 0) -> List[Dict[str, Any]]:
+        """Events recorded so far with id > after (reading the event file if needed)."""
+        log = self._get(run_id, local=False)
+        if not log.local:
+            self._read_new(log)
+        with log.condition:
+            return log.since(after)
+
+    def subscribe(self, run_id: str, after: int = 0, heartbeat: float = HEARTBEAT_SECONDS) -> Iterator[Optional[Dict[str, Any]]]:
+        """
+        Yields a run's events with id > after as they are published, ending after the
+        terminal event. Yields None every heartbeat seconds while nothing happens, so
+        callers can keep their connection alive.
+        """
+        log = self._get(run_id, local=False)
+        with log.condition:
+            log.subscribers += 1
+        if not log.local:
+            self._read_new(log)
+            self._ensure_tail_thread()
+        try:
+            position = after
+            while True:
+                with log.condition:
+                    if log.last_id <= position and not log.finished:
+                        log.condition.wait(timeout=heartbeat)
+                    pending = log.since(position)
+                    finished = log.finished
+                if pending:
+                    for event in pending:
+                        yield event
+                    position = pending[-1]["id"]
+                elif finished:
+                    return
+                else:
+                    yield None
+        finally:
+            with log.condition:
+                log.subscribers -= 1
+
+    async def subscribe_async(self, run_id: str, after: int = 0,
+                              heartbeat: float = HEARTBEAT_SECONDS) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """subscribe() for an asyncio event loop: waiting costs a future, not a thread."""
+        loop = asyncio.get_running_loop()
+        log = self._get(run_id, local=False)
+        with log.condition:
+            log.subscribers += 1
+        if not log.local:
+            # The first read of the event file happens off the loop
+            await loop.run_in_executor(None, self._read_new, log)
+            self._ensure_tail_thread()
+        try:
+            position = after
+            while True:
+                waiter = None
+                with log.condition:
+                    pending = log.since(position)
+                    finished = log.finished
+                    if not pending and not finished:
+                        waiter = loop.create_future()
+                        log.waiters.append((loop, waiter))
+                if waiter is not None:
+                    try:
+                        await asyncio.wait_for(waiter, timeout=heartbeat)
+                    except asyncio.TimeoutError:
+                        with log.condition:
+                            if (loop, waiter) in log.waiters:
+                                log.waiters.remove((loop, waiter))
+                        yield None
+                    continue
+                if pending:
+                    for event in pending:
+                        yield event
+                    position = pending[-1]["id"]
+                else:
+                    return
+        finally:
+            with log.condition:
+                log.subscribers -= 1
+
+
+def _wake(waiter: "asyncio.Future"):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+event_bus = EventBus()
+
+
+def publish(run_id: Optional[str], event_type: str, **data) -> Optional[Dict[str, Any]]:
+    """Module-level shortcut; a None run_id means nobody can subscribe, so nothing is recorded."""
+    if run_id is None:
+        return None
+    try:
+        return event_bus.publish(run_id, event_type, **data)
+    except OSError as e:
+        # Progress reporting must never break a pipeline run
+        logger.warning("Could not publish %s event for run %s: %s", event_type, run_id, e)
+        return None
+
+
+def format_sse(event: Optional[Dict[str, Any]]) -> str:
+    """Server-Sent Events wire format; None becomes a comment line used as a heartbeat."""
+    if event is None:
+        return ": keep-alive\n\n"
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
@@ -1,15 +1,19 @@
 import utilityFunctions as util
 import os
 import sys
-import base64
 from typing import List
-from pydanticModels import ChatMessage, Content
+from pydanticModels import APIParameters, ChatMessage, Content
+from contentCache import image_cache
+from rateLimiter import CHARS_PER_TOKEN, IMAGE_TOKEN_ESTIMATE
 
 
 DIR = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(DIR)
 sys.path.append(parent)
 
+# Anthropic caches no prefix shorter than this (1024 for Sonnet/Opus, 2048 for Haiku)
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+
 
 def example() -> List[ChatMessage]:
     system = """
@@ -26,104 +30,108 @@ def example() -> List[ChatMessage]:
     return messages
 
 
-def generate_modelica_first_pass(
-    df_describe: str, image_file_path: str
-) -> List[ChatMessage]:
-    image_media_type = "image/png"
-    image_data = base64.standard_b64encode(open(image_file_path, "rb").read()).decode(
-        "utf-8"
-    )
-    image_source = {
-        "type": "base64",
-        "media_type": image_media_type,
-        "data": image_data,
-    }
-    image_content = Content(type="image", source=image_source)
-
-    system = """
+# One system prompt for every call of a run, so it and the source plot after it form a
+# prefix that is byte-identical across the first pass and each iteration (and cacheable)
+SYSTEM = """
     You are working at an engineering firm to help understand and simulate industrial systems. You have extensive experience with Modelica, a differential equation programming language and numerical solver for modeling physical systems.
 
     You are working with some output data from sensors of an industrial machine, which is a time series dataset. This represents the output of the sensors over time.
-    The idea here is to create a modelica model that can simulate the machine.
+    The idea here is to create a modelica model that can simulate the machine, which will consist of a set of numerically solvable differential equations.
 
-    You will be given the following:
+    You will be given the following about the source data:
      1. a df.describe() (Python pandas dataframe) string of the data.
-     2. an image of the resulting plot of the data.
+     2. an image of the resulting plot of the data, and/or a dynamics summary measured from the data: start/end levels, max rate of change, step events with first-order time constants (tau), dominant frequencies and cross-correlation lags between variables.
 
-    You will need to create a modelica model that can simulate the machine, which will consist of a set of numerically solvable differential equations
+    The task is either to create the first model, or to improve the model tried last. When improving a model you are also given:
+     3. the modelica source code that was tried last
+     4. a df.describe string of the simulation results
+     5. an image of the simulation results, and/or a dynamics summary of them
+    If the last model failed validation it was not simulated; you get the problems found instead of simulation results, and must fix them first.
 
-    Complete this task by following these instructions:
-    1. Look at the image paying specific attention to the differential relationships between variables over time
-    2. Think, write your analysis of the differential relationships between variables
-    3. Generate the modelica code representing the system
-    - Variable names used in the model should match the names from the original data frame
+    Rules for the modelica code:
     - the model must be named Sys
-    - the variable names must match the source dataframe
+    - the variable names must match the names from the source dataframe
+    - when improving a model, the model name and variable names shouldn't be changed
 
     You need to return your reasoning/analysis of the provided image and data, and the modelica code you generated in a string. Return this in XML format:
-    
+
     <analysis></analysis>
     <modelica_code></modelica_code>
     """
 
+
+def generate_modelica_first_pass(
+    df_describe: str, image_file_path: str | None, features: str | None = None
+) -> List[ChatMessage]:
+    # Cache breakpoint: system prompt + source image are identical across calls
+    image_content = img(image_file_path, cache=True) if image_file_path else None
+
     user = f"""
+    Task: create the first model.
+    1. Look at the image and the dynamics summary paying specific attention to the differential relationships between variables over time
+    2. Think, write your analysis of the differential relationships between variables
+    3. Generate the modelica code representing the system
+
     df.describe() output:
     {df_describe}
     """
+    if features:
+        user += f"""
+    dynamics summary:
+    {features}
+    """
     # Convert the system and user strings to a Messages object
     messages = util.convert_to_messages(
-        user=user, system=system, image_content=image_content
+        user=user, system=SYSTEM, image_content=image_content
     )
     # Get the parameters to call the OpenAI API
 
     return messages
 
 
-def img(path: str):
-    return Content(
-        type="image",
-        source={
-            "type": "base64",
-            "media_type": "image/png",
-            "data": base64.standard_b64encode(open(path, "rb").read()).decode("utf-8"),
-        },
+def img(path: str, cache: bool = False) -> Content:
+    # Encoded payloads are memoized by path/mtime, so unchanged images are read once
+    return image_cache.content(
+        path, cache_control={"type": "ephemeral"} if cache else None
     )
 
 
+def cached_prefix_tokens(params: APIParameters) -> int:
+    """
+    Estimated tokens of the prefix prompt caching would cache: the system prompt and every
+    block up to the last one carrying cache_control. 0 if no block is marked.
+    """
+    tokens = marked = 0
+    for message in params.messages:
+        parts = message.content if isinstance(message.content, list) else [message.content]
+        for part in parts:
+            if isinstance(part, Content):
+                tokens += IMAGE_TOKEN_ESTIMATE
+                if part.cache_control:
+                    marked = tokens
+            else:
+                tokens += len(part) // CHARS_PER_TOKEN
+                if message.role == "system":
+                    marked = tokens
+    return marked
+
+
 def generate_modelica_iteration(
     src_desc: str,
-    src_img: str,
+    src_img: str | None,
     sim_model: str,
     sim_desc: str,
-    sim_img: str,
+    sim_img: str | None,
+    src_features: str | None = None,
+    sim_features: str | None = None,
+    problems: str | None = None,
 ) -> List[ChatMessage]:
-    system = """
-    You are working at an engineering firm to help understand and simulate industrial systems. You have extensive experience with Modelica, a differential equation programming language and numerical solver for modeling physical systems.
-
-    You are working on writing a set of differential equations in modelica and just finished running a simulation to compare them with the baseline sensor data
-
-    You will be given the following:
-     1. a df.describe() (Python pandas dataframe) string of the data.
-     2. an image of the resulting plot of the data.
-     3. the modelica source code that was tried last
-     4. a df.describe string of the simulation results
-     5. an image of the simulation results
-
-    You must update the modelica model to make it more accurately model the source data
-
-    Complete this task by following these instructions:
+    user = f"""
+    Task: improve the model tried last.
     1. Compare the source data and simulation results
     2. Think, write your analysis of the differential relationships between variables. pay special attention to where the simulated results don't align with the source data
     3. update the modelica model's parameters & equation in order to make it better simulate the source data
-    - the model name and variable names shouldn't be changed
-
-    You need to return your reasoning/analysis of the provided image and data, and the modelica code you generated in a string. Return this in XML format:
-    
-    <analysis></analysis>
-    <modelica_code></modelica_code>
-    """
 
-    user = f"""
     source df.describe() output:
     {src_desc}
 
@@ -133,9 +141,27 @@ def generate_modelica_iteration(
     sim df.describe() output:
     {sim_desc}
     """
+    if src_features:
+        user += f"""
+    source dynamics summary:
+    {src_features}
+    """
+    # A model that failed validation has no simulation to summarize
+    if sim_features:
+        user += f"""
+    sim dynamics summary:
+    {sim_features}
+    """
+    if problems:
+        user += f"""
+    problems found in the current model (it was not simulated):
+    {problems}
+    """
+    # The source image comes first, right after the system prompt, as in the first pass
+    images = ([img(src_img, cache=True)] if src_img else []) + ([img(sim_img)] if sim_img else [])
     # Convert the system and user strings to a Messages object
     messages = util.convert_to_messages(
-        user=user, system=system, image_content=[img(src_img), img(sim_img)]
+        user=user, system=SYSTEM, image_content=images or None
     )
     # Get the parameters to call the OpenAI API
 
@@ -203,6 +203,8 @@ import httpx
 class Content(BaseModel):
     type: str
     source: Dict[str, Any]
+    # Anthropic prompt-caching breakpoint, e.g. {"type": "ephemeral"}
+    cache_control: Optional[Dict[str, str]] = None
 
 class ChatMessage(BaseModel):
     role: str
@@ -227,9 +229,12 @@ class APIParameters(BaseModel):
     max_retries: Optional[int] = Field(default=1)  # Instructor specific
     # Anthropic specific:
     stop_sequences: Optional[List[str]] = Field(default=None)
+    prompt_caching: bool = Field(default=False, description="Cache the system prompt and marked content blocks")
 
     # Metadata for cost analysis and logging
     calling_function: Optional[str] = None
+    session_id: Optional[str] = None
+    machine_name: Optional[str] = None
     rag_tokens: int = Field(..., description="Number of RAG tokens")
 
     
@@ -243,6 +248,7 @@ class APIParameters(BaseModel):
 class APIUsage(BaseModel):
     response_id: str = Field(..., description="Unique identifier for the record. Primary key.")
     session_id: Optional[str] = Field(default=None, description="Unique identifier for the session.")
+    machine_name: Optional[str] = Field(default=None, description="Machine the request was made for")
     calling_function: str = Field(..., description="Name of the Python function that initiated the request")
     vendor: str = Field(..., description="The vendor used for the request")
     model: str = Field(..., description="The LLM model used for the request")
@@ -252,6 +258,8 @@ class APIUsage(BaseModel):
     rag_tokens: Optional[int] = Field(..., description="Number of RAG tokens")
     output_tokens: Optional[int] = Field(..., description="Number of completion tokens")
     total_tokens: Optional[int] = Field(..., description="Total number of tokens used in the request")
+    cache_creation_input_tokens: Optional[int] = Field(None, description="Prompt tokens written to the provider's prompt cache")
+    cache_read_input_tokens: Optional[int] = Field(None, description="Prompt tokens served from the provider's prompt cache")
 
     input_cost: Optional[float] = None
     rag_cost: Optional[float] = None
@@ -260,38 +268,41 @@ class APIUsage(BaseModel):
 
     request_status: Optional[int] = Field(None, description="Status of the API request")
     error_message: Optional[str] = Field(None, description="Error message if the request failed")
+    retry_after: Optional[float] = Field(None, description="Seconds the vendor asked to wait after a 429 (not stored)")
     duration: Optional[float] = Field(None, description="Duration of the API request in seconds")
 
     api_key_name: Optional[str] = Field(None, description="Name of the API key used for the request")
     timestamp: datetime.datetime = Field(default=None, description="Timestamp of the API request")
 
-    # @model_validator(mode='after')
-    # def compute_cost(self) -> 'APIUsage':
-    #     # Don't recompute if the cost is already set
-    #     if self.total_cost is not None:
-    #         return self
-    #     # Open the JSON file and load pricing data
-    #     # with open("src.utils.api_pricing.json", "r") as file:
-    #     #     pricing_data = json.load(file)
-        
-    #     # Access the vendor and model specific pricing information
-    #     try:
-    #         model_pricing = pricing_data[self.vendor][self.model]
-    #     except KeyError:
-    #         return self
-    #         raise ValueError(f"Pricing data not found for model {self.model} and vendor {self.vendor}")
-        
-    #     # Calculate costs
-    #     self.input_cost = (self.input_tokens / 1e6) * float(model_pricing["input_price"])
-    #     self.output_cost = (self.output_tokens / 1e6) * float(model_pricing["output_price"])
-    #     self.total_cost = self.input_cost + self.output_cost
-    #     return self
-    
-    
-
-
-
-
+    @model_validator(mode='after')
+    def compute_cost(self) -> 'APIUsage':
+        # Don't recompute if the cost is already set
+        if self.total_cost is not None:
+            return self
+        # Access the vendor and model specific pricing information
+        try:
+            model_pricing = pricing_data[self.vendor][self.model]
+        except KeyError:
+            return self
+        if self.input_tokens is None and self.output_tokens is None:
+            return self
+
+        # Calculate costs; prices are USD per million tokens, "" means not billed
+        input_price = float(model_pricing.get("input_price") or 0)
+        output_price = float(model_pricing.get("output_price") or 0)
+        # Anthropic bills cache writes at 1.25x and cache reads at 0.1x the input price
+        cached_input = (self.cache_creation_input_tokens or 0) * 1.25 + (self.cache_read_input_tokens or 0) * 0.1
+        self.input_cost = (((self.input_tokens or 0) + cached_input) / 1e6) * input_price
+        self.rag_cost = ((self.rag_tokens or 0) / 1e6) * input_price
+        self.output_cost = ((self.output_tokens or 0) / 1e6) * output_price
+        self.total_cost = self.input_cost + self.output_cost
+        return self
+
+    def insert(self, user: str):
+        """Queues this record for the local usage store. Writes happen off the calling thread."""
+        import usageStore
+
+        usageStore.record_usage(self, user)
 
 
 def main():
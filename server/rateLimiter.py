@@ -0,0 +1,254 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+from pydanticModels import APIParameters, Content, pricing_data
+
+# Rough token cost of one base64 image block (a 1568px-edge PNG is ~1600 tokens).
+IMAGE_TOKEN_ESTIMATE = 1600
+CHARS_PER_TOKEN = 4
+
+# Adaptive backoff: multiplicative decrease on a 429, additive recovery per success.
+MIN_RATE_SCALE = 0.1
+RATE_DECREASE = 0.5
+RATE_RECOVERY = 0.05
+
+
+class TokenBucket:
+    """
+    A classic token bucket. Holds up to `capacity` units and refills continuously at
+    `refill_per_second`. Not thread-safe on its own; RateLimiter guards it with a lock.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.available = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.available = min(
+                self.capacity, self.available + elapsed * self.refill_per_second
+            )
+            self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units will be available (0 if they already are)."""
+        if self.available >= amount:
+            return 0.0
+        if self.refill_per_second <= 0:
+            return math.inf
+        return (amount - self.available) / self.refill_per_second
+
+
+class RateLimiter:
+    """
+    Reserves request and token capacity for one vendor/model pair before a call is made.
+
+    Two buckets are kept: one for requests per minute and one for tokens per minute. A
+    caller reserves 1 request plus an estimated token count; once the call returns the
+    estimate is reconciled against the real usage. Rate-limit responses shrink the
+    effective refill rate, and successful calls slowly restore it.
+
+    Safe to share between threads (acquire) and asyncio tasks (acquire_async).
+    """
+
+    def __init__(self, name: str, rpm: int, tpm: int):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm, rpm / 60)
+        self.tokens = TokenBucket(tpm, tpm / 60)
+        self.scale = 1.0
+        self.paused_until = 0.0
+        self.rate_limited = 0
+        self.granted = 0
+        self.waited_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def _try_reserve(self, tokens: int, start: float) -> float:
+        # Requests larger than the bucket would never fit; clamp so they go through alone.
+        tokens = min(tokens, self.tokens.capacity)
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait > 0:
+                return wait
+            self.requests.available -= 1
+            self.tokens.available -= tokens
+            self.granted += 1
+            self.waited_seconds += now - start
+            return 0.0
+
+    def acquire(self, tokens: int, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until capacity for one request of `tokens` tokens is reserved.
+
+        Args:
+            tokens (int): Estimated tokens (prompt + completion) for the request.
+            timeout (float, optional): Give up after this many seconds. Defaults to None.
+
+        Returns:
+            bool: True if the reservation was made, False on timeout.
+        """
+        start = time.monotonic()
+        while True:
+            wait = self._try_reserve(tokens, start)
+            if wait == 0:
+                return True
+            if timeout is not None:
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(min(wait, 1.0))
+
+    async def acquire_async(self, tokens: int, timeout: Optional[float] = None) -> bool:
+        """Same as acquire, but yields to the event loop instead of blocking the thread."""
+        start = time.monotonic()
+        while True:
+            wait = self._try_reserve(tokens, start)
+            if wait == 0:
+                return True
+            if timeout is not None:
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            await asyncio.sleep(min(wait, 1.0))
+
+    def reconcile(self, estimated: int, actual: Optional[int]):
+        """Refunds (or charges) the difference between the reserved estimate and real usage."""
+        if actual is None:
+            return
+        with self.lock:
+            self.tokens.refill(time.monotonic())
+            self.tokens.available = min(
+                self.tokens.capacity, self.tokens.available + (estimated - actual)
+            )
+
+    def record_success(self):
+        with self.lock:
+            if self.scale < 1.0:
+                self.scale = min(1.0, self.scale + RATE_RECOVERY)
+                self._apply_scale()
+
+    def record_rate_limit(self, retry_after: Optional[float] = None):
+        """
+        Called when the vendor answered 429. Halves the effective rate, drains both buckets
+        and pauses new reservations for `retry_after` seconds (or one refill interval).
+        """
+        with self.lock:
+            self.rate_limited += 1
+            self.scale = max(MIN_RATE_SCALE, self.scale * RATE_DECREASE)
+            self._apply_scale()
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            self.requests.available = min(self.requests.available, 0.0)
+            self.tokens.available = min(self.tokens.available, 0.0)
+            pause = retry_after if retry_after is not None else 60 / max(self.rpm, 1)
+            self.paused_until = max(self.paused_until, now + pause)
+
+    def _apply_scale(self):
+        self.requests.refill_per_second = self.rpm / 60 * self.scale
+        self.tokens.refill_per_second = self.tpm / 60 * self.scale
+
+    def utilization(self) -> Dict[str, float]:
+        """Returns the fraction of each bucket currently in use plus adaptive state."""
+        with self.lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            return {
+                "requests": 1 - max(self.requests.available, 0) / self.requests.capacity,
+                "tokens": 1 - max(self.tokens.available, 0) / self.tokens.capacity,
+                "rate_scale": self.scale,
+                "granted": self.granted,
+                "rate_limited": self.rate_limited,
+                "waited_seconds": round(self.waited_seconds, 3),
+            }
+
+
+_limiters: Dict[Tuple[str, str], Optional[RateLimiter]] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(vendor: str, model: str) -> Optional[RateLimiter]:
+    """
+    Returns the shared RateLimiter for a vendor/model, built from pricing_data's RPM/TPM.
+    Returns None when the model has no published limits.
+
+    Limits are divided by MODELICASIM_WORKERS so several server processes sharing one
+    API key stay under the account quota together.
+    """
+    vendor = vendor.lower().split("/")[-1]
+    key = (vendor, model)
+    with _limiters_lock:
+        if key not in _limiters:
+            model_pricing = pricing_data.get(vendor, {}).get(model, {})
+            rpm, tpm = model_pricing.get("RPM"), model_pricing.get("TPM")
+            if not rpm or not tpm:
+                _limiters[key] = None
+            else:
+                workers = max(int(os.getenv("MODELICASIM_WORKERS", "1")), 1)
+                _limiters[key] = RateLimiter(
+                    f"{vendor}/{model}", max(rpm // workers, 1), max(tpm // workers, 1)
+                )
+        return _limiters[key]
+
+
+def rate_limiter_utilization() -> Dict[str, Dict[str, float]]:
+    """Utilization of every limiter created so far, keyed by vendor/model."""
+    with _limiters_lock:
+        limiters = [l for l in _limiters.values() if l is not None]
+    return {limiter.name: limiter.utilization() for limiter in limiters}
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """
+    Seconds to wait from a 429 response's headers: OpenAI's retry-after-ms, or the standard
+    retry-after as seconds or an HTTP date. None when absent or unparseable.
+    """
+    if headers is None:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return max(float(headers["retry-after-ms"]) / 1000, 0.0)
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(params: APIParameters) -> int:
+    """
+    Cheap local estimate of the tokens a request will consume: ~4 characters per text
+    token, a flat cost per image block, plus the completion budget in max_tokens.
+    """
+    chars = 0
+    images = 0
+    for message in params.messages:
+        parts = message.content if isinstance(message.content, list) else [message.content]
+        for part in parts:
+            if isinstance(part, Content):
+                images += 1
+            else:
+                chars += len(part)
+    return chars // CHARS_PER_TOKEN + images * IMAGE_TOKEN_ESTIMATE + (params.max_tokens or 0)
@@ -0,0 +1,483 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from artifactStore import artifact_store
+from dataStats import StatsAccumulator
+from datasetStore import dataset_store
+from logConfig import get_logger
+from multiRate import MultiRateDataset
+from scheduler import slot
+from tracing import bind, span
+
+logger = get_logger(__name__)
+
+# Residuals kept per variable for the sliding-window statistics
+TWIN_WINDOW = int(os.getenv("TWIN_WINDOW", "256"))
+# Residuals used to learn each variable's normal spread before anything is flagged
+TWIN_WARMUP = int(os.getenv("TWIN_WARMUP", "64"))
+# A single residual this many baseline standard deviations out is an anomaly
+TWIN_ANOMALY_SIGMA = float(os.getenv("TWIN_ANOMALY_SIGMA", "4"))
+# Two-sided CUSUM on standardized residuals: slack k and decision threshold h (in sigmas)
+TWIN_DRIFT_SLACK = float(os.getenv("TWIN_DRIFT_SLACK", "0.5"))
+TWIN_DRIFT_THRESHOLD = float(os.getenv("TWIN_DRIFT_THRESHOLD", "8"))
+# Live twins per server process; the least recently fed one is stopped beyond this
+TWIN_MAX_SESSIONS = int(os.getenv("TWIN_MAX_SESSIONS", "500"))
+TWIN_IDLE_SECONDS = float(os.getenv("TWIN_IDLE_SECONDS", "3600"))
+# Flags kept per twin for status queries
+MAX_RECENT_FLAGS = 50
+# Small floor on the baseline spread so a perfect fit does not flag rounding noise
+MIN_SIGMA = 1e-9
+
+
+# ===== Steppers =====
+# A stepper owns one running instance of a model and advances it to given times.
+
+
+class FmuStepper:
+    """
+    Co-simulation of the model exported as an FMU (sim.build_fmu), stepped with fmpy.
+    The unzipped FMU and its model description are shared by every twin of the same model;
+    each twin only holds its own FMU instance.
+    """
+
+    # fmu_path -> [unzip directory, model description, open instances]
+    _extracted: Dict[str, List[Any]] = {}
+    _extract_lock = threading.Lock()
+
+    def __init__(self, fmu_path: str, columns: List[str], inputs: List[str]):
+        try:
+            from fmpy import extract, read_model_description
+            from fmpy.fmi2 import FMU2Slave
+        except ImportError:
+            raise RuntimeError("Real-time twins need fmpy (pip install fmpy) unless SIM_BACKEND=fake")
+
+        with self._extract_lock:
+            shared = self._extracted.get(fmu_path)
+            if shared is None:
+                description = read_model_description(fmu_path)
+                shared = self._extracted[fmu_path] = [extract(fmu_path), description, 0]
+            shared[2] += 1
+        self.fmu_path: Optional[str] = fmu_path
+        unzipped, description, _ = shared
+        refs = {v.name: v.valueReference for v in description.modelVariables}
+        self.outputs = {k: refs[k] for k in columns if k in refs and k not in inputs}
+        self.inputs = {k: refs[k] for k in inputs if k in refs}
+        self.start_refs = refs
+        try:
+            self.fmu = FMU2Slave(
+                guid=description.guid,
+                unzipDirectory=unzipped,
+                modelIdentifier=description.coSimulation.modelIdentifier,
+                instanceName=f"twin_{id(self):x}",
+            )
+        except Exception:
+            self._release()
+            raise
+        self.time = 0.0
+
+    def reset(self, t0: float, initial: Dict[str, float]):
+        self.fmu.instantiate()
+        self.fmu.setupExperiment(startTime=t0)
+        starts = {k: v for k, v in initial.items() if k in self.start_refs}
+        if starts:
+            self.fmu.setReal([self.start_refs[k] for k in starts], list(starts.values()))
+        self.fmu.enterInitializationMode()
+        self.fmu.exitInitializationMode()
+        self.time = t0
+
+    def advance(self, t: float, inputs: Dict[str, float]) -> Dict[str, float]:
+        feed = {k: v for k, v in inputs.items() if k in self.inputs}
+        if feed:
+            self.fmu.setReal([self.inputs[k] for k in feed], list(feed.values()))
+        if t > self.time:
+            self.fmu.doStep(currentCommunicationPoint=self.time, communicationStepSize=t - self.time)
+            self.time = t
+        values = self.fmu.getReal(list(self.outputs.values()))
+        return dict(zip(self.outputs, values))
+
+    def close(self):
+        if self.fmu_path is None:
+            return
+        try:
+            self.fmu.terminate()
+            self.fmu.freeInstance()
+        except Exception as e:
+            logger.debug("Closing FMU instance failed: %s", e)
+        self._release()
+
+    def _release(self):
+        """Drops this twin's use of the unzipped FMU; the last one out removes it."""
+        fmu_path, self.fmu_path = self.fmu_path, None
+        with self._extract_lock:
+            shared = self._extracted.get(fmu_path)
+            if shared is None:
+                return
+            shared[2] -= 1
+            if shared[2] > 0:
+                return
+            del self._extracted[fmu_path]
+        shutil.rmtree(shared[0], ignore_errors=True)
+        _forget_fmu(fmu_path)
+
+
+class FakeStepper:
+    """
+    Stand-in for SIM_BACKEND=fake: each variable relaxes first-order towards the previous
+    reading, like fakeBackends.FakeSimulator's smoothed copy of the measurements.
+    """
+
+    def __init__(self, columns: List[str], inputs: List[str], time_constant: float = 20.0):
+        self.outputs = [k for k in columns if k not in inputs]
+        self.time_constant = time_constant
+        self.state: Dict[str, float] = {}
+        self.target: Dict[str, float] = {}
+        self.time = 0.0
+
+    def reset(self, t0: float, initial: Dict[str, float]):
+        self.state = {k: initial[k] for k in self.outputs if k in initial}
+        self.target = dict(self.state)
+        self.time = t0
+
+    def advance(self, t: float, inputs: Dict[str, float]) -> Dict[str, float]:
+        decay = np.exp(-max(t - self.time, 0.0) / self.time_constant)
+        for k, x in self.state.items():
+            self.state[k] = self.target[k] + (x - self.target[k]) * decay
+        self.time = max(t, self.time)
+        return dict(self.state)
+
+    def observe(self, measured: Dict[str, float]):
+        self.target.update({k: v for k, v in measured.items() if k in self.state})
+        for k, v in measured.items():
+            self.state.setdefault(k, v)
+            self.target.setdefault(k, v)
+
+    def close(self):
+        pass
+
+
+# Model source hash -> its FMU, while a twin of that model is running
+_fmu_paths: Dict[str, str] = {}
+_fmu_lock = threading.Lock()
+
+
+def fmu_for(model: str) -> str:
+    """The FMU for this model source, built once per process and kept in the artifact store."""
+    key = hashlib.sha256(model.encode()).hexdigest()
+    with _fmu_lock:
+        path = _fmu_paths.get(key)
+    if path is None or not os.path.exists(path):
+        from sim import build_fmu
+
+        path = build_fmu(model)
+        with _fmu_lock:
+            _fmu_paths[key] = path
+    return path
+
+
+def _forget_fmu(path: str):
+    """Drops the FMU of a model no twin runs any more (rebuilt if a twin starts again)."""
+    with _fmu_lock:
+        for key in [k for k, p in _fmu_paths.items() if p == path]:
+            del _fmu_paths[key]
+
+
+def make_stepper(model: str, columns: List[str], inputs: List[str]):
+    if os.getenv("SIM_BACKEND", "omc") == "fake":
+        return FakeStepper(columns, inputs)
+    return FmuStepper(fmu_for(model), columns, inputs)
+
+
+# ===== Residual tracking =====
+
+
+class ResidualTracker:
+    """
+    Sliding-window residual statistics and drift/anomaly detection for one variable, in
+    O(window) memory and O(1) time per reading.
+
+    The first TWIN_WARMUP residuals set the baseline mean and spread. After that a
+    residual beyond TWIN_ANOMALY_SIGMA baseline sigmas is an anomaly, and a two-sided
+    CUSUM of standardized residuals flags sustained drift of the model away from the
+    machine; drift stays flagged until the twin is restarted (e.g. after a re-fit).
+    """
+
+    def __init__(self, window: int = TWIN_WINDOW, warmup: int = TWIN_WARMUP):
+        self.buffer = np.zeros(window)
+        self.size = 0
+        self.position = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.count = 0
+        self.warmup = warmup
+        self.baseline_mean = 0.0
+        self.baseline_sigma: Optional[float] = None
+        self._warm_sum = 0.0
+        self._warm_sq = 0.0
+        self.cusum_high = 0.0
+        self.cusum_low = 0.0
+        self.drifting = False
+
+    def add(self, residual: float) -> Optional[str]:
+        """Records a residual; returns "anomaly", "drift" (on onset) or None."""
+        window = len(self.buffer)
+        if self.size == window:
+            old = self.buffer[self.position]
+            self.total -= old
+            self.total_sq -= old * old
+        else:
+            self.size += 1
+        residual = float(residual)
+        self.buffer[self.position] = residual
+        self.position = (self.position + 1) % window
+        self.total += residual
+        self.total_sq += residual * residual
+        self.count += 1
+        if self.position == 0:
+            # Re-sum once per lap so add/subtract rounding does not accumulate
+            self.total = float(self.buffer.sum())
+            self.total_sq = float((self.buffer**2).sum())
+
+        if self.baseline_sigma is None:
+            self._warm_sum += residual
+            self._warm_sq += residual * residual
+            if self.count >= self.warmup:
+                mean = self._warm_sum / self.count
+                variance = max(self._warm_sq / self.count - mean * mean, 0.0)
+                self.baseline_mean = mean
+                self.baseline_sigma = max(float(np.sqrt(variance)), MIN_SIGMA * max(1.0, abs(mean)))
+            return None
+
+        z = (residual - self.baseline_mean) / self.baseline_sigma
+        self.cusum_high = max(0.0, self.cusum_high + z - TWIN_DRIFT_SLACK)
+        self.cusum_low = max(0.0, self.cusum_low - z - TWIN_DRIFT_SLACK)
+        drifting = max(self.cusum_high, self.cusum_low) > TWIN_DRIFT_THRESHOLD
+        onset = drifting and not self.drifting
+        self.drifting = drifting
+        if onset:
+            return "drift"
+        if abs(z) > TWIN_ANOMALY_SIGMA:
+            return "anomaly"
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        n = self.size
+        mean = self.total / n if n else None
+        return {
+            "samples": self.count,
+            "window": n,
+            "bias": mean,
+            "rmse": float(np.sqrt(max(self.total_sq / n, 0.0))) if n else None,
+            "baseline_sigma": self.baseline_sigma,
+            "drifting": self.drifting,
+            "cusum": round(max(self.cusum_high, self.cusum_low), 3),
+        }
+
+
+# ===== Sessions =====
+
+
+class TwinClosed(LookupError):
+    """Raised when a twin is used after it was stopped, restarted or expired."""
+
+
+class TwinSession:
+    """
+    One machine's live twin: a loaded model advanced in lockstep with appended readings.
+
+    Readings may come from sensors sampled at different times; the model is advanced to
+    each distinct timestamp in order and compared with the fields measured at it.
+    """
+
+    def __init__(self, machine: str, model: str, columns: List[str], inputs: Optional[List[str]] = None):
+        self.machine = machine
+        self.model = model
+        self.columns = list(columns)
+        self.inputs = list(inputs or [])
+        self.stepper = make_stepper(model, self.columns, self.inputs)
+        self.trackers = {k: ResidualTracker() for k in self.columns if k not in self.inputs}
+        self.flags: List[Dict[str, Any]] = []
+        # describe() of every reading fed to the twin, kept without storing the readings
+        self.summary = StatsAccumulator(self.columns)
+        self.start_ns: Optional[int] = None
+        self.last_ns: Optional[int] = None
+        self.readings = 0
+        self.created = time.time()
+        self.last_used = self.created
+        # Set by close(); the stepper's model instance is freed then and must not be touched
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def ingest(self, dataset: MultiRateDataset) -> List[Dict[str, Any]]:
+        """
+        Advances the twin through the new readings (older than the last one are skipped)
+        and returns the anomalies and drift onsets they caused.
+
+        Raises:
+            TwinClosed: If the twin was stopped, restarted or expired meanwhile.
+        """
+        with self.lock, bind(machine=self.machine), slot("cpu"), span("twin.ingest") as s:
+            if self.closed:
+                raise TwinClosed(f"The twin of machine {self.machine!r} was stopped")
+            times = dataset.union_times()
+            if self.last_ns is not None:
+                times = times[times > self.last_ns]
+            if not len(times):
+                return []
+            # Per field: index of its sample at each union time, or -1 where it has none
+            present = {}
+            for f in dataset.fields:
+                idx = np.searchsorted(f.t, times)
+                idx_clipped = np.minimum(idx, len(f.t) - 1)
+                hit = (idx < len(f.t)) & (f.t[idx_clipped] == times)
+                present[f.name] = (np.where(hit, idx_clipped, -1), f.v)
+            rows = np.full((len(times), len(self.columns)), np.nan)
+            for j, k in enumerate(self.columns):
+                if k in present:
+                    idx, v = present[k]
+                    rows[idx >= 0, j] = v[idx[idx >= 0]]
+            self.summary.update(rows)
+
+            flags = []
+            for i, t in enumerate(times):
+                measured = {k: float(v[idx[i]]) for k, (idx, v) in present.items() if idx[i] >= 0}
+                if self.start_ns is None:
+                    self.start_ns = int(t)
+                    self.stepper.reset(0.0, measured)
+                seconds = (int(t) - self.start_ns) / 1e9
+                simulated = self.stepper.advance(seconds, {k: v for k, v in measured.items() if k in self.inputs})
+                for k, value in measured.items():
+                    tracker = self.trackers.get(k)
+                    if tracker is None or k not in simulated:
+                        continue
+                    kind = tracker.add(value - simulated[k])
+                    if kind is not None:
+                        flags.append({
+                            "type": kind,
+                            "field": k,
+                            "time": seconds,
+                            "measured": value,
+                            "simulated": float(simulated[k]),
+                        })
+                if isinstance(self.stepper, FakeStepper):
+                    self.stepper.observe(measured)
+                self.last_ns = int(t)
+            self.readings += len(times)
+            self.last_used = time.time()
+            self.flags = (self.flags + flags)[-MAX_RECENT_FLAGS:]
+            s.set(readings=len(times), flags=len(flags))
+            return flags
+
+    def status(self) -> Dict[str, Any]:
+        """Raises TwinClosed if the twin was stopped meanwhile."""
+        with self.lock:
+            if self.closed:
+                raise TwinClosed(f"The twin of machine {self.machine!r} was stopped")
+            return {
+                "machine": self.machine,
+                "readings": self.readings,
+                "time": (self.last_ns - self.start_ns) / 1e9 if self.last_ns is not None else None,
+                "drifting": any(t.drifting for t in self.trackers.values()),
+                "fields": {k: t.stats() for k, t in self.trackers.items()},
+                "readingStats": self.summary.result().to_dict(),
+                "recentFlags": list(self.flags),
+            }
+
+    def close(self):
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.stepper.close()
+
+
+class TwinManager:
+    """
+    The live twins of this server process, keyed by machine, with at most
+    TWIN_MAX_SESSIONS kept (least recently fed stopped first) and idle ones expired.
+
+    Twins hold model state in memory, so readings for a machine must reach the process
+    that started its twin (a single worker, or sticky routing by machine).
+    """
+
+    def __init__(self, max_sessions: int = TWIN_MAX_SESSIONS, idle_seconds: float = TWIN_IDLE_SECONDS):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.sessions: "OrderedDict[str, TwinSession]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def start(self, machine: str, model: Optional[str] = None, columns: Optional[List[str]] = None,
+              inputs: Optional[List[str]] = None) -> TwinSession:
+        """
+        Starts (or restarts) a machine's twin. Without a model, the machine's latest
+        generated model is used; without columns, those of its latest upload.
+
+        Raises:
+            LookupError: If no model or upload is stored for the machine.
+        """
+        if model is None:
+            path = artifact_store.pinned(machine, "latest_model")
+            if path is None:
+                raise LookupError(f"No generated model stored for machine {machine!r}")
+            with open(path) as f:
+                model = f.read()
+        if columns is None and dataset_store.contains(machine):
+            columns = [f["column"] for f in dataset_store.info(machine)["fields"]]
+        if columns is None:
+            upload = artifact_store.pinned(machine, "upload")
+            if upload is None:
+                raise LookupError(f"No upload stored for machine {machine!r}")
+            columns = MultiRateDataset.load(upload).columns
+        session = TwinSession(machine, model, columns, inputs)
+        with self.lock:
+            previous = self.sessions.pop(machine, None)
+            self.sessions[machine] = session
+            evicted = self._evict()
+        for old in ([previous] if previous else []) + evicted:
+            old.close()
+        return session
+
+    def _evict(self) -> List[TwinSession]:
+        # Called with the lock held
+        now = time.time()
+        evicted = [m for m, s in self.sessions.items() if now - s.last_used > self.idle_seconds]
+        while len(self.sessions) - len(evicted) > self.max_sessions:
+            oldest = next(m for m in self.sessions if m not in evicted)
+            evicted.append(oldest)
+        return [self.sessions.pop(m) for m in evicted]
+
+    def get(self, machine: str) -> Optional[TwinSession]:
+        """The machine's running twin, or None; idle twins are expired here too."""
+        with self.lock:
+            evicted = self._evict()
+            session = self.sessions.get(machine)
+            if session is not None:
+                self.sessions.move_to_end(machine)
+        for old in evicted:
+            old.close()
+        return session
+
+    def stop(self, machine: str) -> bool:
+        with self.lock:
+            session = self.sessions.pop(machine, None)
+        if session is None:
+            return False
+        session.close()
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "sessions": len(self.sessions),
+                "drifting": sum(
+                    any(t.drifting for t in s.trackers.values()) for s in self.sessions.values()
+                ),
+            }
+
+
+twin_manager = TwinManager()
@@ -1,26 +1,169 @@
 #!/usr/bin/env python3
 
-from sim import sim
-from dataScience import load_json
+from sim import get_simulator
+from dataScience import genimg
+from multiRate import load_dataset
 from generateModelica import generateModelica
+from budget import RunBudget, BudgetExceeded
+from artifactStore import artifact_store
+from pipelineEvents import publish
+from simWindows import choose_windows, windows_summary
+from fitMetrics import accepted, simulation_metrics
+from modelLibrary import MODEL_LIBRARY_ENABLED, model_library
+from modelicaValidation import validate
+from tracing import annotate, bind, span
+from scheduler import DEFAULT_PRIORITY
+from sharedFrames import shared_frames
+from datasetStore import dataset_store
 import pandas as pd
+import time
+import uuid
 
 
-def run_modelica_pipeline(filePath: str):
-    name, unit, df = load_json(filePath)
-    simres = None
-    iteration_limit = 2
-    for i in range(0, iteration_limit):
-        modelica_code = generateModelica(name, unit, df, simres, i)
-        print(modelica_code)
-        is_success, simdf = sim(modelica_code, df)
-        simres = (modelica_code, simdf)
-        if is_success:
-            print(f"Success on iteration {i}")
-            break
-        else:
-            print(f"Failure on iteration {i}")
+def keep(path: str, run_id: str, machine: str, role: str):
+    """
+    References a stored artifact from the run and makes it the machine's current one for
+    role. machine is the stable key (MultiRateDataset.machine), not the display name.
+    """
+    if artifact_store.contains(path):
+        artifact_store.ref(path, "run", run_id, role)
+        artifact_store.pin(path, machine, role)
 
 
+def _publish_code(run_id: str, i: int, modelica_code: str, **extra) -> str:
+    """Stores an iteration's model source and announces it; returns its path."""
+    model_path = artifact_store.put_bytes(
+        modelica_code.encode(), "mo", refs=[("run", run_id, f"model_{i}")]
+    )
+    publish(run_id, "code", iteration=i, modelica_code=modelica_code, url=artifact_store.url(model_path), **extra)
+    return model_path
 
 
+def _publish_result(
+    run_id: str, machine: str, name: str, unit: str | None, i: int, simdf: pd.DataFrame, metrics: dict, model_path: str
+) -> str:
+    """Stores and announces an iteration's simulation and its plot; returns the plot's path."""
+    publish(run_id, "simulation", iteration=i, **metrics)
+    result_path = artifact_store.put_bytes(
+        simdf.to_csv(index=False).encode(), "csv", refs=[("run", run_id, f"result_{i}")]
+    )
+    # Rendered here rather than in the next prompt so subscribers see it right away
+    sim_img = genimg(
+        simdf, name + "_simulation", unit, iteration=i + 1,
+        refs=[("run", run_id, f"simulation_image_{i}")],
+    )
+    publish(
+        run_id, "image", kind="simulation", iteration=i,
+        url=artifact_store.url(sim_img), result_url=artifact_store.url(result_path),
+    )
+    keep(model_path, run_id, machine, "latest_model")
+    return sim_img
+
+
+def run_modelica_pipeline(
+    filePath: str,
+    run_id: str | None = None,
+    src_img: str | None = None,
+    windows: list[list[float]] | None = None,
+    priority: str = DEFAULT_PRIORITY,
+):
+    """
+    Generates, simulates and refines a model for an upload, publishing progress events.
+
+    windows ([[start, stop], ...] seconds from the first sample) limits what is simulated;
+    by default SIM_WINDOWS picks the whole span or the windows around detected events.
+    priority (scheduler.PRIORITIES) orders the run's CPU and LLM work against other runs.
+    """
+    run_id = run_id or str(uuid.uuid4())
+    with bind(run_id=run_id, priority=priority), span("run"):
+        try:
+            return _run_pipeline(filePath, run_id, src_img, windows)
+        finally:
+            # Frames handed to worker processes live exactly as long as the run
+            shared_frames.release(run_id)
+
+
+def _run_pipeline(filePath: str, run_id: str, src_img: str | None, windows: list[list[float]] | None):
+    # Columns as the machine's history stores them, so its models fit later uploads and readings
+    dataset = dataset_store.conform(load_dataset(filePath))
+    machine, name, unit = dataset.machine, dataset.name, dataset.unit
+    annotate(machine=name)
+    publish(run_id, "run_started", machine=name, machineId=machine, samples=dataset.samples, fields=len(dataset.fields))
+    try:
+        if src_img is None:
+            src_img = genimg(dataset, name, unit)
+        keep(filePath, run_id, machine, "upload")
+        keep(src_img, run_id, machine, "source_image")
+        publish(run_id, "image", kind="source", url=artifact_store.url(src_img))
+        budget = RunBudget.from_env(run_id, machine)
+        simulate = get_simulator()
+        # Simulators take one dense frame; align the fields on a grid at the finest sensor rate
+        df = dataset.aligned()
+        sim_windows = choose_windows(dataset, windows)
+        simres = None
+        problems = None
+        iteration_limit = 2
+        is_success = False
+        iterations = 0
+        warm = None
+        if MODEL_LIBRARY_ENABLED:
+            # A re-fitted model from a similar machine spares the LLM entirely
+            publish(run_id, "stage", iteration=0, stage="searching_library")
+            warm = model_library.warm_start(dataset, df, sim_windows)
+        if warm is not None:
+            print(f"Reusing library model {warm.source.id} from {warm.source.machine}")
+            metrics = dict(warm.metrics, **windows_summary(sim_windows))
+            metrics.update(success=True, library_model=warm.source.id, source_machine=warm.source.machine,
+                           distance=warm.source.distance, evaluations=warm.evaluations)
+            model_path = _publish_code(run_id, 0, warm.code, source="library")
+            _publish_result(run_id, machine, name, unit, 0, warm.simdf, metrics, model_path)
+            model_library.add(machine, dataset, warm.code, warm.metrics)
+            is_success = True
+            iteration_limit = 0
+        for i in range(0, iteration_limit):
+            publish(run_id, "stage", iteration=i, stage="generating")
+            try:
+                modelica_code = generateModelica(name, unit, dataset, simres, i, budget, src_img, problems)
+            except BudgetExceeded as e:
+                print(f"Stopping run {run_id}: {e}")
+                publish(run_id, "budget_exceeded", iteration=i, message=str(e))
+                break
+            print(modelica_code)
+            model_path = _publish_code(run_id, i, modelica_code)
+            iterations = i + 1
+
+            # Catch empty, misnamed or unbalanced models before paying for a build
+            publish(run_id, "stage", iteration=i, stage="validating")
+            validation = validate(modelica_code, dataset.columns)
+            publish(run_id, "validation", iteration=i, **validation.to_dict())
+            if not validation.ok:
+                print(f"Validation failed on iteration {i}:\n{validation}")
+                simres, problems = (modelica_code, None), str(validation)
+                continue
+            problems = None
+
+            publish(run_id, "stage", iteration=i, stage="simulating")
+            start = time.perf_counter()
+            with span("simulate", iteration=i, windows=len(sim_windows)):
+                is_success, simdf = simulate(modelica_code, df, sim_windows)
+            scores = simulation_metrics(dataset, simdf, sim_windows)
+            is_success = is_success or accepted(scores)
+            metrics = dict(scores, **windows_summary(sim_windows))
+            metrics.update(success=is_success, duration=time.perf_counter() - start)
+            sim_img = _publish_result(run_id, machine, name, unit, i, simdf, metrics, model_path)
+            simres = (modelica_code, simdf, sim_img)
+            if is_success:
+                model_library.add(machine, dataset, modelica_code, scores)
+                print(f"Success on iteration {i}")
+                break
+            else:
+                print(f"Failure on iteration {i}")
+    except Exception as e:
+        publish(run_id, "run_failed", error=str(e))
+        raise
+    publish(
+        run_id, "run_finished", success=is_success, iterations=iterations,
+        input_tokens=budget.run_input_tokens, output_tokens=budget.run_output_tokens,
+        cost=budget.run_spent,
+    )
+    return run_id
@@ -0,0 +1,171 @@
+import contextvars
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional
+
+from tracing import current_attributes, span
+
+# Priority classes, most urgent first. Interactive uploads wait on nobody but each other;
+# batch onboarding and nightly re-fits take what is left.
+PRIORITIES = ("interactive", "batch", "nightly")
+DEFAULT_PRIORITY = "interactive"
+
+# Like the rate limiter, capacity is split across the server processes on one host
+_WORKERS = max(int(os.getenv("MODELICASIM_WORKERS", "1")), 1)
+# CPU-bound stages (model builds, simulations, plot rendering)
+SCHEDULER_CPU_SLOTS = int(os.getenv("SCHEDULER_CPU_SLOTS", str(max(1, (os.cpu_count() or 1) // _WORKERS))))
+# Concurrent LLM calls (I/O bound; token throughput is still capped by the rate limiter)
+SCHEDULER_LLM_SLOTS = int(os.getenv("SCHEDULER_LLM_SLOTS", str(max(1, 16 // _WORKERS))))
+# A waiter moves up one priority class per this many seconds, so nightly work cannot starve
+SCHEDULER_AGING_SECONDS = float(os.getenv("SCHEDULER_AGING_SECONDS", "120"))
+
+# Machines whose last grant is remembered for round robin; the least recent are forgotten
+MAX_TRACKED_MACHINES = 10_000
+
+# Pools the current context already holds a slot in; nested stages reuse it
+_held: contextvars.ContextVar[FrozenSet[str]] = contextvars.ContextVar("scheduler_held", default=frozenset())
+
+
+class _Waiter:
+    __slots__ = ("priority", "machine", "seq", "enqueued", "granted")
+
+    def __init__(self, priority: int, machine: str, seq: int):
+        self.priority = priority
+        self.machine = machine
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+class ResourcePool:
+    """
+    A counting semaphore that hands free slots out by priority class, then to the
+    machine holding the fewest slots, then to the machine served longest ago (round
+    robin across a fleet), then first come first served. Waiting time ages a request
+    into more urgent classes.
+    """
+
+    def __init__(self, name: str, capacity: int, aging_seconds: float = SCHEDULER_AGING_SECONDS):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.aging_seconds = aging_seconds
+        self.in_use = 0
+        self.by_machine: Dict[str, int] = {}
+        self.last_grant: "OrderedDict[str, int]" = OrderedDict()
+        self.waiters: List[_Waiter] = []
+        self.granted = 0
+        self.waited_seconds = 0.0
+        self.condition = threading.Condition()
+        self._seq = itertools.count()
+
+    def _rank(self, waiter: _Waiter, now: float):
+        aged = int((now - waiter.enqueued) / self.aging_seconds) if self.aging_seconds > 0 else 0
+        return (
+            max(0, waiter.priority - aged),
+            self.by_machine.get(waiter.machine, 0),
+            self.last_grant.get(waiter.machine, -1),
+            waiter.seq,
+        )
+
+    def _grant_next(self):
+        # Called with the condition held whenever a slot frees up or a waiter arrives
+        now = time.monotonic()
+        while self.in_use < self.capacity and self.waiters:
+            best = min(self.waiters, key=lambda w: self._rank(w, now))
+            self.waiters.remove(best)
+            best.granted = True
+            self.in_use += 1
+            self.by_machine[best.machine] = self.by_machine.get(best.machine, 0) + 1
+            self.granted += 1
+            self.waited_seconds += now - best.enqueued
+            self.last_grant[best.machine] = self.granted
+            self.last_grant.move_to_end(best.machine)
+            if len(self.last_grant) > MAX_TRACKED_MACHINES:
+                self.last_grant.popitem(last=False)
+        self.condition.notify_all()
+
+    def acquire(self, priority: str = DEFAULT_PRIORITY, machine: str = "") -> float:
+        """Blocks until a slot is granted; returns the seconds spent waiting."""
+        waiter = _Waiter(_priority_index(priority), machine, next(self._seq))
+        with self.condition:
+            self.waiters.append(waiter)
+            self._grant_next()
+            while not waiter.granted:
+                self.condition.wait()
+        return time.monotonic() - waiter.enqueued
+
+    def release(self, machine: str = ""):
+        with self.condition:
+            self.in_use -= 1
+            remaining = self.by_machine.get(machine, 1) - 1
+            if remaining:
+                self.by_machine[machine] = remaining
+            else:
+                self.by_machine.pop(machine, None)
+            self._grant_next()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.condition:
+            waiting = {p: 0 for p in PRIORITIES}
+            for w in self.waiters:
+                waiting[PRIORITIES[w.priority]] += 1
+            return {
+                "capacity": self.capacity,
+                "in_use": self.in_use,
+                "waiting": waiting,
+                "machines": len(self.by_machine),
+                "granted": self.granted,
+                "mean_wait_seconds": round(self.waited_seconds / self.granted, 4) if self.granted else 0.0,
+            }
+
+
+def _priority_index(priority: str) -> int:
+    try:
+        return PRIORITIES.index(priority)
+    except ValueError:
+        raise ValueError(f"Unknown priority {priority!r}; expected one of {', '.join(PRIORITIES)}")
+
+
+class Scheduler:
+    """
+    Fleet-wide concurrency caps per resource: "cpu" for builds, simulations and
+    rendering, "llm" for model API calls. Stages take a slot with slot(pool); the
+    priority and machine come from the run's tracing context (tracing.bind).
+    """
+
+    def __init__(self, cpu_slots: int = SCHEDULER_CPU_SLOTS, llm_slots: int = SCHEDULER_LLM_SLOTS):
+        self.pools = {"cpu": ResourcePool("cpu", cpu_slots), "llm": ResourcePool("llm", llm_slots)}
+
+    @contextmanager
+    def slot(self, pool: str, priority: Optional[str] = None, machine: Optional[str] = None) -> Iterator[None]:
+        held = _held.get()
+        if pool in held:
+            yield
+            return
+        attributes = current_attributes()
+        priority = priority or attributes.get("priority", DEFAULT_PRIORITY)
+        machine = machine or attributes.get("machine", "")
+        resource = self.pools[pool]
+        with span(f"wait.{pool}", priority=priority):
+            resource.acquire(priority, machine)
+        token = _held.set(held | {pool})
+        try:
+            yield
+        finally:
+            _held.reset(token)
+            resource.release(machine)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+
+scheduler = Scheduler()
+
+
+def slot(pool: str, priority: Optional[str] = None, machine: Optional[str] = None):
+    """scheduler.slot(); `with slot("cpu"): model.build()`."""
+    return scheduler.slot(pool, priority, machine)
@@ -0,0 +1,305 @@
+import atexit
+import mmap
+import os
+import re
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from logConfig import get_logger
+from multiRate import FieldSeries, MultiRateDataset
+
+logger = get_logger(__name__)
+
+# "shm" (multiprocessing.shared_memory, i.e. /dev/shm) or "file" (memory-mapped files in
+# SHARED_FRAMES_DIR, for containers whose /dev/shm is too small)
+SHARED_FRAMES_BACKEND = os.getenv("SHARED_FRAMES_BACKEND", "shm")
+SHARED_FRAMES_DIR = os.getenv("SHARED_FRAMES_DIR", os.path.join(tempfile.gettempdir(), "modelicasim-frames"))
+
+# Segment names carry the creating pid, so segments of a crashed process can be swept
+PREFIX = "msim"
+_NAME = re.compile(rf"^{PREFIX}_(\d+)_[0-9a-f]+$")
+# Arrays start on cache-line boundaries within a segment
+ALIGN = 64
+
+
+@dataclass(frozen=True)
+class SharedArray:
+    offset: int
+    dtype: str
+    shape: Tuple[int, ...]
+
+
+@dataclass(frozen=True)
+class SharedFrame:
+    """
+    A picklable handle on a DataFrame or MultiRateDataset whose numbers sit in one shared
+    segment. Passing it to a worker process costs a few hundred bytes however large the
+    data; attach() rebuilds the object there as read-only views of the segment.
+    """
+
+    segment: str
+    backend: str
+    size: int
+    kind: str  # "frame" or "dataset"
+    arrays: Tuple[SharedArray, ...]
+    # frame: (columns, timestamp encoding); dataset: (name, unit, id, [(column, label, key, t index, v index)])
+    meta: Tuple[Any, ...]
+
+
+# ===== Segments =====
+
+
+class _Segment:
+    """One shared region: a shared_memory block or a memory-mapped file."""
+
+    def __init__(self, name: str, backend: str, size: int, create: bool):
+        self.name = name
+        self.backend = backend
+        if backend == "shm":
+            # Pool workers share their parent's resource tracker, so attaching there does not
+            # make the worker's exit unlink the block
+            self._shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+            self.buf = self._shm.buf
+        elif backend == "file":
+            path = os.path.join(SHARED_FRAMES_DIR, name)
+            if create:
+                os.makedirs(SHARED_FRAMES_DIR, exist_ok=True)
+                with open(path, "wb") as f:
+                    f.truncate(size)
+            with open(path, "r+b" if create else "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if create else mmap.ACCESS_READ)
+            self.buf = memoryview(self._mmap)
+        else:
+            raise ValueError(f"Unknown shared frame backend {backend!r}; expected 'shm' or 'file'")
+
+    def close(self):
+        """Unmaps the segment; BufferError while views of it are still alive."""
+        if self.backend == "shm":
+            self._shm.close()
+        else:
+            self.buf.release()
+            self._mmap.close()
+
+    def unlink(self):
+        if self.backend == "shm":
+            self._shm.unlink()
+        else:
+            os.unlink(os.path.join(SHARED_FRAMES_DIR, self.name))
+
+
+def _layout(arrays: List[np.ndarray]) -> Tuple[List[SharedArray], int]:
+    placed, offset = [], 0
+    for a in arrays:
+        offset = -(-offset // ALIGN) * ALIGN
+        placed.append(SharedArray(offset, a.dtype.str, a.shape))
+        offset += a.nbytes
+    return placed, max(offset, 1)
+
+
+def _view(buf, spec: SharedArray) -> np.ndarray:
+    a = np.ndarray(spec.shape, dtype=np.dtype(spec.dtype), buffer=buf, offset=spec.offset)
+    a.flags.writeable = False
+    return a
+
+
+# ===== Encoding =====
+
+
+def _encode_frame(df: pd.DataFrame):
+    """timestamp (datetime as int64 ns, or numeric seconds) + one (columns, rows) float64 block."""
+    columns = [c for c in df.columns if c != "timestamp"]
+    arrays, timestamp = [], None
+    if "timestamp" in df:
+        ts = df["timestamp"]
+        if pd.api.types.is_datetime64_any_dtype(ts):
+            tz = str(ts.dt.tz) if ts.dt.tz is not None else None
+            naive = ts.dt.tz_convert("UTC").dt.tz_localize(None) if tz else ts
+            arrays.append(naive.to_numpy().astype("datetime64[ns]").view(np.int64))
+            timestamp = ("datetime", tz, str(ts.dt.unit))
+        else:
+            arrays.append(ts.to_numpy(dtype=np.float64))
+            timestamp = ("numeric",)
+    block = np.empty((len(columns), len(df)), dtype=np.float64)
+    for row, column in zip(block, columns):
+        # Non-numeric columns raise here: only numeric frames are handed over
+        row[:] = df[column].to_numpy(dtype=np.float64)
+    arrays.append(block)
+    return arrays, (tuple(map(str, columns)), timestamp)
+
+
+def _decode_frame(views: List[np.ndarray], meta) -> pd.DataFrame:
+    columns, timestamp = meta
+    # The transposed block is an F-ordered (rows, columns) view: one pandas block, no copy
+    df = pd.DataFrame(views[-1].T, columns=list(columns), copy=False)
+    if timestamp is not None:
+        if timestamp[0] == "datetime":
+            times = pd.DatetimeIndex(views[0].view("datetime64[ns]"))
+            times = times.tz_localize("UTC").tz_convert(timestamp[1]) if timestamp[1] else times
+            df.insert(0, "timestamp", times.as_unit(timestamp[2]))
+        else:
+            df.insert(0, "timestamp", views[0])
+    return df
+
+
+def _encode_dataset(dataset: MultiRateDataset):
+    """Each distinct time and value array once (compact datasets share time arrays)."""
+    arrays: List[np.ndarray] = []
+    index: Dict[int, int] = {}
+
+    def place(a: np.ndarray) -> int:
+        if id(a) not in index:
+            index[id(a)] = len(arrays)
+            arrays.append(np.ascontiguousarray(a))
+        return index[id(a)]
+
+    fields = [(f.name, f.label, f.key, place(f.t), place(f.v)) for f in dataset.fields]
+    return arrays, (dataset.name, dataset.unit, dataset.id, tuple(fields))
+
+
+def _decode_dataset(views: List[np.ndarray], meta) -> MultiRateDataset:
+    name, unit, id, fields = meta
+    return MultiRateDataset(name, unit, [FieldSeries(c, label, views[t], views[v], key) for c, label, key, t, v in fields], id)
+
+
+# ===== Owners =====
+
+
+class SharedFrames:
+    """
+    Hands DataFrames and MultiRateDatasets to worker processes without pickling them.
+
+    share() copies an object's numeric blocks once into a shared segment and returns a
+    SharedFrame descriptor; workers attach() it and read the numbers in place. Segments
+    belong to an owner (a run id) and live until release(owner), which the runner calls
+    when the run finishes. Sharing the same object twice for one owner reuses its segment.
+    Segments left by processes that died are swept when a process first shares one.
+    """
+
+    def __init__(self, backend: str = SHARED_FRAMES_BACKEND):
+        self.backend = backend
+        self.lock = threading.Lock()
+        # owner -> {id(obj): (obj, descriptor, segment)}; obj is kept so its id is not reused
+        self.owned: Dict[str, Dict[int, Tuple[Any, SharedFrame, _Segment]]] = {}
+        # Attached segments whose views were still alive when the worker let go of them
+        self._detached: List[_Segment] = []
+        self._swept = False
+        self.counters = {"shared": 0, "reused": 0, "released": 0, "bytes": 0}
+
+    def share(self, obj: Union[pd.DataFrame, MultiRateDataset], owner: str) -> SharedFrame:
+        with self.lock:
+            entry = self.owned.get(owner, {}).get(id(obj))
+            if entry is not None:
+                self.counters["reused"] += 1
+                return entry[1]
+        if not self._swept:
+            self._swept = True
+            self.sweep()
+        if isinstance(obj, MultiRateDataset):
+            kind, (arrays, meta) = "dataset", _encode_dataset(obj)
+        else:
+            kind, (arrays, meta) = "frame", _encode_frame(obj)
+        specs, size = _layout(arrays)
+        name = f"{PREFIX}_{os.getpid()}_{uuid.uuid4().hex[:16]}"
+        segment = _Segment(name, self.backend, size, create=True)
+        for a, spec in zip(arrays, specs):
+            target = np.ndarray(spec.shape, dtype=np.dtype(spec.dtype), buffer=segment.buf, offset=spec.offset)
+            target[...] = a
+            del target
+        frame = SharedFrame(name, self.backend, size, kind, tuple(specs), meta)
+        with self.lock:
+            self.owned.setdefault(owner, {})[id(obj)] = (obj, frame, segment)
+            self.counters["shared"] += 1
+            self.counters["bytes"] += size
+        return frame
+
+    def release(self, owner: str) -> int:
+        """Frees every segment shared for owner; returns how many."""
+        with self.lock:
+            entries = self.owned.pop(owner, {})
+        for _, frame, segment in entries.values():
+            try:
+                segment.close()
+                segment.unlink()
+            except (BufferError, FileNotFoundError, OSError):
+                logger.warning("Could not free shared frame %s", frame.segment)
+        with self.lock:
+            self.counters["released"] += len(entries)
+            self.counters["bytes"] -= sum(frame.size for _, frame, _ in entries.values())
+        return len(entries)
+
+    def release_all(self):
+        for owner in list(self.owned):
+            self.release(owner)
+
+    @contextmanager
+    def attach(self, frame: SharedFrame) -> Iterator[Union[pd.DataFrame, MultiRateDataset]]:
+        """
+        The shared object as read-only views (in a worker, or anywhere). Do not keep it
+        past the block: the segment is unmapped once nothing references the views.
+        """
+        self._close_detached()
+        segment = _Segment(frame.segment, frame.backend, frame.size, create=False)
+        try:
+            views = [_view(segment.buf, spec) for spec in frame.arrays]
+            decode = _decode_dataset if frame.kind == "dataset" else _decode_frame
+            yield decode(views, frame.meta)
+        finally:
+            views = None
+            self._detached.append(segment)
+            self._close_detached()
+
+    def _close_detached(self):
+        pending = []
+        for segment in self._detached:
+            try:
+                segment.close()
+            except BufferError:
+                pending.append(segment)
+        self._detached = pending
+
+    def sweep(self) -> int:
+        """Unlinks segments whose creating process no longer exists; returns how many."""
+        directory = "/dev/shm" if self.backend == "shm" else SHARED_FRAMES_DIR
+        removed = 0
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return 0
+        for name in names:
+            match = _NAME.match(name)
+            if match is None or _alive(int(match.group(1))):
+                continue
+            try:
+                os.unlink(os.path.join(directory, name))
+                removed += 1
+            except OSError:
+                pass
+        if removed:
+            logger.info("Removed %d shared frames left by exited processes", removed)
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters, segments=sum(len(e) for e in self.owned.values()), owners=len(self.owned))
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+shared_frames = SharedFrames()
+atexit.register(shared_frames.release_all)
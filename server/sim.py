@@ -2,36 +2,157 @@
 # from scipy.io import loadmat
 from OMPython import ModelicaSystem  # , OMCSessionZMQ
 import tempfile
-from pandas import DataFrame, Series
+import pandas as pd
+from pandas import DataFrame
 from dataScience import load_json
-import numpy as np
-
-
-def sim(model: str, df: DataFrame):
-    sim = DataFrame()
-    dt = df["timestamp"].diff().mean().microseconds / 1e6
-    with tempfile.NamedTemporaryFile(suffix=".mo") as f:
-        f.write(str.encode(model))
-        f.flush()
-        s = ModelicaSystem(f.name, "Sys")
-        s.buildModel()
-        s.setSimulationOptions(
-            [
-                f"stepSize={dt}",
-            ]
-        )
-        s.simulate()
-    ks = [k for k in list(df.keys()) if k != "timestamp"]
-    vs = s.getSolutions(ks)
-    for i in range(0, len(ks)):
-        v = np.array(vs[i])
-        d = Series(v, np.arange(0, len(v) * dt, dt))
-        sim[ks[i]] = d
-    sim["timestamp"] = np.arange(0, len(vs[0]) * dt, dt)
+from simWindows import Segment, Window, plan, run_segments, step_size, stitch
+from scheduler import slot
+from tracing import span
+from artifactStore import artifact_store
+from typing import Dict, List, Optional
+import os
+import shutil
+import subprocess
+import uuid
+
+# Wall-clock limit for one segment's simulation executable
+SIM_TIMEOUT = float(os.getenv("SIM_TIMEOUT", "600"))
+
+
+class CompiledModel:
+    """
+    A Modelica model built once, whose executable is then run directly for each segment
+    with its own start/stop time, step size, start values and result file. Segments can
+    run concurrently since every run writes a separate CSV.
+    """
+
+    def __init__(self, model: str, name: str = "Sys"):
+        self.workdir = tempfile.mkdtemp(prefix="sim_")
+        path = os.path.join(self.workdir, f"{name}.mo")
+        with open(path, "w") as f:
+            f.write(model)
+        try:
+            with slot("cpu"), span("sim.build"):
+                # Built inside workdir, so close() removes the C sources and executable too
+                self.system = ModelicaSystem(path, name, customBuildDirectory=self.workdir)
+                self.system.buildModel()
+        except BaseException:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            raise
+        self.build_dir = self.system.getWorkDirectory()
+        self.executable = os.path.join(self.build_dir, name + (".exe" if os.name == "nt" else ""))
+        # Only start values and parameters the model lets us change can be overridden
+        self.changeable = {
+            q["name"] for q in self.system.getQuantities() if str(q.get("changeable")).lower() == "true"
+        }
+
+    def run(self, segment: Segment, step: float, columns: List[str]) -> DataFrame:
+        overrides = {
+            "startTime": segment.window.start,
+            "stopTime": segment.window.stop,
+            "stepSize": step,
+            "outputFormat": "csv",
+        }
+        overrides.update({k: v for k, v in segment.initial.items() if k in self.changeable})
+        result = os.path.join(self.workdir, f"result_{uuid.uuid4().hex}.csv")
+        flags = ",".join(f"{k}={v}" for k, v in overrides.items())
+        with slot("cpu"), span("sim.segment", start=segment.window.start, stop=segment.window.stop):
+            subprocess.run(
+                [self.executable, f"-override={flags}", f"-r={result}"],
+                cwd=self.build_dir,
+                check=True,
+                capture_output=True,
+                timeout=SIM_TIMEOUT,
+            )
+        try:
+            out = pd.read_csv(result)
+        finally:
+            if os.path.exists(result):
+                os.remove(result)
+        sim = DataFrame({k: out[k].to_numpy() for k in columns if k in out})
+        sim["timestamp"] = out["time"].to_numpy()
+        return sim
+
+    def simulate(
+        self, df: DataFrame, windows: Optional[List[Window]] = None, parameters: Optional[Dict[str, float]] = None
+    ) -> DataFrame:
+        """
+        Runs the built model over the windows (default: the whole frame), with parameters
+        overriding the model's own values, and stitches the segments into one frame.
+        """
+        dt = step_size(df)
+        ks = [k for k in list(df.keys()) if k != "timestamp"]
+        segments = plan(df, windows)
+        for segment in segments:
+            segment.initial.update(parameters or {})
+        results = run_segments(lambda segment: self.run(segment, dt, ks), segments)
+        return stitch(results, [s.window for s in segments])
+
+    def close(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+        if os.path.abspath(self.build_dir) != os.path.abspath(self.workdir):
+            shutil.rmtree(self.build_dir, ignore_errors=True)
+
+
+def build_fmu(model: str, name: str = "Sys") -> str:
+    """Exports the model as a co-simulation FMU (for realtimeTwin) and returns its path."""
+    workdir = tempfile.mkdtemp(prefix="fmu_")
+    try:
+        path = os.path.join(workdir, f"{name}.mo")
+        with open(path, "w") as f:
+            f.write(model)
+        with slot("cpu"), span("sim.fmu"):
+            system = ModelicaSystem(path, name, customBuildDirectory=workdir)
+            fmu = system.convertMo2Fmu(fmuType="cs")
+        if not fmu or not os.path.exists(fmu):
+            raise RuntimeError(f"OpenModelica did not produce an FMU for {name}")
+        # Copied next to the store first: put_file moves, and /tmp may be another filesystem
+        staged = artifact_store.temp_path("fmu", prefix=f"{name}_")
+        shutil.copyfile(fmu, staged)
+        return artifact_store.put_file(staged, "fmu")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def sim(model: str, df: DataFrame, windows: Optional[List[Window]] = None):
+    """
+    Simulates the model over the windows (default: the whole frame) and returns the
+    results in one frame with the timestamp in seconds from the first measurement.
+    Windows longer than SIM_CHUNK_SECONDS run as parallel segments.
+    """
+    compiled = CompiledModel(model)
+    try:
+        sim = compiled.simulate(df, windows)
+    finally:
+        compiled.close()
     print(sim.keys())
     return False, sim
 
 
+def get_simulator():
+    """
+    Returns the simulate function selected by SIM_BACKEND: "omc" (default, OpenModelica)
+    or "fake" (fakeBackends.FakeSimulator, no OpenModelica install needed).
+    """
+    if os.getenv("SIM_BACKEND", "omc") == "fake":
+        from fakeBackends import fake_simulator
+
+        return fake_simulator
+    return sim
+
+
+def compile_model(model: str):
+    """
+    Builds the model once for repeated simulate(df, windows, parameters) calls (e.g.
+    parameter re-fitting) with the SIM_BACKEND's simulator; close() when done.
+    """
+    if os.getenv("SIM_BACKEND", "omc") == "fake":
+        from fakeBackends import fake_simulator
+
+        return fake_simulator.compile(model)
+    return CompiledModel(model)
+
+
 if __name__ == "__main__":
     _, _, df = load_json("data/2/box-dt.json")
     sim(
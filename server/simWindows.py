@@ -0,0 +1,213 @@
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from dynamicsFeatures import summarize
+from taskExecutor import StreamingExecutor
+from tracing import propagate
+
+# What a simulation covers: "full" (the whole measured span) or "events" (windows around
+# the step events dynamicsFeatures finds); runs can also pass explicit windows
+SIM_WINDOWS = os.getenv("SIM_WINDOWS", "full")
+# Spans longer than this are split into segments that run in parallel
+SIM_CHUNK_SECONDS = float(os.getenv("SIM_CHUNK_SECONDS", "86400"))
+SIM_WORKERS = int(os.getenv("SIM_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Time simulated before and (at least) after each event in "events" mode
+SIM_EVENT_PADDING = float(os.getenv("SIM_EVENT_PADDING", "120"))
+# An event's window extends this many of its time constants past the step
+SETTLING_TIME_CONSTANTS = 5
+
+
+@dataclass
+class Window:
+    """A span to simulate, in seconds from the first measurement."""
+
+    start: float
+    stop: float
+
+    @property
+    def duration(self) -> float:
+        return self.stop - self.start
+
+    def to_list(self) -> List[float]:
+        return [self.start, self.stop]
+
+
+@dataclass
+class Segment:
+    """One simulator call: a window plus start values taken from the measurements."""
+
+    window: Window
+    initial: Dict[str, float] = field(default_factory=dict)
+
+
+def elapsed(df: pd.DataFrame) -> np.ndarray:
+    """The aligned frame's timestamps in seconds from its first row."""
+    t = df["timestamp"]
+    return (t - t.iloc[0]).dt.total_seconds().to_numpy(dtype=np.float64)
+
+
+def step_size(df: pd.DataFrame) -> float:
+    """Mean sample interval in seconds (the simulator's output interval)."""
+    if len(df) < 2:
+        return 1.0
+    return float(df["timestamp"].diff().mean().total_seconds()) or 1.0
+
+
+def merge(windows: Iterable[Window], duration: float) -> List[Window]:
+    """Clips windows to [0, duration], drops empty ones and merges overlaps."""
+    merged: List[Window] = []
+    for w in sorted(windows, key=lambda w: w.start):
+        start, stop = max(0.0, w.start), min(duration, w.stop)
+        if stop <= start:
+            continue
+        if merged and start <= merged[-1].stop:
+            merged[-1].stop = max(merged[-1].stop, stop)
+        else:
+            merged.append(Window(start, stop))
+    return merged
+
+
+def parse_windows(spec: Optional[Sequence[Sequence[float]]], duration: float) -> Optional[List[Window]]:
+    """
+    Windows a client asked for, as [[start, stop], ...] in seconds from the first sample.
+
+    Raises:
+        ValueError: If an entry is not a pair of numbers with start < stop, or none overlap the data.
+    """
+    if spec is None:
+        return None
+    windows = []
+    for entry in spec:
+        try:
+            start, stop = (float(v) for v in entry)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid simulation window {entry!r}; expected [start, stop] in seconds")
+        if not start < stop:
+            raise ValueError(f"Simulation window {entry!r} must have start < stop")
+        windows.append(Window(start, stop))
+    windows = merge(windows, duration)
+    if not windows:
+        raise ValueError("No simulation window overlaps the measured data")
+    return windows
+
+
+def event_windows(summary, duration: float, padding: float = SIM_EVENT_PADDING) -> List[Window]:
+    """
+    Windows around the step events of a dynamicsFeatures.DynamicsSummary, long enough to
+    cover each response's settling. Falls back to the full span when there are no events.
+    """
+    windows = []
+    for column in summary.columns:
+        for step in column.steps:
+            settle = SETTLING_TIME_CONSTANTS * (step.time_constant or 0.0)
+            windows.append(Window(step.time - padding, step.time + max(padding, settle)))
+    return merge(windows, duration) or [Window(0.0, duration)]
+
+
+def choose_windows(dataset, requested=None, mode: str = SIM_WINDOWS) -> List[Window]:
+    """The windows a run simulates: the client's, the event windows, or the whole span."""
+    duration = (dataset.end - dataset.start) / 1e9
+    windows = parse_windows(requested, duration)
+    if windows is not None:
+        return windows
+    if mode == "events":
+        return event_windows(summarize(dataset), duration)
+    return [Window(0.0, duration)]
+
+
+def chunk(windows: Iterable[Window], chunk_seconds: Optional[float] = None) -> List[Window]:
+    """Splits windows longer than chunk_seconds (default SIM_CHUNK_SECONDS) into consecutive pieces."""
+    chunk_seconds = SIM_CHUNK_SECONDS if chunk_seconds is None else chunk_seconds
+    pieces = []
+    for w in windows:
+        count = max(1, int(np.ceil(w.duration / chunk_seconds))) if chunk_seconds > 0 else 1
+        bounds = np.linspace(w.start, w.stop, count + 1)
+        pieces.extend(Window(float(a), float(b)) for a, b in zip(bounds[:-1], bounds[1:]))
+    return pieces
+
+
+def initial_values(df: pd.DataFrame, t: float, times: Optional[np.ndarray] = None) -> Dict[str, float]:
+    """Each measured column's value at t seconds, interpolated between its samples."""
+    times = elapsed(df) if times is None else times
+    values = {}
+    for column in df.columns:
+        if column == "timestamp":
+            continue
+        v = df[column].to_numpy(dtype=np.float64)
+        ok = ~np.isnan(v)
+        if ok.any():
+            values[column] = float(np.interp(t, times[ok], v[ok]))
+    return values
+
+
+def plan(df: pd.DataFrame, windows: Optional[List[Window]] = None, chunk_seconds: Optional[float] = None) -> List[Segment]:
+    """Segments covering the windows (default: the whole frame), each started from the measurements."""
+    times = elapsed(df)
+    windows = windows or [Window(0.0, float(times[-1]) if len(times) else 0.0)]
+    return [Segment(w, initial_values(df, w.start, times)) for w in chunk(windows, chunk_seconds)]
+
+
+def stitch(results: List[pd.DataFrame], windows: List[Window]) -> pd.DataFrame:
+    """
+    Concatenates segment results (timestamp in seconds) into the single frame sim.sim has
+    always returned. Where segments meet, the later segment's first row is dropped.
+    The simulated windows are kept in attrs["windows"] for scoring.
+    """
+    frames = [r for r in results if not r.empty]
+    if not frames:
+        stitched = pd.DataFrame({"timestamp": np.empty(0)})
+    else:
+        stitched = pd.concat(frames, ignore_index=True)
+        stitched = stitched.drop_duplicates("timestamp", keep="first").sort_values("timestamp", ignore_index=True)
+    stitched.attrs["windows"] = [w.to_list() for w in windows]
+    return stitched
+
+
+def in_windows(t: np.ndarray, windows: Optional[List[List[float]]]) -> np.ndarray:
+    """Mask of the times that fall inside any simulated window (all of them if windows is None)."""
+    if not windows:
+        return np.ones(len(t), dtype=bool)
+    mask = np.zeros(len(t), dtype=bool)
+    for start, stop in windows:
+        mask |= (t >= start) & (t <= stop)
+    return mask
+
+
+_executor: Optional[StreamingExecutor] = None
+_executor_pid: Optional[int] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> StreamingExecutor:
+    # A dedicated pool: segments are submitted from pipeline runs that already occupy
+    # the shared executor, so borrowing its threads could starve them
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = StreamingExecutor(max_in_flight=SIM_WORKERS, name="sim")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def backlog() -> Dict[str, int]:
+    """The segment pool's backlog (empty until a chunked simulation has run in this process)."""
+    with _executor_lock:
+        executor = _executor if _executor_pid == os.getpid() else None
+    return executor.backlog() if executor is not None else {"queued": 0, "in_flight": 0, "completed": 0}
+
+
+def run_segments(run: Callable[[Segment], pd.DataFrame], segments: List[Segment]) -> List[pd.DataFrame]:
+    """run(segment) for every segment, SIM_WORKERS at a time; results in segment order."""
+    if len(segments) == 1:
+        return [run(segments[0])]
+    # Each task gets its own copy of the caller's context so its spans carry the run id
+    return list(_get_executor().map(lambda fn, segment: fn(segment), ((propagate(run), s) for s in segments)))
+
+
+def windows_summary(windows: List[Window]) -> Dict[str, Any]:
+    return {"windows": [w.to_list() for w in windows], "simulated_seconds": sum(w.duration for w in windows)}
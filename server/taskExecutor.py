@@ -0,0 +1,268 @@
+import concurrent.futures
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class TaskTimeout(Exception):
+    """Raised (as a TaskResult error) when a task exceeds its per-task timeout."""
+
+
+class TaskCancelled(Exception):
+    """Raised (as a TaskResult error) when a task is cancelled before it finished."""
+
+
+@dataclass
+class TaskResult:
+    index: int
+    args: Tuple[Any, ...]
+    value: Any = None
+    error: Optional[BaseException] = None
+    attempts: int = 0
+    duration: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def unwrap(self) -> Any:
+        """Returns the value, or re-raises the task's exception."""
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+@dataclass
+class _Pending:
+    index: int
+    args: Tuple[Any, ...]
+    timeout: Optional[float] = None
+    # Set by the worker when the task starts running; its deadline counts from there
+    started: Optional[float] = None
+    attempts: List[int] = field(default_factory=lambda: [0])
+    # Set when the caller gave up on the task (timeout, or imap closed), so retries stop
+    cancelled: threading.Event = field(default_factory=threading.Event)
+
+    @property
+    def deadline(self) -> Optional[float]:
+        if self.timeout is None or self.started is None:
+            return None
+        return self.started + self.timeout
+
+
+class StreamingExecutor:
+    """
+    A long-lived thread pool that keeps at most `max_in_flight` tasks running and hands
+    results back as soon as each one finishes, instead of waiting on batch barriers.
+
+    Usage:
+        with StreamingExecutor(max_in_flight=8) as executor:
+            for result in executor.imap(fn, args_list, ordered=False, timeout=60, retries=2):
+                ...
+
+    A task's timeout counts from when a worker starts it, not from when it was queued.
+    Timeouts cannot interrupt a running Python thread, so a timed-out task is reported
+    as TaskTimeout and its slot is handed to the next task while the worker finishes the
+    current attempt in the background; it makes no further retries. The pool is sized
+    with headroom for this.
+    """
+
+    def __init__(
+        self, max_in_flight: int = 8, name: str = "executor", max_workers: Optional[int] = None
+    ):
+        self.max_in_flight = max_in_flight
+        self.name = name
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers or max_in_flight * 2, thread_name_prefix=name
+        )
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+
+    def __enter__(self) -> "StreamingExecutor":
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown(wait=exc[0] is None)
+
+    def submit(
+        self,
+        fn: Callable,
+        *args: Any,
+        retries: int = 0,
+        backoff: float = 0.5,
+    ) -> concurrent.futures.Future:
+        """Submits a single task (with retry) to the shared pool, bypassing the in-flight window."""
+        return self._pool.submit(self._call, fn, retries, backoff, _Pending(0, args))
+
+    def _call(self, fn: Callable, retries: int, backoff: float, task: _Pending) -> Any:
+        task.started = time.monotonic()
+        while True:
+            if self._cancelled.is_set() or task.cancelled.is_set():
+                raise TaskCancelled()
+            task.attempts[0] += 1
+            try:
+                return fn(*task.args)
+            except Exception:
+                if task.attempts[0] > retries or self._cancelled.is_set() or task.cancelled.is_set():
+                    raise
+                # Exponential backoff with full jitter, never sleeping past the deadline
+                delay = random.uniform(0, backoff * 2 ** (task.attempts[0] - 1))
+                if task.deadline is not None:
+                    if time.monotonic() + delay >= task.deadline:
+                        raise TaskTimeout(f"Task {task.index} exceeded {task.timeout}s")
+                # Woken early if the caller gives up on the task
+                if task.cancelled.wait(delay):
+                    raise TaskCancelled()
+
+    def imap(
+        self,
+        fn: Callable,
+        args_list: Iterable[Tuple[Any, ...]],
+        ordered: bool = False,
+        timeout: Optional[float] = None,
+        retries: int = 0,
+        backoff: float = 0.5,
+        max_in_flight: Optional[int] = None,
+    ) -> Iterator[TaskResult]:
+        """
+        Runs fn(*args) for every entry of args_list, keeping up to max_in_flight running.
+
+        Args:
+            fn (Callable): The function to run.
+            args_list (Iterable[Tuple]): Argument tuples; consumed lazily.
+            ordered (bool, optional): Yield in submission order instead of completion order. Defaults to False.
+            timeout (float, optional): Per-task wall-clock limit in seconds, retries included. Defaults to None.
+            retries (int, optional): Extra attempts after an exception. Defaults to 0.
+            backoff (float, optional): Base delay in seconds for exponential backoff. Defaults to 0.5.
+            max_in_flight (int, optional): Window size for this call. Defaults to the executor's.
+
+        Yields:
+            TaskResult: One per task. Failures are reported on TaskResult.error, not raised.
+        """
+        window = max_in_flight or self.max_in_flight
+        source = iter(enumerate(args_list))
+        running: Dict[concurrent.futures.Future, _Pending] = {}
+        finished: Dict[int, TaskResult] = {}
+        next_to_yield = 0
+        exhausted = False
+
+        def fill():
+            nonlocal exhausted
+            while not exhausted and len(running) < window:
+                if self._cancelled.is_set():
+                    exhausted = True
+                    break
+                try:
+                    index, args = next(source)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending = _Pending(index, tuple(args), timeout)
+                future = self._pool.submit(self._call, fn, retries, backoff, pending)
+                running[future] = pending
+                with self._lock:
+                    self.in_flight += 1
+
+        def settle(future, pending: _Pending, error: Optional[BaseException] = None) -> TaskResult:
+            del running[future]
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+            result = TaskResult(
+                index=pending.index,
+                args=pending.args,
+                attempts=pending.attempts[0],
+                duration=time.monotonic() - pending.started if pending.started is not None else 0.0,
+            )
+            if error is not None:
+                result.error = error
+            elif future.cancelled():
+                result.error = TaskCancelled()
+            else:
+                result.error = future.exception()
+                if result.error is None:
+                    result.value = future.result()
+            return result
+
+        try:
+            fill()
+            while running:
+                deadlines = [p.deadline for p in running.values() if p.deadline is not None]
+                wait_for = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+                if timeout and any(p.started is None for p in running.values()):
+                    # A queued task may start any moment; its deadline is at least `timeout` away
+                    wait_for = timeout if wait_for is None else min(wait_for, timeout)
+                done, _ = concurrent.futures.wait(
+                    list(running), timeout=wait_for, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                settled = [settle(future, running[future]) for future in done]
+
+                now = time.monotonic()
+                for future, pending in list(running.items()):
+                    if pending.deadline is not None and now >= pending.deadline:
+                        pending.cancelled.set()
+                        future.cancel()
+                        settled.append(settle(future, pending, TaskTimeout(
+                            f"Task {pending.index} exceeded {timeout}s"
+                        )))
+
+                fill()
+                for result in settled:
+                    if not ordered:
+                        yield result
+                    else:
+                        finished[result.index] = result
+                while ordered and next_to_yield in finished:
+                    yield finished.pop(next_to_yield)
+                    next_to_yield += 1
+        finally:
+            # Generator closed early or cancelled: drop whatever has not started yet and
+            # stop the retries of whatever has
+            for future, pending in running.items():
+                pending.cancelled.set()
+                future.cancel()
+            with self._lock:
+                self.in_flight -= len(running)
+
+    def map(self, fn: Callable, args_list: Iterable[Tuple[Any, ...]], **kwargs) -> Iterator[Any]:
+        """Like imap(ordered=True) but yields plain values and raises the first failure."""
+        for result in self.imap(fn, args_list, ordered=True, **kwargs):
+            yield result.unwrap()
+
+    def backlog(self) -> Dict[str, int]:
+        """Tasks waiting for a worker thread and tasks running in the imap() windows."""
+        return {"queued": self._pool._work_queue.qsize(), "in_flight": self.in_flight, "completed": self.completed}
+
+    def cancel(self):
+        """Stops submitting new tasks and aborts pending retries. Running calls finish."""
+        self._cancelled.set()
+
+    def reset(self):
+        """Clears a previous cancel() so the executor can be reused."""
+        self._cancelled.clear()
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
+
+
+SHARED_POOL_WORKERS = 64
+_shared_executor: Optional[StreamingExecutor] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_executor() -> StreamingExecutor:
+    """
+    Process-wide executor reused across calls so threads are not re-created per batch.
+    Callers pick their own window with imap(max_in_flight=...).
+    """
+    global _shared_executor
+    with _shared_lock:
+        if _shared_executor is None:
+            _shared_executor = StreamingExecutor(
+                max_in_flight=8, name="shared", max_workers=SHARED_POOL_WORKERS
+            )
+        return _shared_executor
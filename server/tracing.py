@@ -0,0 +1,287 @@
+import bisect
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1").lower() not in ("0", "false", "no")
+# Each process writes <TRACE_DIR>/spans-<pid>.jsonl; rotating one file from several
+# gunicorn workers would race
+TRACE_DIR = os.getenv("TRACE_DIR", os.path.join(BASE_DIR, "traces"))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(20 * 2**20)))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "3"))
+
+# Latency histogram bucket upper bounds in milliseconds (the last bucket is unbounded)
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000)
+
+# Attributes (run_id, machine, ...) attached to every span opened in this context
+_attributes: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("trace_attributes", default={})
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("trace_span", default=None)
+# Span ids are a random per-process prefix plus a counter; uuid4 per span costs more than the span
+_id_prefix = uuid.uuid4().hex[:8]
+_ids = itertools.count(1)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; quantiles are bucket upper bounds."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms: float, error: bool = False):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.errors += error
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS + (self.max,), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(self.total / self.count, 3) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max, 3),
+            "buckets": {
+                **{f"le_{bound:g}": count for bound, count in zip(BUCKETS_MS, self.counts)},
+                "inf": self.counts[-1],
+            },
+        }
+
+
+class Span:
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]):
+        parent = _current.get()
+        self.tracer = tracer
+        self.name = name
+        self.attributes = {**_attributes.get(), **attributes}
+        self.span_id = f"{_id_prefix}{next(_ids):08x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self.error: Optional[str] = None
+        self._token = _current.set(self)
+
+    def set(self, **attributes):
+        """Adds attributes known only once the stage has run (token counts, sizes, ...)."""
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None):
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Ended from another context (e.g. a Flask teardown); nothing to restore
+            pass
+        self.tracer.record(self, duration_ms)
+
+
+class Tracer:
+    """
+    Spans around pipeline stages, aggregated into per-stage latency histograms and
+    appended to a rotating JSON-lines trace file.
+
+    A span costs about 10us (5us with the trace file off): serialization and the file
+    write happen on a listener thread, the caller only enqueues the record.
+
+    Metrics are per process; under gunicorn each worker reports its own (the response
+    carries the pid).
+    """
+
+    def __init__(self, enabled: bool = TRACE_ENABLED, directory: str = TRACE_DIR):
+        self.enabled = enabled
+        self.directory = directory
+        self.histograms: Dict[str, Histogram] = {}
+        self.gauges: Dict[str, Callable[[], Any]] = {}
+        self.caches: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self._queue: Optional["queue.Queue[Dict[str, Any]]"] = None
+        self._listener: Optional[logging.handlers.QueueListener] = None
+        self._pid: Optional[int] = None
+
+    # ===== Spans =====
+
+    def start(self, name: str, **attributes) -> Span:
+        """Opens a span that the caller must end(); prefer span() where a block fits."""
+        return Span(self, name, attributes)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        span = Span(self, name, attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(e)
+            raise
+        span.end()
+
+    def traced(self, name: str) -> Callable:
+        """Decorator form of span() for a whole function."""
+
+        def decorate(fn: Callable) -> Callable:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorate
+
+    def record(self, span: Span, duration_ms: float):
+        with self.lock:
+            histogram = self.histograms.get(span.name)
+            if histogram is None:
+                histogram = self.histograms[span.name] = Histogram()
+            histogram.observe(duration_ms, span.error is not None)
+        if self.enabled:
+            self._write({
+                "name": span.name,
+                "trace_id": span.trace_id,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "start": round(span.start, 6),
+                "duration_ms": round(duration_ms, 3),
+                "error": span.error,
+                "pid": os.getpid(),
+                "thread": threading.current_thread().name,
+                **span.attributes,
+            })
+
+    def _write(self, record: Dict[str, Any]):
+        if self._pid != os.getpid():
+            self._open()
+        # Serialized on the listener thread, off the traced code's path
+        self._queue.put_nowait(record)
+
+    def _open(self):
+        global _id_prefix
+        # One listener thread per process; after a fork the child starts its own
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                os.path.join(self.directory, f"spans-{os.getpid()}.jsonl"),
+                maxBytes=TRACE_MAX_BYTES,
+                backupCount=TRACE_BACKUPS,
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._queue = queue.Queue(-1)
+            self._listener = _LineListener(self._queue, handler)
+            self._listener.start()
+            self._pid = os.getpid()
+            _id_prefix = uuid.uuid4().hex[:8]
+
+    # ===== Metrics =====
+
+    def register_gauge(self, name: str, fn: Callable[[], Any]):
+        """Reports fn() under "queues" in metrics(), e.g. an executor's backlog."""
+        self.gauges[name] = fn
+
+    def register_cache(self, name: str, fn: Callable[[], Dict[str, Any]]):
+        """Reports a cache's stats() (with hits/misses) and its hit rate in metrics()."""
+        self.caches[name] = fn
+
+    def metrics(self) -> Dict[str, Any]:
+        with self.lock:
+            stages = {name: h.snapshot() for name, h in sorted(self.histograms.items())}
+        caches = {}
+        for name, fn in self.caches.items():
+            stats = dict(_safe(fn) or {})
+            lookups = stats.get("hits", 0) + stats.get("misses", 0)
+            if "hits" in stats:
+                stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+            caches[name] = stats
+        return {
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "stages": stages,
+            "queues": {name: _safe(fn) for name, fn in self.gauges.items()},
+            "caches": caches,
+        }
+
+
+class _LineListener(logging.handlers.QueueListener):
+    """QueueListener for span dicts instead of LogRecords."""
+
+    def handle(self, span: Dict[str, Any]):
+        line = json.dumps(span, default=str)
+        record = logging.LogRecord("trace", logging.INFO, "", 0, line, None, None)
+        for handler in self.handlers:
+            handler.handle(record)
+
+
+def _safe(fn: Callable[[], Any]) -> Any:
+    try:
+        return fn()
+    except Exception as e:
+        return {"error": str(e)}
+
+
+tracer = Tracer()
+
+
+def span(name: str, **attributes):
+    """tracer.span(); `with span("render", machine=name) as s: ... s.set(bytes=n)`."""
+    return tracer.span(name, **attributes)
+
+
+def traced(name: str) -> Callable:
+    return tracer.traced(name)
+
+
+@contextmanager
+def bind(**attributes) -> Iterator[None]:
+    """Attaches attributes (run_id, machine, ...) to every span opened inside the block."""
+    token = _attributes.set({**_attributes.get(), **attributes})
+    try:
+        yield
+    finally:
+        _attributes.reset(token)
+
+
+def current_attributes() -> Dict[str, Any]:
+    """Attributes bound in the current context (run_id, machine, priority, ...)."""
+    return _attributes.get()
+
+
+def annotate(**attributes):
+    """Adds attributes for the rest of the enclosing bind() block (e.g. once the machine is known)."""
+    _attributes.set({**_attributes.get(), **attributes})
+
+
+def propagate(fn: Callable) -> Callable:
+    """Wraps fn to run in a copy of the caller's trace context, for handing to a thread pool."""
+    return functools.partial(contextvars.copy_context().run, fn)
@@ -0,0 +1,259 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pydanticModels import APIUsage
+
+DIR = os.path.dirname(os.path.realpath(__file__))
+USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", os.path.join(DIR, "usage.db"))
+
+FLUSH_INTERVAL_SECONDS = 2.0
+MAX_BATCH_SIZE = 500
+
+COLUMN_TYPES = {
+    "response_id": "TEXT PRIMARY KEY",
+    "session_id": "TEXT",
+    "machine_name": "TEXT",
+    "user_name": "TEXT",
+    "calling_function": "TEXT",
+    "vendor": "TEXT",
+    "model": "TEXT",
+    "input_tokens": "INTEGER",
+    "rag_tokens": "INTEGER",
+    "output_tokens": "INTEGER",
+    "total_tokens": "INTEGER",
+    "cache_creation_input_tokens": "INTEGER",
+    "cache_read_input_tokens": "INTEGER",
+    "input_cost": "REAL",
+    "rag_cost": "REAL",
+    "output_cost": "REAL",
+    "total_cost": "REAL",
+    "request_status": "INTEGER",
+    "error_message": "TEXT",
+    "duration": "REAL",
+    "api_key_name": "TEXT",
+    "timestamp": "TEXT",
+}
+COLUMNS = list(COLUMN_TYPES)
+
+GROUP_BY_COLUMNS = {
+    "model": "vendor, model",
+    "machine": "machine_name",
+    "session": "session_id",
+    "function": "calling_function",
+    "day": "substr(timestamp, 1, 10) AS day",
+}
+
+_queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+_writer: Optional[threading.Thread] = None
+_writer_pid: Optional[int] = None
+_writer_lock = threading.Lock()
+_local = threading.local()
+# Cost of this process's queued records not written yet, per machine (see machine_spent)
+_pending_cost: Dict[str, float] = {}
+_pending_lock = threading.Lock()
+_MACHINE = COLUMNS.index("machine_name")
+_COST = COLUMNS.index("total_cost")
+
+
+def connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(USAGE_DB_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS api_usage ("
+        + ", ".join(f"{name} {sql_type}" for name, sql_type in COLUMN_TYPES.items())
+        + ")"
+    )
+    # Add columns introduced after the table was first created
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(api_usage)")}
+    for name, sql_type in COLUMN_TYPES.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE api_usage ADD COLUMN {name} {sql_type}")
+    conn.execute("CREATE INDEX IF NOT EXISTS api_usage_session ON api_usage (session_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS api_usage_machine ON api_usage (machine_name)")
+    return conn
+
+
+def _reader() -> sqlite3.Connection:
+    # One read connection per thread (and per process after a fork), set up once
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    _local.conn = connect()
+    _local.pid = os.getpid()
+    return _local.conn
+
+
+def _writer_loop():
+    conn = connect()
+    stopping = False
+    while not stopping:
+        batch = []
+        try:
+            item = _queue.get(timeout=FLUSH_INTERVAL_SECONDS)
+            batch.append(item)
+            while len(batch) < MAX_BATCH_SIZE:
+                batch.append(_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if None in batch:
+            stopping = True
+        rows = [row for row in batch if row is not None]
+        if rows:
+            try:
+                with conn:
+                    conn.executemany(
+                        f"INSERT OR REPLACE INTO api_usage ({', '.join(COLUMNS)}) "
+                        f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                        rows,
+                    )
+            except sqlite3.Error as e:
+                print(f"Error writing {len(rows)} usage records: {e}")
+            _settle(rows)
+        for _ in batch:
+            _queue.task_done()
+    conn.close()
+
+
+def _settle(rows: List[tuple]):
+    with _pending_lock:
+        for row in rows:
+            machine = row[_MACHINE]
+            if machine in _pending_cost:
+                left = _pending_cost[machine] - (row[_COST] or 0.0)
+                if left > 1e-12:
+                    _pending_cost[machine] = left
+                else:
+                    del _pending_cost[machine]
+
+
+def _ensure_writer():
+    global _writer, _writer_pid
+    # Re-create the writer after a fork; threads don't survive into the child
+    if _writer is not None and _writer_pid == os.getpid() and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or _writer_pid != os.getpid() or not _writer.is_alive():
+            _writer = threading.Thread(target=_writer_loop, name="usage-writer", daemon=True)
+            _writer_pid = os.getpid()
+            _writer.start()
+
+
+def record_usage(usage: APIUsage, user: str):
+    """Queues a usage record for a batched insert by the background writer."""
+    _ensure_writer()
+    row = usage.model_dump()
+    row["user_name"] = user
+    row["timestamp"] = (usage.timestamp or datetime.now()).isoformat()
+    if row.get("machine_name") is not None and row.get("total_cost"):
+        with _pending_lock:
+            _pending_cost[row["machine_name"]] = _pending_cost.get(row["machine_name"], 0.0) + row["total_cost"]
+    _queue.put(tuple(row.get(c) for c in COLUMNS))
+
+
+def flush():
+    """Blocks until every queued record has been written."""
+    if _writer is not None and _writer_pid == os.getpid():
+        _queue.join()
+
+
+@atexit.register
+def _shutdown():
+    if _writer is not None and _writer_pid == os.getpid() and _writer.is_alive():
+        _queue.put(None)
+        _writer.join(timeout=10)
+
+
+def spent(session_id: Optional[str] = None, machine_name: Optional[str] = None) -> float:
+    """Total recorded cost in USD for a session (run) and/or machine."""
+    flush()
+    clauses, values = [], []
+    if session_id is not None:
+        clauses.append("session_id = ?")
+        values.append(session_id)
+    if machine_name is not None:
+        clauses.append("machine_name = ?")
+        values.append(machine_name)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    (total,) = _reader().execute(
+        f"SELECT COALESCE(SUM(total_cost), 0) FROM api_usage {where}", values
+    ).fetchone()
+    return total
+
+
+def machine_spent(machine_name: str) -> float:
+    """
+    spent() for one machine without waiting for the writer: what is written (by every
+    process) plus this process's records still queued.
+    """
+    # Pending first: a batch written in between is then counted twice rather than missed
+    with _pending_lock:
+        pending = _pending_cost.get(machine_name, 0.0)
+    (total,) = _reader().execute(
+        "SELECT COALESCE(SUM(total_cost), 0) FROM api_usage WHERE machine_name = ?", (machine_name,)
+    ).fetchone()
+    return total + pending
+
+
+def aggregate(
+    group_by: str = "model",
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    machine_name: Optional[str] = None,
+    session_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Sums tokens and cost over the usage store.
+
+    Args:
+        group_by (str, optional): One of model, machine, session, function, day. Defaults to "model".
+        since (str, optional): ISO timestamp lower bound (inclusive).
+        until (str, optional): ISO timestamp upper bound (exclusive).
+        machine_name (str, optional): Only this machine.
+        session_id (str, optional): Only this run.
+
+    Raises:
+        ValueError: If group_by is not supported.
+
+    Returns:
+        List[Dict[str, Any]]: One row per group, most expensive first.
+    """
+    if group_by not in GROUP_BY_COLUMNS:
+        raise ValueError(f"group_by must be one of {sorted(GROUP_BY_COLUMNS)}")
+    group_expr = GROUP_BY_COLUMNS[group_by]
+    group_key = group_expr.split(" AS ")[-1]
+    clauses, values = [], []
+    for clause, value in (
+        ("timestamp >= ?", since),
+        ("timestamp < ?", until),
+        ("machine_name = ?", machine_name),
+        ("session_id = ?", session_id),
+    ):
+        if value is not None:
+            clauses.append(clause)
+            values.append(value)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    flush()
+    cursor = _reader().cursor()
+    cursor.row_factory = sqlite3.Row
+    rows = cursor.execute(
+        f"""SELECT {group_expr},
+                COUNT(*) AS requests,
+                SUM(CASE WHEN request_status = 200 THEN 0 ELSE 1 END) AS errors,
+                COALESCE(SUM(input_tokens), 0) AS input_tokens,
+                COALESCE(SUM(output_tokens), 0) AS output_tokens,
+                COALESCE(SUM(cache_read_input_tokens), 0) AS cache_read_input_tokens,
+                COALESCE(SUM(cache_creation_input_tokens), 0) AS cache_creation_input_tokens,
+                COALESCE(SUM(total_cost), 0) AS total_cost,
+                AVG(duration) AS avg_duration
+            FROM api_usage {where}
+            GROUP BY {group_key}
+            ORDER BY total_cost DESC""",
+        values,
+    ).fetchall()
+    return [dict(row) for row in rows]
@@ -1,6 +1,5 @@
 import tiktoken
 import os
-import concurrent.futures
 from typing import Optional, List, Any, Callable, Tuple, Type, Union
 from openai import OpenAI
 from anthropic import Anthropic
@@ -9,9 +8,13 @@ from pydantic import BaseModel
 from pydanticModels import APIParameters, ChatMessage, APIUsage, Content
 from datetime import datetime
 import time
-import math
 from dotenv import load_dotenv
 import uuid
+from rateLimiter import get_rate_limiter, estimate_tokens, parse_retry_after
+from taskExecutor import get_shared_executor
+from fakeBackends import create_chat_completion_fake, record_response
+from scheduler import slot
+from tracing import span
 
 DIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -53,6 +56,12 @@ def convert_to_messages(
         elif isinstance(image_content, dict):
             content_obj = Content(**image_content)
             messages.append(ChatMessage(role="user", content=[content_obj]))
+        # A list of images goes into one user message, in order
+        elif isinstance(image_content, list):
+            content_objs = [
+                c if isinstance(c, Content) else Content(**c) for c in image_content
+            ]
+            messages.append(ChatMessage(role="user", content=content_objs))
 
     messages.append(ChatMessage(role="user", content=user))
     return messages
@@ -75,14 +84,44 @@ def create_chat_completion(
     Returns:
         Tuple[str, APIUsage]: The chat completion response and usage data.
     """
-    if params.vendor.lower() == "openai":
-        response_tuple = create_chat_completion_openai(params)
-    elif "instructor/" in params.vendor.lower():
-        response_tuple = create_chat_completion_instructor(params)
-    elif params.vendor.lower() == "anthropic":
-        response_tuple = create_chat_completetion_anthropic(params)
-    else:
-        raise ValueError("Unsupported vendor")
+    # Reserve request/token capacity against the model's RPM/TPM before calling out
+    limiter = get_rate_limiter(params.vendor, params.model)
+    estimated_tokens = estimate_tokens(params)
+    if limiter is not None:
+        with span("llm.rate_limit", vendor=params.vendor, model=params.model):
+            limiter.acquire(estimated_tokens)
+
+    with slot("llm"), span("llm", vendor=params.vendor, model=params.model, estimated_tokens=estimated_tokens) as s:
+        if params.vendor.lower() == "openai":
+            response_tuple = create_chat_completion_openai(params)
+        elif "instructor/" in params.vendor.lower():
+            response_tuple = create_chat_completion_instructor(params)
+        elif params.vendor.lower() == "anthropic":
+            response_tuple = create_chat_completetion_anthropic(params)
+        elif params.vendor.lower() == "fake":
+            response_tuple = create_chat_completion_fake(params)
+        else:
+            raise ValueError("Unsupported vendor")
+        s.set(
+            status=response_tuple[1].request_status,
+            input_tokens=response_tuple[1].input_tokens,
+            output_tokens=response_tuple[1].output_tokens,
+        )
+
+    if params.vendor.lower() != "fake" and isinstance(response_tuple[0], str):
+        record_response(response_tuple[0])
+
+    response_tuple[1].session_id = params.session_id
+    response_tuple[1].machine_name = params.machine_name
+
+    if limiter is not None:
+        usage = response_tuple[1]
+        if usage.request_status == 429:
+            limiter.record_rate_limit(usage.retry_after)
+        else:
+            limiter.reconcile(estimated_tokens, usage.total_tokens)
+            if usage.request_status == 200:
+                limiter.record_success()
 
     if insert_usage:
         if user is None:
@@ -91,6 +130,12 @@ def create_chat_completion(
     return response_tuple
 
 
+def _retry_after(error: Exception) -> Optional[float]:
+    """The retry-after of a vendor SDK's 429 error, from its HTTP response headers."""
+    response = getattr(error, "response", None)
+    return parse_retry_after(getattr(response, "headers", None))
+
+
 def create_chat_completion_openai(params: APIParameters) -> Tuple[str, APIUsage]:
     """
     Calls the OpenAI ChatCompletion API and returns the completion message and usage data.
@@ -123,6 +168,7 @@ def create_chat_completion_openai(params: APIParameters) -> Tuple[str, APIUsage]
         status = 200
         response_id = completion.id
         error_message = None
+        retry_after = None
         duration = time.time() - start
         content: str = completion.choices[0].message.content
 
@@ -134,8 +180,9 @@ def create_chat_completion_openai(params: APIParameters) -> Tuple[str, APIUsage]
 
     except Exception as error:
         print(f"Error: {error}")
-        status = 400
+        status = getattr(error, "status_code", 400)
         error_message = str(error)
+        retry_after = _retry_after(error)
         duration = None
         content = None
         input_tokens, output_tokens, total_tokens = None, None, None
@@ -150,6 +197,7 @@ def create_chat_completion_openai(params: APIParameters) -> Tuple[str, APIUsage]
         total_tokens=total_tokens,
         request_status=status,
         error_message=error_message,
+        retry_after=retry_after,
         calling_function=params.calling_function,
         timestamp=datetime.now(),
         duration=duration,
@@ -181,10 +229,29 @@ def create_chat_completetion_anthropic(params: APIParameters) -> Tuple[str, APIU
         real_messages = []
 
         for msg in params.messages:
-            real_messages.append(msg.model_dump())
+            real_messages.append(msg.model_dump(exclude_none=True))
         # real_messages.append({"role": "assistant", "content": "{"})
 
-        completion = anthropic_client.messages.create(
+        if params.prompt_caching:
+            # Cache breakpoint after the system prompt; content blocks carry their own
+            if system is not None:
+                system = [
+                    {
+                        "type": "text",
+                        "text": system,
+                        "cache_control": {"type": "ephemeral"},
+                    }
+                ]
+            create = anthropic_client.beta.prompt_caching.messages.create
+        else:
+            for msg in real_messages:
+                if isinstance(msg["content"], list):
+                    for block in msg["content"]:
+                        if isinstance(block, dict):
+                            block.pop("cache_control", None)
+            create = anthropic_client.messages.create
+
+        completion = create(
             model=params.model,
             system=system,
             max_tokens=params.max_tokens,
@@ -200,10 +267,18 @@ def create_chat_completetion_anthropic(params: APIParameters) -> Tuple[str, APIU
         print(usage)
         input_tokens = usage.input_tokens
         output_tokens = usage.output_tokens
-        total_tokens = input_tokens + output_tokens
+        cache_creation_input_tokens = getattr(usage, "cache_creation_input_tokens", None)
+        cache_read_input_tokens = getattr(usage, "cache_read_input_tokens", None)
+        total_tokens = (
+            input_tokens
+            + (cache_creation_input_tokens or 0)
+            + (cache_read_input_tokens or 0)
+            + output_tokens
+        )
 
         status = 200
         error_message = None
+        retry_after = None
         duration = time.time() - start
         content = completion.content
         # print(content)
@@ -212,13 +287,15 @@ def create_chat_completetion_anthropic(params: APIParameters) -> Tuple[str, APIU
         response_id = completion.id
 
     except Exception as error:
-        status = 400
+        status = getattr(error, "status_code", 400)
         error_message = str(error)
+        retry_after = _retry_after(error)
         print(f"Error: {error}")
         duration = None
         content = None
         response_id = f"ERROR-{str(uuid.uuid4())}"
         input_tokens, output_tokens, total_tokens = None, None, None
+        cache_creation_input_tokens, cache_read_input_tokens = None, None
 
     usage = APIUsage(
         model=params.model,
@@ -227,8 +304,11 @@ def create_chat_completetion_anthropic(params: APIParameters) -> Tuple[str, APIU
         input_tokens=input_tokens,
         output_tokens=output_tokens,
         total_tokens=total_tokens,
+        cache_creation_input_tokens=cache_creation_input_tokens,
+        cache_read_input_tokens=cache_read_input_tokens,
         request_status=status,
         error_message=error_message,
+        retry_after=retry_after,
         calling_function=params.calling_function,
         timestamp=datetime.now(),
         duration=duration,
@@ -279,7 +359,7 @@ def create_chat_completion_instructor(
             real_messages = []
 
             for msg in params.messages:
-                real_messages.append(msg.model_dump())
+                real_messages.append(msg.model_dump(exclude_none=True))
 
             completion: Type[BaseModel] = instructor_anthropic_client.messages.create(
                 model=params.model,
@@ -369,31 +449,44 @@ def run_concurrently(
     args_list: List[Any],
     batch_size: int,
     wait_time: Optional[int] = None,
+    timeout: Optional[float] = None,
+    retries: int = 0,
 ):
     """
-    Concurrently runs a function with a list of arguments in batches.
+    Concurrently runs a function with a list of arguments, keeping batch_size calls in flight.
+    A slow call only holds its own slot; the next argument starts as soon as any call finishes.
     Args:
         main_func (Callable): The function to run.
         args_list (List[Any]): The list of arguments to use for the function.
-        batch_size (int): The number of arguments to include in each batch.
+        batch_size (int): The maximum number of calls running at once.
+        wait_time (int, optional): Pause submissions for this many seconds after every batch_size calls.
+        timeout (float, optional): Per-call timeout in seconds.
+        retries (int, optional): Retries with exponential backoff for calls that raise.
     Returns:
-        List[Any]: The results of the function calls.
+        List[Any]: The results of the function calls, in the order of args_list.
     """
-    total_batches = math.ceil(len(args_list) / batch_size)
     print(
-        f"=== Running {main_func.__name__} for {total_batches} batches of {batch_size} ==="
+        f"=== Running {main_func.__name__} for {len(args_list)} calls, {batch_size} in flight ==="
     )
+
+    def paced_args():
+        for i, args in enumerate(args_list):
+            if wait_time and i and i % batch_size == 0:
+                time.sleep(wait_time)
+            yield args
+
     results = []
-    for i in range(0, len(args_list), batch_size):
-        batch = args_list[i : i + batch_size]
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(main_func, *args) for args in batch]
-        results.extend([future.result() for future in futures])
-        print(
-            f"=== Batch {int((i+batch_size)/batch_size)}/{total_batches} completed ==="
-        )
-        if wait_time:
-            time.sleep(wait_time)
+    for result in get_shared_executor().imap(
+        main_func,
+        paced_args(),
+        ordered=True,
+        timeout=timeout,
+        retries=retries,
+        max_in_flight=batch_size,
+    ):
+        results.append(result.unwrap())
+        if len(results) % batch_size == 0 or len(results) == len(args_list):
+            print(f"=== {len(results)}/{len(args_list)} completed ===")
 
     return results
 
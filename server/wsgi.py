@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Production entry point. Imports everything heavy up front so a pre-forking server
+(gunicorn --preload, see gunicorn.conf.py) pays the cost once in the master and the
+workers start warm via copy-on-write.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy  # noqa: F401
+import pandas  # noqa: F401
+
+from dataScience import set_plot_style
+from app import app  # noqa: F401
+
+
+def warm_up():
+    # Builds matplotlib's font cache and seaborn style once, before workers fork
+    set_plot_style()
+    fig, ax = plt.subplots(figsize=(1, 1), dpi=10)
+    ax.plot([0, 1], [0, 1])
+    ax.set_title("warm")
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+warm_up()